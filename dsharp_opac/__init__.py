@@ -1,6 +1,6 @@
 from .bhmie_python import bhmie_python
 try:
-    from .bhmie_fortran import bhmie_fortran
+    from .bhmie_fortran import bhmie_fortran, bhcoat_fortran
 except ImportError:
     print('fortran mie routines unavailable')
 
@@ -8,6 +8,18 @@ __version__ = '1.1.6'
 
 from .dsharp_opac import \
     progress_bar, \
+    bhmie_plan, \
+    bhmie_numpy, \
+    bhmie_warmup, \
+    bhmie_backends, \
+    bhmie_benchmark, \
+    bhmie_select, \
+    bhmie_info, \
+    MieCache, \
+    mie_cache, \
+    bhmie_geometric, \
+    bhmie_rayleigh, \
+    rayleigh_error, \
     diel_const, \
     diel_from_lnk_file, \
     diel_henning, \
@@ -37,7 +49,9 @@ from .dsharp_opac import \
     compare_nk, \
     get_ricci_mix, \
     get_dsharp_mix, \
+    get_dsharp_opacities, \
     get_opacities, \
+    extend_opacities, \
     size_average_opacity, \
     get_smooth_opacities, \
     distribution, \
@@ -48,7 +62,20 @@ from .dsharp_opac import \
 __all__ = [
     'bhmie_python',
     'bhmie_fortran',
+    'bhcoat_fortran',
     'progress_bar',
+    'bhmie_plan',
+    'bhmie_numpy',
+    'bhmie_warmup',
+    'bhmie_backends',
+    'bhmie_benchmark',
+    'bhmie_select',
+    'bhmie_info',
+    'MieCache',
+    'mie_cache',
+    'bhmie_geometric',
+    'bhmie_rayleigh',
+    'rayleigh_error',
     'diel_const',
     'diel_from_lnk_file',
     'diel_henning',
@@ -79,7 +106,9 @@ __all__ = [
     'compare_nk',
     'get_ricci_mix',
     'get_dsharp_mix',
+    'get_dsharp_opacities',
     'get_opacities',
+    'extend_opacities',
     'size_average_opacity',
     'distribution',
     'get_B11_fit',
@@ -11,6 +11,9 @@ SUBROUTINE BHMIE_FORTRAN(X,REFREL,NANG,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
 
   ! Arguments:
 
+  ! release the GIL when called from python, this routine has no shared state
+  !f2py threadsafe
+
   INTEGER, INTENT(IN) :: NANG
   REAL, INTENT(OUT) :: GSCA,QBACK,QEXT,QABS,QSCA
   REAL, INTENT(IN) :: X
@@ -19,20 +22,9 @@ SUBROUTINE BHMIE_FORTRAN(X,REFREL,NANG,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
 
   ! Local variables:
 
-  LOGICAL SINGLE
-  INTEGER J,JJ,N,NSTOP,NMX,NN
-  DOUBLE PRECISION CHI,CHI0,CHI1,DANG,DX,EN,FN,P,PII,PSI,PSI0,PSI1, &
-       &                 THETA,XSTOP,YMOD
-  DOUBLE PRECISION ::                                                        &
-       &   AMU(NANG),                                                        &
-       &   PI(NANG),                                                         &
-       &   PI0(NANG),                                                        &
-       &   PI1(NANG),                                                        &
-       &   TAU(NANG)
-
-   DOUBLE COMPLEX ::                                                         &
-       &   DCXS1(2*NANG-1),                                                  &
-       &   DCXS2(2*NANG-1)
+  INTEGER BHMIE_NMX
+  DOUBLE PRECISION AMU(NANG)
+  DOUBLE COMPLEX, allocatable :: D(:)
 
   !***********************************************************************
   !
@@ -128,6 +120,122 @@ SUBROUTINE BHMIE_FORTRAN(X,REFREL,NANG,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
   ! end history
   !
   !***********************************************************************
+  !
+  ! The series expansion itself is done in BHMIE_FORTRAN_CORE, which works on
+  ! the angle grid and the memory for the logarithmic derivatives set up here.
+  ! BHMIE_FORTRAN_BATCH sets them up only once for many particles.
+  !
+  !***********************************************************************
+  !*** Safety checks
+
+  IF (NANG.LT.2) THEN
+     WRITE(*,*) '***Error: NANG must be >=2'
+     STOP
+  ENDIF
+
+  ! allocation part
+  NMXX=BHMIE_NMX(X,REFREL)
+  allocate(D(NMXX))
+
+  CALL BHMIE_FORTRAN_ANGLES(NANG,AMU)
+  CALL BHMIE_FORTRAN_CORE(X,REFREL,NANG,AMU,NMXX,D,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
+
+  RETURN
+END SUBROUTINE BHMIE_FORTRAN
+
+
+INTEGER FUNCTION BHMIE_NMX(X,REFREL)
+  IMPLICIT NONE
+
+  ! Returns the index NMX from which the logarithmic derivatives are
+  ! calculated by downward recurrence in BHMIE_FORTRAN_CORE, i.e. the
+  ! minimum length of its workspace D.
+
+  !f2py threadsafe
+
+  REAL, INTENT(IN) :: X
+  COMPLEX, INTENT(IN) :: REFREL
+
+  DOUBLE PRECISION XSTOP,YMOD
+  DOUBLE COMPLEX DREFRL
+
+  DREFRL=REFREL
+  YMOD=ABS(X*DREFRL)
+  XSTOP=X+4.*X**0.3333+2.
+  BHMIE_NMX=NINT(MAX(XSTOP,YMOD))+15
+
+  RETURN
+END FUNCTION BHMIE_NMX
+
+
+SUBROUTINE BHMIE_FORTRAN_ANGLES(NANG,AMU)
+  IMPLICIT NONE
+
+  ! Computes the cosines AMU of the NANG angles between 0 and 90 degree
+  ! used by BHMIE_FORTRAN_CORE.
+
+  !f2py threadsafe
+
+  INTEGER, INTENT(IN) :: NANG
+  DOUBLE PRECISION, INTENT(OUT) :: AMU(NANG)
+
+  INTEGER J
+  DOUBLE PRECISION DANG,PII,THETA
+
+  !*** Obtain pi:
+
+  PII=4.D0*ATAN(1.D0)
+
+  !*** Require NANG.GE.1 in order to calculate scattering intensities
+
+  DANG=0.
+  IF(NANG.GT.1)DANG=.5*PII/DBLE(NANG-1)
+  DO J=1,NANG
+     THETA=DBLE(J-1)*DANG
+     AMU(J)=COS(THETA)
+  ENDDO
+
+  RETURN
+END SUBROUTINE BHMIE_FORTRAN_ANGLES
+
+
+SUBROUTINE BHMIE_FORTRAN_CORE(X,REFREL,NANG,AMU,NMXX,D,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
+  IMPLICIT NONE
+
+  ! Series expansion of BHMIE_FORTRAN on preallocated memory:
+  !    AMU(NANG) = cosines of the angles, see BHMIE_FORTRAN_ANGLES
+  !    D(NMXX) = workspace for the logarithmic derivatives,
+  !              NMXX needs to be at least BHMIE_NMX(X,REFREL)
+  ! All other arguments are as in BHMIE_FORTRAN. Nothing is allocated here.
+  ! With NANG=0 no scattering amplitudes are calculated, QEXT and QBACK
+  ! are then obtained from the sums over the Mie coefficients.
+
+  !f2py threadsafe
+
+  INTEGER, INTENT(IN) :: NANG,NMXX
+  REAL, INTENT(OUT) :: GSCA,QBACK,QEXT,QABS,QSCA
+  REAL, INTENT(IN) :: X
+  COMPLEX, INTENT(IN) :: REFREL
+  DOUBLE PRECISION, INTENT(IN) :: AMU(NANG)
+  DOUBLE COMPLEX, INTENT(INOUT) :: D(NMXX)
+  COMPLEX, INTENT(OUT) :: S1(2*NANG-1),S2(2*NANG-1)
+
+  ! Local variables:
+
+  LOGICAL SINGLE
+  INTEGER J,JJ,N,NSTOP,NMX,NN
+  DOUBLE PRECISION CHI,CHI0,CHI1,DX,EN,FN,P,PSI,PSI0,PSI1, &
+       &                 XSTOP,YMOD
+  DOUBLE PRECISION ::                                                        &
+       &   PI(NANG),                                                         &
+       &   PI0(NANG),                                                        &
+       &   PI1(NANG),                                                        &
+       &   TAU(NANG)
+
+   DOUBLE COMPLEX ::                                                         &
+       &   DCXS1(2*NANG-1),                                                  &
+       &   DCXS2(2*NANG-1)
+
   !
   ! This module is dependent on whether compiler supports double precision
   ! complex variables:
@@ -136,13 +244,16 @@ SUBROUTINE BHMIE_FORTRAN(X,REFREL,NANG,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
   ! three lines, and uncomment corresponding 3 lines further below
   !
   DOUBLE COMPLEX AN,AN1,BN,BN1,DREFRL,XI,XI1,Y
-  DOUBLE COMPLEX, allocatable :: D(:)
   PARAMETER(SINGLE=.FALSE.)
 
   !      COMPLEX AN,AN1,BN,BN1,DREFRL,XI,XI1,Y
   !      COMPLEX D(NMXX)
   !      PARAMETER(SINGLE=.TRUE.)
 
+  ! forward and backward sums used if NANG=0
+
+  DOUBLE COMPLEX SFWD,SBCK
+
   !**********************************************************************
 
   ! Following five statements should be enabled if NOT using g77.
@@ -165,14 +276,6 @@ SUBROUTINE BHMIE_FORTRAN(X,REFREL,NANG,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
 
   IF(SINGLE)WRITE(0,*)'Warning: this version of bhmie uses only ',  &
        &          'single precision complex numbers!'
-  IF (NANG.LT.2) THEN
-     WRITE(*,*) '***Error: NANG must be >=2'
-     STOP
-  ENDIF
-
-  !*** Obtain pi:
-
-  PII=4.D0*ATAN(1.D0)
   DX=X
   DREFRL=REFREL
   Y=X*DREFRL
@@ -190,19 +293,7 @@ SUBROUTINE BHMIE_FORTRAN(X,REFREL,NANG,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
   ! conclusion: we are indeed retaining enough terms in series!
 
   NSTOP=NINT(XSTOP)
-  
-  ! allocation part
-  NMXX=NMX
-  allocate(D(NMXX))
-
-  !*** Require NANG.GE.1 in order to calculate scattering intensities
 
-  DANG=0.
-  IF(NANG.GT.1)DANG=.5*PII/DBLE(NANG-1)
-  DO J=1,NANG
-     THETA=DBLE(J-1)*DANG
-     AMU(J)=COS(THETA)
-  ENDDO
   DO J=1,NANG
      PI0(J)=0.
      PI1(J)=1.
@@ -233,6 +324,8 @@ SUBROUTINE BHMIE_FORTRAN(X,REFREL,NANG,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
   XI1=DCMPLX(PSI1,-CHI1)
   QSCA=0.E0
   GSCA=0.E0
+  SFWD=(0.D0,0.D0)
+  SBCK=(0.D0,0.D0)
   P=-1.
   DO N=1,NSTOP
      EN=N
@@ -294,6 +387,10 @@ SUBROUTINE BHMIE_FORTRAN(X,REFREL,NANG,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
         DCXS1(JJ)=DCXS1(JJ)+FN*P*(AN*PI(J)-BN*TAU(J))
         DCXS2(JJ)=DCXS2(JJ)+FN*P*(BN*PI(J)-AN*TAU(J))
      ENDDO
+     IF(NANG.EQ.0)THEN
+        SFWD=SFWD+(2.D0*EN+1.D0)*(AN+BN)
+        SBCK=SBCK+P*(2.D0*EN+1.D0)*(AN-BN)
+     ENDIF
      PSI0=PSI1
      PSI1=PSI
      CHI0=CHI1
@@ -315,9 +412,14 @@ SUBROUTINE BHMIE_FORTRAN(X,REFREL,NANG,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
 
   GSCA=REAL(2.D0*REAL(GSCA)/QSCA)
   QSCA=REAL((2.D0/(DX*DX))*QSCA)
-  QEXT=REAL((4.D0/(DX*DX))*REALPART(DCXS1(1)))
+  IF(NANG.EQ.0)THEN
+     QEXT=REAL((2.D0/(DX*DX))*REALPART(SFWD))
+     QBACK=REAL((ABS(SBCK)/DX)**2)
+  ELSE
+     QEXT=REAL((4.D0/(DX*DX))*REALPART(DCXS1(1)))
+     QBACK=REAL(4.D0*(ABS(DCXS1(2*NANG-1))/DX)**2)
+  ENDIF
   QABS=QEXT-QSCA
-  QBACK=REAL(4.D0*(ABS(DCXS1(2*NANG-1))/DX)**2)
 
   ! prepare single precision complex scattering amplitude for output
 
@@ -327,4 +429,700 @@ SUBROUTINE BHMIE_FORTRAN(X,REFREL,NANG,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
   ENDDO
 
   RETURN
-END SUBROUTINE BHMIE_FORTRAN
+END SUBROUTINE BHMIE_FORTRAN_CORE
+
+
+SUBROUTINE BHMIE_FORTRAN_BATCH(NX,X,REFREL,NANG,NMXX,D,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
+  IMPLICIT NONE
+
+  !***********************************************************************
+  !
+  ! Batched version of BHMIE_FORTRAN: evaluates the Mie solution for a
+  ! whole array of size parameters and refractive indices in one call,
+  ! which avoids the python/f2py call overhead for each single grain.
+  ! The angle grid is computed once and the workspace D is reused for
+  ! all particles.
+  ! Given:
+  !    NX = number of (size parameter, refractive index) pairs
+  !    X(NX) = 2*pi*a/lambda
+  !    REFREL(NX) = (complex refr. index of sphere)/(real index of medium)
+  !    NANG = number of angles between 0 and 90 degrees, or 0 to only
+  !           calculate the efficiencies
+  !    D(NMXX) = workspace for the logarithmic derivatives, if it is
+  !              shorter than needed, a larger one is allocated once
+  ! Returns:
+  !    S1(2*NANG-1, NX), S2(2*NANG-1, NX), QEXT(NX), QABS(NX), QSCA(NX),
+  !    QBACK(NX), GSCA(NX) as defined in BHMIE_FORTRAN for each pair.
+  !
+  !***********************************************************************
+
+  ! release the GIL when called from python
+  !f2py threadsafe
+
+  INTEGER, INTENT(IN) :: NX,NANG,NMXX
+  REAL, INTENT(IN) :: X(NX)
+  COMPLEX, INTENT(IN) :: REFREL(NX)
+  DOUBLE COMPLEX, INTENT(INOUT) :: D(NMXX)
+  COMPLEX, INTENT(OUT) :: S1(MAX(2*NANG-1,0),NX),S2(MAX(2*NANG-1,0),NX)
+  REAL, INTENT(OUT) :: QEXT(NX),QABS(NX),QSCA(NX),QBACK(NX),GSCA(NX)
+
+  INTEGER I,NMX,BHMIE_NMX
+  DOUBLE PRECISION AMU(NANG)
+  DOUBLE COMPLEX, allocatable :: DL(:)
+
+  IF ((NANG.LT.2).AND.(NANG.NE.0)) THEN
+     WRITE(*,*) '***Error: NANG must be >=2 or 0'
+     STOP
+  ENDIF
+
+  CALL BHMIE_FORTRAN_ANGLES(NANG,AMU)
+
+  NMX=0
+  DO I=1,NX
+     NMX=MAX(NMX,BHMIE_NMX(X(I),REFREL(I)))
+  ENDDO
+
+  IF (NMX.LE.NMXX) THEN
+     DO I=1,NX
+        CALL BHMIE_FORTRAN_CORE(X(I),REFREL(I),NANG,AMU,NMXX,D,S1(:,I),S2(:,I), &
+             &                  QEXT(I),QABS(I),QSCA(I),QBACK(I),GSCA(I))
+     ENDDO
+  ELSE
+     allocate(DL(NMX))
+     DO I=1,NX
+        CALL BHMIE_FORTRAN_CORE(X(I),REFREL(I),NANG,AMU,NMX,DL,S1(:,I),S2(:,I), &
+             &                  QEXT(I),QABS(I),QSCA(I),QBACK(I),GSCA(I))
+     ENDDO
+  ENDIF
+
+  RETURN
+END SUBROUTINE BHMIE_FORTRAN_BATCH
+
+
+SUBROUTINE BHMIE_FORTRAN_MU_CORE(X,REFREL,NMU,AMU,NMXX,D,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
+  IMPLICIT NONE
+
+  ! Version of BHMIE_FORTRAN_CORE for an arbitrary set of angles:
+  !    AMU(NMU) = cosines of all NMU scattering angles, in any order
+  !    S1(NMU), S2(NMU) = the scattering amplitudes at these angles
+  ! The angles are not mirrored at 90 degrees, so angles that are not
+  ! symmetric (e.g. Gauss-Legendre nodes) can be used. QEXT and QBACK are
+  ! obtained from the sums over the Mie coefficients, so the angles 0 and
+  ! 180 degree do not need to be included. All other arguments are as in
+  ! BHMIE_FORTRAN_CORE.
+
+  !f2py threadsafe
+
+  INTEGER, INTENT(IN) :: NMU,NMXX
+  REAL, INTENT(OUT) :: GSCA,QBACK,QEXT,QABS,QSCA
+  REAL, INTENT(IN) :: X
+  COMPLEX, INTENT(IN) :: REFREL
+  DOUBLE PRECISION, INTENT(IN) :: AMU(NMU)
+  DOUBLE COMPLEX, INTENT(INOUT) :: D(NMXX)
+  COMPLEX, INTENT(OUT) :: S1(NMU),S2(NMU)
+
+  INTEGER J,N,NSTOP,NMX
+  DOUBLE PRECISION CHI,CHI0,CHI1,DX,EN,FN,P,PSI,PSI0,PSI1,XSTOP,YMOD
+  DOUBLE PRECISION DQSCA,DGSCA
+  DOUBLE PRECISION PI(NMU),PI0(NMU),PI1(NMU),TAU(NMU)
+  DOUBLE COMPLEX DCXS1(NMU),DCXS2(NMU)
+  DOUBLE COMPLEX AN,AN1,BN,BN1,DREFRL,XI,XI1,Y,SFWD,SBCK
+
+  DX=X
+  DREFRL=REFREL
+  Y=X*DREFRL
+  YMOD=ABS(Y)
+
+  !*** Series expansion terminated after NSTOP terms
+  !    Logarithmic derivatives calculated from NMX on down
+
+  XSTOP=X+4.*X**0.3333+2.
+  NMX=NINT(MAX(XSTOP,YMOD))+15
+  NSTOP=NINT(XSTOP)
+
+  DO J=1,NMU
+     PI0(J)=0.D0
+     PI1(J)=1.D0
+     DCXS1(J)=(0.D0,0.D0)
+     DCXS2(J)=(0.D0,0.D0)
+  ENDDO
+
+  D(NMX)=(0.,0.)
+  DO N=1,NMX-1
+     EN=NMX-N+1
+     D(NMX-N)=(EN/Y)-(1./(D(NMX-N+1)+EN/Y))
+  ENDDO
+
+  PSI0=COS(DX)
+  PSI1=SIN(DX)
+  CHI0=-SIN(DX)
+  CHI1=COS(DX)
+  XI1=DCMPLX(PSI1,-CHI1)
+  DQSCA=0.D0
+  DGSCA=0.D0
+  SFWD=(0.D0,0.D0)
+  SBCK=(0.D0,0.D0)
+  AN=(0.D0,0.D0)
+  BN=(0.D0,0.D0)
+  P=-1.D0
+  DO N=1,NSTOP
+     EN=N
+     FN=(2.D0*EN+1.D0)/(EN*(EN+1.D0))
+     PSI=(2.D0*EN-1.D0)*PSI1/DX-PSI0
+     CHI=(2.D0*EN-1.D0)*CHI1/DX-CHI0
+     XI=DCMPLX(PSI,-CHI)
+     AN1=AN
+     BN1=BN
+     AN=(D(N)/DREFRL+EN/DX)*PSI-PSI1
+     AN=AN/((D(N)/DREFRL+EN/DX)*XI-XI1)
+     BN=(DREFRL*D(N)+EN/DX)*PSI-PSI1
+     BN=BN/((DREFRL*D(N)+EN/DX)*XI-XI1)
+
+     DQSCA=DQSCA+(2.D0*EN+1.D0)*(ABS(AN)**2+ABS(BN)**2)
+     DGSCA=DGSCA+FN*(DBLE(AN)*DBLE(BN)+DIMAG(AN)*DIMAG(BN))
+     IF(N.GT.1)THEN
+        DGSCA=DGSCA+((EN-1.D0)*(EN+1.D0)/EN)*                        &
+             &    (DBLE(AN1)*DBLE(AN)+DIMAG(AN1)*DIMAG(AN)+         &
+             &     DBLE(BN1)*DBLE(BN)+DIMAG(BN1)*DIMAG(BN))
+     ENDIF
+
+     !*** P=1 for N=1,3,...; P=-1 for N=2,4,...
+     !    angles in the backward hemisphere use pi_n and tau_n of
+     !    the mirrored angle
+
+     P=-P
+     SFWD=SFWD+(2.D0*EN+1.D0)*(AN+BN)
+     SBCK=SBCK+P*(2.D0*EN+1.D0)*(AN-BN)
+     DO J=1,NMU
+        PI(J)=PI1(J)
+        TAU(J)=EN*ABS(AMU(J))*PI(J)-(EN+1.D0)*PI0(J)
+        IF(AMU(J).GE.0.D0)THEN
+           DCXS1(J)=DCXS1(J)+FN*(AN*PI(J)+BN*TAU(J))
+           DCXS2(J)=DCXS2(J)+FN*(AN*TAU(J)+BN*PI(J))
+        ELSE
+           DCXS1(J)=DCXS1(J)+FN*P*(AN*PI(J)-BN*TAU(J))
+           DCXS2(J)=DCXS2(J)+FN*P*(BN*PI(J)-AN*TAU(J))
+        ENDIF
+     ENDDO
+     PSI0=PSI1
+     PSI1=PSI
+     CHI0=CHI1
+     CHI1=CHI
+     XI1=DCMPLX(PSI1,-CHI1)
+     DO J=1,NMU
+        PI1(J)=((2.D0*EN+1.D0)*ABS(AMU(J))*PI(J)-(EN+1.D0)*PI0(J))/EN
+        PI0(J)=PI(J)
+     ENDDO
+  ENDDO
+
+  GSCA=REAL(2.D0*DGSCA/DQSCA)
+  QSCA=REAL((2.D0/(DX*DX))*DQSCA)
+  QEXT=REAL((2.D0/(DX*DX))*DBLE(SFWD))
+  QABS=QEXT-QSCA
+  QBACK=REAL((ABS(SBCK)/DX)**2)
+
+  DO J=1,NMU
+     S1(J)=CMPLX(DCXS1(J))
+     S2(J)=CMPLX(DCXS2(J))
+  ENDDO
+
+  RETURN
+END SUBROUTINE BHMIE_FORTRAN_MU_CORE
+
+
+SUBROUTINE BHMIE_FORTRAN_MU_BATCH(NX,X,REFREL,NMU,AMU,NMXX,D,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
+  IMPLICIT NONE
+
+  ! Batched version of BHMIE_FORTRAN_MU_CORE, arguments as in
+  ! BHMIE_FORTRAN_BATCH, but with the cosines AMU(NMU) of all angles
+  ! instead of the number of angles NANG.
+
+  !f2py threadsafe
+
+  INTEGER, INTENT(IN) :: NX,NMU,NMXX
+  REAL, INTENT(IN) :: X(NX)
+  COMPLEX, INTENT(IN) :: REFREL(NX)
+  DOUBLE PRECISION, INTENT(IN) :: AMU(NMU)
+  DOUBLE COMPLEX, INTENT(INOUT) :: D(NMXX)
+  COMPLEX, INTENT(OUT) :: S1(NMU,NX),S2(NMU,NX)
+  REAL, INTENT(OUT) :: QEXT(NX),QABS(NX),QSCA(NX),QBACK(NX),GSCA(NX)
+
+  INTEGER I,NMX,BHMIE_NMX
+  DOUBLE COMPLEX, allocatable :: DL(:)
+
+  NMX=0
+  DO I=1,NX
+     NMX=MAX(NMX,BHMIE_NMX(X(I),REFREL(I)))
+  ENDDO
+
+  IF (NMX.LE.NMXX) THEN
+     DO I=1,NX
+        CALL BHMIE_FORTRAN_MU_CORE(X(I),REFREL(I),NMU,AMU,NMXX,D,S1(:,I),S2(:,I), &
+             &                     QEXT(I),QABS(I),QSCA(I),QBACK(I),GSCA(I))
+     ENDDO
+  ELSE
+     allocate(DL(NMX))
+     DO I=1,NX
+        CALL BHMIE_FORTRAN_MU_CORE(X(I),REFREL(I),NMU,AMU,NMX,DL,S1(:,I),S2(:,I), &
+             &                     QEXT(I),QABS(I),QSCA(I),QBACK(I),GSCA(I))
+     ENDDO
+  ENDIF
+
+  RETURN
+END SUBROUTINE BHMIE_FORTRAN_MU_BATCH
+
+
+DOUBLE COMPLEX FUNCTION BHMIE_LENTZ(N,Z)
+  IMPLICIT NONE
+
+  ! Returns the logarithmic derivative D_n(z) = psi_n'(z)/psi_n(z) of the
+  ! Riccati-Bessel function psi_n from the continued fraction of
+  ! Lentz (1976, Appl. Opt. 15, 668) for the ratio j_{n-1}(z)/j_n(z),
+  ! evaluated with the modified Lentz method. This gives the starting value
+  ! of the downward recurrence without iterating down from NMX.
+
+  !f2py threadsafe
+
+  INTEGER, INTENT(IN) :: N
+  DOUBLE COMPLEX, INTENT(IN) :: Z
+
+  DOUBLE PRECISION, PARAMETER :: TINY=1.D-300,EPS=1.D-15
+  INTEGER J,JMAX
+  DOUBLE COMPLEX B,C,D,DELTA,F
+
+  F=DBLE(2*N+1)/Z
+  IF(ABS(F).LT.TINY)F=TINY
+  C=F
+  D=(0.D0,0.D0)
+
+  ! the number of terms needed is about |z|-n if n<|z|
+
+  JMAX=NINT(MIN(2.D0*ABS(Z),1.D9))+1000
+  DO J=1,JMAX
+     B=DBLE(2*(N+J)+1)/Z
+     D=B-D
+     IF(ABS(D).LT.TINY)D=TINY
+     C=B-1.D0/C
+     IF(ABS(C).LT.TINY)C=TINY
+     D=1.D0/D
+     DELTA=C*D
+     F=F*DELTA
+     IF(ABS(DELTA-1.D0).LT.EPS)EXIT
+  ENDDO
+
+  BHMIE_LENTZ=F-DBLE(N)/Z
+
+  RETURN
+END FUNCTION BHMIE_LENTZ
+
+
+SUBROUTINE BHMIE_FORTRAN_LARGE(X,REFREL,NMU,AMU,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
+  IMPLICIT NONE
+
+  !***********************************************************************
+  !
+  ! Version of BHMIE_FORTRAN_CORE for very large size parameters, in full
+  ! double precision and with a memory footprint that does not grow with
+  ! NMX:
+  ! - the logarithmic derivative at NSTOP is obtained from the continued
+  !   fraction in BHMIE_LENTZ, so the downward recurrence starts at NSTOP
+  !   instead of NMX=MAX(XSTOP,|m*X|)+15.
+  ! - instead of storing D(1:NSTOP), a first downward pass only keeps D at
+  !   the top of blocks of NB ~ SQRT(NSTOP) terms. The series is then summed
+  !   upwards block by block, recomputing D within each block from its
+  !   stored top value.
+  ! Arguments are as in BHMIE_FORTRAN_MU_CORE, but in double precision.
+  !
+  !***********************************************************************
+
+  !f2py threadsafe
+
+  INTEGER, INTENT(IN) :: NMU
+  DOUBLE PRECISION, INTENT(IN) :: X,AMU(NMU)
+  DOUBLE COMPLEX, INTENT(IN) :: REFREL
+  DOUBLE COMPLEX, INTENT(OUT) :: S1(NMU),S2(NMU)
+  DOUBLE PRECISION, INTENT(OUT) :: QEXT,QABS,QSCA,QBACK,GSCA
+
+  INTEGER IB,J,N,N0,N1,NB,NBLK,NSTOP
+  DOUBLE PRECISION CHI,CHI0,CHI1,EN,FN,P,PSI,PSI0,PSI1,XSTOP
+  DOUBLE PRECISION PI(NMU),PI0(NMU),PI1(NMU),TAU(NMU)
+  DOUBLE COMPLEX AN,AN1,BN,BN1,DN,XI,XI1,Y,BHMIE_LENTZ,SFWD,SBCK
+  DOUBLE COMPLEX, allocatable :: CK(:),DB(:)
+
+  Y=X*REFREL
+  XSTOP=X+4.D0*X**0.3333D0+2.D0
+  NSTOP=NINT(XSTOP)
+  NB=MAX(1024,INT(SQRT(DBLE(NSTOP)))+1)
+  NBLK=(NSTOP+NB-1)/NB
+  allocate(CK(NBLK),DB(NB))
+
+  !*** First pass: downward recurrence of D from NSTOP, only keeping
+  !    the value at the top of each block
+
+  DN=BHMIE_LENTZ(NSTOP,Y)
+  DO N=NSTOP,1,-1
+     IF((N.EQ.NSTOP).OR.(MOD(N,NB).EQ.0))CK((N-1)/NB+1)=DN
+     EN=N
+     DN=EN/Y-1.D0/(DN+EN/Y)
+  ENDDO
+
+  !*** Second pass: upward summation of the series
+
+  DO J=1,NMU
+     PI0(J)=0.D0
+     PI1(J)=1.D0
+     S1(J)=(0.D0,0.D0)
+     S2(J)=(0.D0,0.D0)
+  ENDDO
+  PSI0=COS(X)
+  PSI1=SIN(X)
+  CHI0=-SIN(X)
+  CHI1=COS(X)
+  XI1=DCMPLX(PSI1,-CHI1)
+  QSCA=0.D0
+  GSCA=0.D0
+  P=-1.D0
+  AN=(0.D0,0.D0)
+  BN=(0.D0,0.D0)
+  SFWD=(0.D0,0.D0)
+  SBCK=(0.D0,0.D0)
+
+  DO IB=1,NBLK
+     N0=(IB-1)*NB
+     N1=MIN(N0+NB,NSTOP)
+
+     ! recompute D within this block from its top value
+
+     DB(N1-N0)=CK(IB)
+     DO N=N1,N0+2,-1
+        EN=N
+        DB(N-N0-1)=EN/Y-1.D0/(DB(N-N0)+EN/Y)
+     ENDDO
+
+     DO N=N0+1,N1
+        EN=N
+        FN=(2.D0*EN+1.D0)/(EN*(EN+1.D0))
+        PSI=(2.D0*EN-1.D0)*PSI1/X-PSI0
+        CHI=(2.D0*EN-1.D0)*CHI1/X-CHI0
+        XI=DCMPLX(PSI,-CHI)
+        AN1=AN
+        BN1=BN
+        DN=DB(N-N0)
+        AN=(DN/REFREL+EN/X)*PSI-PSI1
+        AN=AN/((DN/REFREL+EN/X)*XI-XI1)
+        BN=(REFREL*DN+EN/X)*PSI-PSI1
+        BN=BN/((REFREL*DN+EN/X)*XI-XI1)
+
+        QSCA=QSCA+(2.D0*EN+1.D0)*(ABS(AN)**2+ABS(BN)**2)
+        GSCA=GSCA+((2.D0*EN+1.D0)/(EN*(EN+1.D0)))*                  &
+             &   (DBLE(AN)*DBLE(BN)+DIMAG(AN)*DIMAG(BN))
+        IF(N.GT.1)THEN
+           GSCA=GSCA+((EN-1.D0)*(EN+1.D0)/EN)*                      &
+                &   (DBLE(AN1)*DBLE(AN)+DIMAG(AN1)*DIMAG(AN)+       &
+                &    DBLE(BN1)*DBLE(BN)+DIMAG(BN1)*DIMAG(BN))
+        ENDIF
+
+        P=-P
+        DO J=1,NMU
+           PI(J)=PI1(J)
+           TAU(J)=EN*ABS(AMU(J))*PI(J)-(EN+1.D0)*PI0(J)
+           IF(AMU(J).GE.0.D0)THEN
+              S1(J)=S1(J)+FN*(AN*PI(J)+BN*TAU(J))
+              S2(J)=S2(J)+FN*(AN*TAU(J)+BN*PI(J))
+           ELSE
+              S1(J)=S1(J)+FN*P*(AN*PI(J)-BN*TAU(J))
+              S2(J)=S2(J)+FN*P*(BN*PI(J)-AN*TAU(J))
+           ENDIF
+        ENDDO
+        SFWD=SFWD+(2.D0*EN+1.D0)*(AN+BN)
+        SBCK=SBCK+P*(2.D0*EN+1.D0)*(AN-BN)
+        PSI0=PSI1
+        PSI1=PSI
+        CHI0=CHI1
+        CHI1=CHI
+        XI1=DCMPLX(PSI1,-CHI1)
+        DO J=1,NMU
+           PI1(J)=((2.D0*EN+1.D0)*ABS(AMU(J))*PI(J)-(EN+1.D0)*PI0(J))/EN
+           PI0(J)=PI(J)
+        ENDDO
+     ENDDO
+  ENDDO
+
+  GSCA=2.D0*GSCA/QSCA
+  QSCA=(2.D0/(X*X))*QSCA
+  QEXT=(2.D0/(X*X))*DBLE(SFWD)
+  QABS=QEXT-QSCA
+  QBACK=(ABS(SBCK)/X)**2
+
+  RETURN
+END SUBROUTINE BHMIE_FORTRAN_LARGE
+
+
+SUBROUTINE BHMIE_FORTRAN_LARGE_BATCH(NX,X,REFREL,NMU,AMU,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
+  IMPLICIT NONE
+
+  ! Batched version of BHMIE_FORTRAN_LARGE, arguments as in
+  ! BHMIE_FORTRAN_MU_BATCH but in double precision and without workspace.
+
+  !f2py threadsafe
+
+  INTEGER, INTENT(IN) :: NX,NMU
+  DOUBLE PRECISION, INTENT(IN) :: X(NX),AMU(NMU)
+  DOUBLE COMPLEX, INTENT(IN) :: REFREL(NX)
+  DOUBLE COMPLEX, INTENT(OUT) :: S1(NMU,NX),S2(NMU,NX)
+  DOUBLE PRECISION, INTENT(OUT) :: QEXT(NX),QABS(NX),QSCA(NX),QBACK(NX),GSCA(NX)
+
+  INTEGER I
+
+  DO I=1,NX
+     CALL BHMIE_FORTRAN_LARGE(X(I),REFREL(I),NMU,AMU,S1(:,I),S2(:,I), &
+          &                   QEXT(I),QABS(I),QSCA(I),QBACK(I),GSCA(I))
+  ENDDO
+
+  RETURN
+END SUBROUTINE BHMIE_FORTRAN_LARGE_BATCH
+
+
+SUBROUTINE BHCOAT_DLOG(Z,NMX,D)
+  IMPLICIT NONE
+
+  ! Logarithmic derivatives D(N) = psi_N'(Z)/psi_N(Z), N=1..NMX, of the
+  ! Riccati-Bessel function psi_N for complex Z by downward recurrence,
+  ! starting with 0 at NMX.
+
+  !f2py threadsafe
+
+  INTEGER, INTENT(IN) :: NMX
+  DOUBLE COMPLEX, INTENT(IN) :: Z
+  DOUBLE COMPLEX, INTENT(OUT) :: D(NMX)
+
+  INTEGER N
+
+  D(NMX)=(0.D0,0.D0)
+  DO N=NMX,2,-1
+     D(N-1)=(N/Z)-(1.D0/(D(N)+N/Z))
+  ENDDO
+
+  RETURN
+END SUBROUTINE BHCOAT_DLOG
+
+
+SUBROUTINE BHCOAT_FORTRAN_CORE(X,Y,RFREL1,RFREL2,NMU,AMU,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
+  IMPLICIT NONE
+
+  ! Mie scattering by a coated sphere, same problem as the subroutine BHCOAT
+  ! of Bohren & Huffman (1983), extended by the scattering amplitudes and
+  ! the asymmetry parameter as in BHMIE_FORTRAN_MU_CORE:
+  !    X      = 2*pi*(core radius)/wavelength
+  !    Y      = 2*pi*(outer radius)/wavelength
+  !    RFREL1 = refractive index of the core
+  !    RFREL2 = refractive index of the mantle
+  !    AMU(NMU) = cosines of all NMU scattering angles
+  ! Output as in BHMIE_FORTRAN_MU_CORE, the efficiencies refer to the
+  ! geometric cross section of the outer radius.
+  ! BHCOAT needs the Riccati-Bessel functions chi_n in the mantle, which
+  ! overflow for absorbing mantles. Instead, the Mie coefficients are
+  ! calculated with the recursive algorithm of Yang (2003, Appl. Opt. 42,
+  ! 1710) that only uses logarithmic derivatives, the products psi_n*xi_n
+  ! and the ratio Q_n of psi_n/xi_n at core and outer radius, which all
+  ! stay bounded.
+
+  !f2py threadsafe
+
+  INTEGER, INTENT(IN) :: NMU
+  DOUBLE PRECISION, INTENT(IN) :: X,Y,AMU(NMU)
+  DOUBLE COMPLEX, INTENT(IN) :: RFREL1,RFREL2
+  DOUBLE COMPLEX, INTENT(OUT) :: S1(NMU),S2(NMU)
+  DOUBLE PRECISION, INTENT(OUT) :: QEXT,QABS,QSCA,QBACK,GSCA
+
+  DOUBLE COMPLEX, PARAMETER :: II=(0.D0,1.D0)
+  INTEGER J,N,NMX,NSTOP
+  DOUBLE PRECISION CHI0Y,CHI1Y,CHIY,EN,FN,P,PSI0Y,PSI1Y,PSIY,YSTOP
+  DOUBLE PRECISION PI(NMU),PI0(NMU),PI1(NMU),TAU(NMU)
+  DOUBLE COMPLEX X1,X2,Y2,XIY,XI1Y
+  DOUBLE COMPLEX D1X2,D1Y2,D3X2,D3Y2,PZX2,PZY2,Q,G1,G2,HA,HB
+  DOUBLE COMPLEX AN,AN1,BN,BN1,SFWD,SBCK
+  DOUBLE COMPLEX, allocatable :: DX1(:),DX2(:),DY2(:)
+
+  X1=RFREL1*X
+  X2=RFREL2*X
+  Y2=RFREL2*Y
+
+  !*** Series expansion terminated after NSTOP terms of the outer sphere
+
+  YSTOP=Y+4.D0*Y**0.3333D0+2.D0
+  NSTOP=NINT(YSTOP)
+  NMX=NINT(MAX(YSTOP,ABS(X1),ABS(X2),ABS(Y2)))+15
+
+  allocate(DX1(NMX),DX2(NMX),DY2(NMX))
+  CALL BHCOAT_DLOG(X1,NMX,DX1)
+  CALL BHCOAT_DLOG(X2,NMX,DX2)
+  CALL BHCOAT_DLOG(Y2,NMX,DY2)
+
+  DO J=1,NMU
+     PI0(J)=0.D0
+     PI1(J)=1.D0
+     S1(J)=(0.D0,0.D0)
+     S2(J)=(0.D0,0.D0)
+  ENDDO
+
+  !*** order 0 of D1 = psi'/psi, D3 = xi'/xi, psi*xi and of
+  !    Q = (psi/xi)(X2) / (psi/xi)(Y2), written such that no
+  !    exponential grows for Im(RFREL2) >= 0
+
+  D1X2=1.D0/X2-1.D0/(DX2(1)+1.D0/X2)
+  D1Y2=1.D0/Y2-1.D0/(DY2(1)+1.D0/Y2)
+  D3X2=II
+  D3Y2=II
+  PZX2=0.5D0*(1.D0-EXP(2.D0*II*X2))
+  PZY2=0.5D0*(1.D0-EXP(2.D0*II*Y2))
+  Q=(EXP(2.D0*II*Y2)-EXP(2.D0*II*(Y2-X2)))/(EXP(2.D0*II*Y2)-1.D0)
+
+  PSI0Y=COS(Y)
+  PSI1Y=SIN(Y)
+  CHI0Y=-SIN(Y)
+  CHI1Y=COS(Y)
+  XI1Y=DCMPLX(PSI1Y,-CHI1Y)
+  QSCA=0.D0
+  GSCA=0.D0
+  SFWD=(0.D0,0.D0)
+  SBCK=(0.D0,0.D0)
+  AN=(0.D0,0.D0)
+  BN=(0.D0,0.D0)
+  P=-1.D0
+  DO N=1,NSTOP
+     EN=N
+     FN=(2.D0*EN+1.D0)/(EN*(EN+1.D0))
+     PSIY=(2.D0*EN-1.D0)*PSI1Y/Y-PSI0Y
+     CHIY=(2.D0*EN-1.D0)*CHI1Y/Y-CHI0Y
+     XIY=DCMPLX(PSIY,-CHIY)
+
+     !*** upward recurrences of psi*xi, D3 and Q in the mantle
+
+     PZX2=PZX2*(EN/X2-D1X2)*(EN/X2-D3X2)
+     PZY2=PZY2*(EN/Y2-D1Y2)*(EN/Y2-D3Y2)
+     D1X2=DX2(N)
+     D1Y2=DY2(N)
+     D3X2=D1X2+II/PZX2
+     D3Y2=D1Y2+II/PZY2
+     Q=Q*((D3X2+EN/X2)/(D1X2+EN/X2))/((D3Y2+EN/Y2)/(D1Y2+EN/Y2))
+
+     !*** logarithmic derivatives at the outer radius, for the electric
+     !    (HA) and magnetic (HB) modes, given the core
+
+     G1=RFREL2*DX1(N)-RFREL1*D1X2
+     G2=RFREL2*DX1(N)-RFREL1*D3X2
+     HA=(G2*D1Y2-Q*G1*D3Y2)/(G2-Q*G1)
+     G1=RFREL1*DX1(N)-RFREL2*D1X2
+     G2=RFREL1*DX1(N)-RFREL2*D3X2
+     HB=(G2*D1Y2-Q*G1*D3Y2)/(G2-Q*G1)
+
+     AN1=AN
+     BN1=BN
+     AN=(HA/RFREL2+EN/Y)*PSIY-PSI1Y
+     AN=AN/((HA/RFREL2+EN/Y)*XIY-XI1Y)
+     BN=(RFREL2*HB+EN/Y)*PSIY-PSI1Y
+     BN=BN/((RFREL2*HB+EN/Y)*XIY-XI1Y)
+
+     QSCA=QSCA+(2.D0*EN+1.D0)*(ABS(AN)**2+ABS(BN)**2)
+     GSCA=GSCA+FN*(DBLE(AN)*DBLE(BN)+DIMAG(AN)*DIMAG(BN))
+     IF(N.GT.1)THEN
+        GSCA=GSCA+((EN-1.D0)*(EN+1.D0)/EN)*                          &
+             &   (DBLE(AN1)*DBLE(AN)+DIMAG(AN1)*DIMAG(AN)+          &
+             &    DBLE(BN1)*DBLE(BN)+DIMAG(BN1)*DIMAG(BN))
+     ENDIF
+
+     !*** angles as in BHMIE_FORTRAN_MU_CORE
+
+     P=-P
+     SFWD=SFWD+(2.D0*EN+1.D0)*(AN+BN)
+     SBCK=SBCK+P*(2.D0*EN+1.D0)*(AN-BN)
+     DO J=1,NMU
+        PI(J)=PI1(J)
+        TAU(J)=EN*ABS(AMU(J))*PI(J)-(EN+1.D0)*PI0(J)
+        IF(AMU(J).GE.0.D0)THEN
+           S1(J)=S1(J)+FN*(AN*PI(J)+BN*TAU(J))
+           S2(J)=S2(J)+FN*(AN*TAU(J)+BN*PI(J))
+        ELSE
+           S1(J)=S1(J)+FN*P*(AN*PI(J)-BN*TAU(J))
+           S2(J)=S2(J)+FN*P*(BN*PI(J)-AN*TAU(J))
+        ENDIF
+     ENDDO
+     PSI0Y=PSI1Y
+     PSI1Y=PSIY
+     CHI0Y=CHI1Y
+     CHI1Y=CHIY
+     XI1Y=DCMPLX(PSI1Y,-CHI1Y)
+     DO J=1,NMU
+        PI1(J)=((2.D0*EN+1.D0)*ABS(AMU(J))*PI(J)-(EN+1.D0)*PI0(J))/EN
+        PI0(J)=PI(J)
+     ENDDO
+  ENDDO
+
+  GSCA=2.D0*GSCA/QSCA
+  QSCA=(2.D0/(Y*Y))*QSCA
+  QEXT=(2.D0/(Y*Y))*DBLE(SFWD)
+  QABS=QEXT-QSCA
+  QBACK=(ABS(SBCK)/Y)**2
+
+  deallocate(DX1,DX2,DY2)
+
+  RETURN
+END SUBROUTINE BHCOAT_FORTRAN_CORE
+
+
+SUBROUTINE BHCOAT_FORTRAN(X,Y,RFREL1,RFREL2,NANG,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
+  IMPLICIT NONE
+
+  ! Coated sphere with the calling convention of BHMIE_FORTRAN: NANG angles
+  ! between 0 and 90 degree, S1 and S2 at the 2*NANG-1 equally spaced
+  ! angles between 0 and 180 degree. See BHCOAT_FORTRAN_CORE for the other
+  ! arguments.
+
+  !f2py threadsafe
+
+  INTEGER, INTENT(IN) :: NANG
+  DOUBLE PRECISION, INTENT(IN) :: X,Y
+  DOUBLE COMPLEX, INTENT(IN) :: RFREL1,RFREL2
+  DOUBLE COMPLEX, INTENT(OUT) :: S1(MAX(2*NANG-1,0)),S2(MAX(2*NANG-1,0))
+  DOUBLE PRECISION, INTENT(OUT) :: QEXT,QABS,QSCA,QBACK,GSCA
+
+  INTEGER J
+  DOUBLE PRECISION AMU(MAX(2*NANG-1,0)),PII
+
+  PII=4.D0*ATAN(1.D0)
+  DO J=1,2*NANG-1
+     AMU(J)=COS((J-1)*PII/MAX(2*NANG-2,1))
+  ENDDO
+  CALL BHCOAT_FORTRAN_CORE(X,Y,RFREL1,RFREL2,MAX(2*NANG-1,0),AMU,S1,S2, &
+       &                   QEXT,QABS,QSCA,QBACK,GSCA)
+
+  RETURN
+END SUBROUTINE BHCOAT_FORTRAN
+
+
+SUBROUTINE BHCOAT_FORTRAN_BATCH(NX,X,Y,RFREL1,RFREL2,NMU,AMU,S1,S2,QEXT,QABS,QSCA,QBACK,GSCA)
+  IMPLICIT NONE
+
+  ! Batched version of BHCOAT_FORTRAN_CORE for NX coated spheres, arguments
+  ! as in BHMIE_FORTRAN_LARGE_BATCH with the core size parameters X(NX), the
+  ! outer size parameters Y(NX) and the refractive indices RFREL1(NX) and
+  ! RFREL2(NX) of core and mantle.
+
+  !f2py threadsafe
+
+  INTEGER, INTENT(IN) :: NX,NMU
+  DOUBLE PRECISION, INTENT(IN) :: X(NX),Y(NX),AMU(NMU)
+  DOUBLE COMPLEX, INTENT(IN) :: RFREL1(NX),RFREL2(NX)
+  DOUBLE COMPLEX, INTENT(OUT) :: S1(NMU,NX),S2(NMU,NX)
+  DOUBLE PRECISION, INTENT(OUT) :: QEXT(NX),QABS(NX),QSCA(NX),QBACK(NX),GSCA(NX)
+
+  INTEGER I
+
+  DO I=1,NX
+     CALL BHCOAT_FORTRAN_CORE(X(I),Y(I),RFREL1(I),RFREL2(I),NMU,AMU,S1(:,I),S2(:,I), &
+          &                   QEXT(I),QABS(I),QSCA(I),QBACK(I),GSCA(I))
+  ENDDO
+
+  RETURN
+END SUBROUTINE BHCOAT_FORTRAN_BATCH
@@ -1,16 +1,24 @@
+import functools
+import threading
 import numpy as np
 try:
-    from numba import njit
+    from numba import njit, prange, get_num_threads
     bhmie_type = 'numba'
 except ImportError:
 
-    def njit(ob):
-        return ob
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda ob: ob
 
+    def get_num_threads():
+        return 1
+
+    prange = range
     bhmie_type = 'python'
 
 
-@njit
+@njit(cache=True)
 def bhmie_python(x, refrel, theta):
     """
     The famous Bohren and Huffman Mie scattering code.
@@ -64,12 +72,62 @@ def bhmie_python(x, refrel, theta):
     S1     = np.zeros(nang, dtype=np.complex128)
     S2     = np.zeros(nang, dtype=np.complex128)
     #
-    # Allocate and initialize arrays for the series expansion iteration
+    # Allocate the arrays for the series expansion iteration and
+    # the logarithmic derivatives
+    #
+    work   = np.zeros((4, nang), dtype=np.float64)
+    xstop  = x + 4 * x**0.3333 + 2.0
+    nmx    = int(np.floor(max(xstop, abs(x * refrel))) + 15)
+    dlog   = np.zeros(nmx, dtype=np.complex128)
+    #
+    # Compute the mu = cos(theta*pi/180.) for all scattering angles
+    #
+    mu     = np.cos(theta * np.pi / 180.)
     #
-    pi     = np.zeros(nang, dtype=np.float64)
-    pi0    = np.zeros(nang, dtype=np.float64)
-    pi1    = np.zeros(nang, dtype=np.float64) + 1.0
-    tau    = np.zeros(nang, dtype=np.float64)
+    # Do the calculation
+    #
+    Qext, Qabs, Qsca, Qback, gsca = bhmie_python_core(x, refrel, mu, iang0, iang180, dlog, work, S1, S2)
+    #
+    # Return results
+    #
+    return S1, S2, Qext, Qabs, Qsca, Qback, gsca
+
+
+@njit(nogil=True, cache=True)
+def bhmie_python_core(x, refrel, mu, iang0, iang180, dlog, work, S1, S2):
+    """
+    The actual calculation of `bhmie_python` on preallocated memory. Nothing
+    is allocated in here, so it can be called repeatedly on the workspace of a
+    `bhmie_plan`.
+
+    Arguments:
+      x       = 2*pi*radius_grain/lambda
+      refrel  = Complex index of refraction (example: 1.5 + 0.01*1j)
+      mu      = cosines of the scattering angles, if empty, only the
+                efficiencies are calculated
+      iang0   = index of the angle 0 in mu, or -1 if it is not included
+      iang180 = index of the angle 180 in mu, or -1 if it is not included
+      dlog    = complex scratch array for the logarithmic derivatives,
+                at least floor(max(xstop, abs(x*refrel))) + 15 long
+      work    = float scratch array of shape (4, len(mu))
+      S1, S2  = complex arrays of length len(mu), will be overwritten
+
+    Returns:
+      Qext, Qabs, Qsca, Qback, gsca as in `bhmie_python`
+    """
+    nang   = len(mu)
+    #
+    # Initialize arrays for the series expansion iteration
+    #
+    pi     = work[0]
+    pi0    = work[1]
+    pi1    = work[2]
+    tau    = work[3]
+    for j in range(nang):
+        S1[j]  = 0j
+        S2[j]  = 0j
+        pi0[j] = 0.0
+        pi1[j] = 1.0
     #
     # Compute a alternative to x
     #
@@ -84,14 +142,10 @@ def bhmie_python(x, refrel, theta):
     #
     nmx    = int(np.floor(max(xstop, abs(y))) + 15)
     #
-    # Compute the mu = cos(theta*pi/180.) for all scattering angles
-    #
-    mu     = np.cos(theta * np.pi / 180.)
-    #
     # Now calculate the logarithmic derivative dlog by downward recurrence
     # beginning with initial value 0.+0j at nmx-1
     #
-    dlog   = np.zeros(nmx, dtype=np.complex128)
+    dlog[nmx - 1] = 0j
     for n in range(nmx - 1):
         en            = float(nmx - n)
         dlog[nmx - n - 2] = en / y - 1.0 / (dlog[nmx - n - 1] + en / y)
@@ -108,6 +162,8 @@ def bhmie_python(x, refrel, theta):
     gsca = 0.0
     an   = 0j
     bn   = 0j
+    sfwd = 0j
+    sbck = 0j
     #
     # Riccati-Bessel functions with real argument x
     # calculated by upward recurrence. This is where the
@@ -140,21 +196,25 @@ def bhmie_python(x, refrel, theta):
         #
         # Now contribute to scattering intensity pattern as a function of angle
         #
-        pi[:]   = pi1[:]
-        tau[:]  = en * np.abs(mu[:]) * pi[:] - (en + 1.0) * pi0[:]
-        #
-        # For mu>=0
-        #
-        idx      = mu >= 0
-        S1[idx] += fn * (an * pi[idx]  + bn * tau[idx])
-        S2[idx] += fn * (an * tau[idx] + bn * pi[idx])
-        #
-        # For mu<0
-        #
-        p        = -p
-        idx      = mu < 0
-        S1[idx] += fn * p * (an * pi[idx] - bn * tau[idx])
-        S2[idx] += fn * p * (bn * pi[idx] - an * tau[idx])
+        p       = -p
+        for j in range(nang):
+            pi[j]  = pi1[j]
+            tau[j] = en * abs(mu[j]) * pi[j] - (en + 1.0) * pi0[j]
+            if mu[j] >= 0:
+                #
+                # For mu>=0
+                #
+                S1[j] += fn * (an * pi[j] + bn * tau[j])
+                S2[j] += fn * (an * tau[j] + bn * pi[j])
+            else:
+                #
+                # For mu<0
+                #
+                S1[j] += fn * p * (an * pi[j] - bn * tau[j])
+                S2[j] += fn * p * (bn * pi[j] - an * tau[j])
+        if iang0 < 0 or iang180 < 0:
+            sfwd += (2 * en + 1.0) * (an + bn)
+            sbck += p * (2 * en + 1.0) * (an - bn)
         #
         # Now prepare for the next iteration
         #
@@ -163,20 +223,27 @@ def bhmie_python(x, refrel, theta):
         chi0    = chi1
         chi1    = chi
         xi1     = psi1 - chi1 * 1j
-        pi1[:]  = ((2 * en + 1.0) * np.abs(mu[:]) * pi[:] - (en + 1.0) * pi0[:]) / en
-        pi0[:]  = pi[:]
+        for j in range(nang):
+            pi1[j] = ((2 * en + 1.0) * abs(mu[j]) * pi[j] - (en + 1.0) * pi0[j]) / en
+            pi0[j] = pi[j]
     #
     # Now do the final calculations
     #
     gsca  = 2 * gsca / Qsca
     Qsca  = (2.0 / (x * x)) * Qsca
-    Qext  = (4.0 / (x * x)) * S1[iang0].real
-    Qback = (abs(S1[iang180]) / x)**2 / np.pi
+    if iang0 < 0:
+        Qext  = (2.0 / (x * x)) * sfwd.real
+    else:
+        Qext  = (4.0 / (x * x)) * S1[iang0].real
+    if iang180 < 0:
+        Qback = (abs(sbck) / (2 * x))**2 / np.pi
+    else:
+        Qback = (abs(S1[iang180]) / x)**2 / np.pi
     Qabs  = Qext - Qsca
     #
     # Return results
     #
-    return S1, S2, Qext, Qabs, Qsca, Qback, gsca.real
+    return Qext, Qabs, Qsca, Qback, gsca
 
 
 def bhmie_python_wrapper(x, nk, nangles):
@@ -209,5 +276,736 @@ def bhmie_python_wrapper(x, nk, nangles):
     gsca : float
         Henyey-Greenstein asymmetry factor
     """
-    theta = np.linspace(0., 180., 2 * nangles - 1)
-    return bhmie_python(x, nk, theta)
+    plan = _get_plan(nangles)
+    nmx  = bhmie_nmx(x, nk)
+    S1   = np.zeros(len(plan.theta), dtype=np.complex128)
+    S2   = np.zeros(len(plan.theta), dtype=np.complex128)
+    if nmx > bhmie_nmx_large:
+        _, work = plan.workspace()
+        Qext, Qabs, Qsca, Qback, gsca = bhmie_python_large_core(
+            x, nk, plan.mu, plan.iang0, plan.iang180, work, S1, S2)
+    else:
+        dlog, work = plan.workspace(nmx)
+        Qext, Qabs, Qsca, Qback, gsca = bhmie_python_core(
+            x, nk, plan.mu, plan.iang0, plan.iang180, dlog, work, S1, S2)
+    return S1, S2, Qext, Qabs, Qsca, Qback, gsca
+
+
+@functools.lru_cache(maxsize=16)
+def _get_plan(nangles):
+    """Returns a `bhmie_plan` for nangles that is reused across calls."""
+    return bhmie_plan(nangles)
+
+
+@njit(nogil=True, cache=True)
+def bhmie_lentz(n, z):
+    """
+    Returns the logarithmic derivative D_n(z) = psi_n'(z)/psi_n(z) of the
+    Riccati-Bessel function psi_n from the continued fraction of
+    Lentz (1976, Appl. Opt. 15, 668) for the ratio j_{n-1}(z)/j_n(z),
+    evaluated with the modified Lentz method.
+    """
+    tiny  = 1e-300
+    eps   = 1e-15
+    f     = (2 * n + 1) / z
+    if abs(f) < tiny:
+        f = tiny
+    c     = f
+    d     = 0j
+    #
+    # the number of terms needed is about |z|-n if n<|z|
+    #
+    jmax  = int(min(2 * abs(z), 1e9)) + 1000
+    for j in range(1, jmax + 1):
+        b     = (2 * (n + j) + 1) / z
+        d     = b - d
+        if abs(d) < tiny:
+            d = tiny
+        c     = b - 1.0 / c
+        if abs(c) < tiny:
+            c = tiny
+        d     = 1.0 / d
+        delta = c * d
+        f    *= delta
+        if abs(delta - 1.0) < eps:
+            break
+    return f - n / z
+
+
+@njit(nogil=True, cache=True)
+def bhmie_python_large_core(x, refrel, mu, iang0, iang180, work, S1, S2):
+    """
+    Version of `bhmie_python_core` for very large size parameters whose
+    memory does not grow with the number of terms:
+
+    - the logarithmic derivative at nstop comes from the continued fraction
+      in `bhmie_lentz`, so the downward recurrence starts at nstop instead
+      of nmx = max(xstop, |m*x|) + 15.
+    - instead of storing all nstop values of the logarithmic derivative, a
+      first downward pass only keeps the values at the top of blocks of
+      ~sqrt(nstop) terms. The series is then summed upwards block by block,
+      recomputing the logarithmic derivatives within each block.
+
+    Arguments are as in `bhmie_python_core`, except that no `dlog` is needed.
+    """
+    nang   = len(mu)
+    pi     = work[0]
+    pi0    = work[1]
+    pi1    = work[2]
+    tau    = work[3]
+    for j in range(nang):
+        S1[j]  = 0j
+        S2[j]  = 0j
+        pi0[j] = 0.0
+        pi1[j] = 1.0
+    y      = x * refrel
+    xstop  = x + 4 * x**0.3333 + 2.0
+    nstop  = int(np.floor(xstop))
+    nb     = max(1024, int(np.sqrt(nstop)) + 1)
+    nblk   = (nstop + nb - 1) // nb
+    ck     = np.zeros(nblk, dtype=np.complex128)
+    db     = np.zeros(nb, dtype=np.complex128)
+    #
+    # First pass: downward recurrence from nstop, keeping only the
+    # value at the top of each block
+    #
+    dn     = bhmie_lentz(nstop, y)
+    for n in range(nstop, 0, -1):
+        if n == nstop or n % nb == 0:
+            ck[(n - 1) // nb] = dn
+        dn = n / y - 1.0 / (dn + n / y)
+    #
+    # Second pass: upward summation of the series
+    #
+    psi0 = np.cos(x)
+    psi1 = np.sin(x)
+    chi0 = -np.sin(x)
+    chi1 = np.cos(x)
+    xi1  = psi1 - chi1 * 1j
+    p    = -1.0
+    Qsca = 0.0
+    gsca = 0.0
+    an   = 0j
+    bn   = 0j
+    sfwd = 0j
+    sbck = 0j
+    for ib in range(nblk):
+        n0 = ib * nb
+        n1 = min(n0 + nb, nstop)
+        #
+        # recompute the logarithmic derivatives within the block,
+        # db[i] holds the value for n = n0 + i + 1
+        #
+        db[n1 - n0 - 1] = ck[ib]
+        for n in range(n1, n0 + 1, -1):
+            db[n - n0 - 2] = n / y - 1.0 / (db[n - n0 - 1] + n / y)
+
+        for n in range(n0, n1):
+            en      = float(n + 1)
+            fn      = (2 * en + 1.0) / (en * (en + 1.0))
+            psi     = (2 * en - 1.0) * psi1 / x - psi0
+            chi     = (2 * en - 1.0) * chi1 / x - chi0
+            xi      = psi - chi * 1j
+            an1     = an
+            bn1     = bn
+            dum     = db[n - n0] / refrel + en / x
+            an      = (dum * psi - psi1) / (dum * xi - xi1)
+            dum     = db[n - n0] * refrel + en / x
+            bn      = (dum * psi - psi1) / (dum * xi - xi1)
+            Qsca   += (2 * en + 1.0) * (abs(an)**2 + abs(bn)**2)
+            dum     = (2 * en + 1.0) / (en * (en + 1.0))
+            gsca   += dum * (an.real * bn.real + an.imag * bn.imag)
+            dum     = (en - 1.0) * (en + 1.0) / en
+            gsca   += dum * (an1.real * an.real + an1.imag * an.imag +
+                             bn1.real * bn.real + bn1.imag * bn.imag)
+            p       = -p
+            for j in range(nang):
+                pi[j]  = pi1[j]
+                tau[j] = en * abs(mu[j]) * pi[j] - (en + 1.0) * pi0[j]
+                if mu[j] >= 0:
+                    S1[j] += fn * (an * pi[j] + bn * tau[j])
+                    S2[j] += fn * (an * tau[j] + bn * pi[j])
+                else:
+                    S1[j] += fn * p * (an * pi[j] - bn * tau[j])
+                    S2[j] += fn * p * (bn * pi[j] - an * tau[j])
+            if iang0 < 0 or iang180 < 0:
+                sfwd += (2 * en + 1.0) * (an + bn)
+                sbck += p * (2 * en + 1.0) * (an - bn)
+            psi0    = psi1
+            psi1    = psi
+            chi0    = chi1
+            chi1    = chi
+            xi1     = psi1 - chi1 * 1j
+            for j in range(nang):
+                pi1[j] = ((2 * en + 1.0) * abs(mu[j]) * pi[j] - (en + 1.0) * pi0[j]) / en
+                pi0[j] = pi[j]
+
+    gsca  = 2 * gsca / Qsca
+    Qsca  = (2.0 / (x * x)) * Qsca
+    if iang0 < 0:
+        Qext  = (2.0 / (x * x)) * sfwd.real
+    else:
+        Qext  = (4.0 / (x * x)) * S1[iang0].real
+    if iang180 < 0:
+        Qback = (abs(sbck) / (2 * x))**2 / np.pi
+    else:
+        Qback = (abs(S1[iang180]) / x)**2 / np.pi
+    Qabs  = Qext - Qsca
+    return Qext, Qabs, Qsca, Qback, gsca
+
+
+#
+# number of terms above which the memory-bounded kernels for large size
+# parameters are used instead of storing all logarithmic derivatives
+#
+bhmie_nmx_large = 200000
+
+
+def bhmie_nmx(x, refrel, each=False):
+    """
+    Returns the length of the logarithmic derivative array that the Mie
+    kernels need for all the given size parameters `x` and refractive indices
+    `refrel`, with a small margin for the single precision fortran version.
+    If `each` is True, an integer array with the length needed for each
+    element is returned instead of the maximum.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    xstop = x + 4 * x**0.3333 + 2.0
+    nmx = np.floor(np.maximum(xstop, np.abs(x * refrel)) * (1 + 1e-6)).astype(np.int64) + 17
+    if each:
+        return nmx
+    return int(nmx.max(initial=0))
+
+
+def trapezoid_weights(theta):
+    """
+    Returns the weights of the trapezoidal rule in mu = cos(theta) for the
+    increasing angles `theta` in degree.
+    """
+    mu = np.cos(np.asarray(theta) * np.pi / 180.)
+    dmu = -np.diff(mu)
+    w = np.zeros(mu.shape)
+    w[..., :-1] += 0.5 * dmu
+    w[..., 1:] += 0.5 * dmu
+    return w
+
+
+def adaptive_angles(x, nangles):
+    """
+    Returns an angle grid (degree) and the weights in mu = cos(theta) that
+    resolve the forward diffraction peak of a particle with size parameter
+    `x`, whose rings have a width of about 1 / x:
+
+    - `nangles` Gauss-Legendre nodes in theta between 0 and
+      theta_p = min(90 degree, nangles / x), i.e. about one node per ring
+    - `nangles` Gauss-Legendre nodes in mu between theta_p and 180 degree
+    - the angles 0 and 180 degree with zero weight
+
+    The weights of the first part contain the factor sin(theta) of the
+    transformation from theta to mu. The diffraction rings beyond theta_p
+    carry a fraction of roughly 1 / nangles of the scattered light, so the
+    grid converges as `nangles` is increased.
+    """
+    theta_p = min(0.5 * np.pi, nangles / x)
+    t, w = np.polynomial.legendre.leggauss(nangles)
+    theta_1 = 0.5 * theta_p * (t + 1)
+    w_1 = 0.5 * theta_p * w * np.sin(theta_1)
+    mu_p = np.cos(theta_p)
+    mu_2 = 0.5 * (mu_p + 1) * t[::-1] + 0.5 * (mu_p - 1)
+    w_2 = 0.5 * (mu_p + 1) * w[::-1]
+    theta = np.hstack((0., theta_1 * 180. / np.pi, np.arccos(mu_2) * 180. / np.pi, 180.))
+    weights = np.hstack((0., w_1, w_2, 0.))
+    return theta, weights
+
+
+class bhmie_plan(object):
+    """
+    Precomputed angle grid and reusable scratch memory for the batched Mie
+    kernels, similar in spirit to the plans of FFTW. A plan is created once
+    for a given number of angles and the largest size parameter of a grid and
+    can then be passed to the batched functions for all sizes and wavelengths,
+    so that they do not allocate anything per particle.
+
+    Every thread gets its own scratch memory, so a single plan can be shared
+    by all threads.
+
+    Arguments:
+    ----------
+
+    nangles : int
+        number of angles between 0 and 90 degree. With 0, no scattering
+        amplitudes are calculated, only the efficiencies.
+
+    Keywords:
+    ---------
+
+    x_max : float
+        the largest size parameter that will be calculated
+
+    m_max : float
+        the largest absolute value of the refractive index
+
+    angles : str | array
+        the angle grid:
+
+        - `'linear'`: 2 * nangles - 1 equally spaced angles from 0 to 180
+          degree (default)
+        - `'gauss'`: 2 * nangles - 3 Gauss-Legendre nodes in mu = cos(theta),
+          plus the angles 0 and 180 degree with zero weight
+        - an array of angles in degree, increasing from 0 to 180 degree
+
+    weights : None | array
+        quadrature weights belonging to an array of `angles`, see below. If
+        None, the weights of the trapezoidal rule are used.
+
+    The attribute `weights` holds the quadrature weights in mu belonging to
+    `theta`, such that sum(weights * f(mu)) approximates the integral of f
+    from -1 to 1. These are the Gauss-Legendre weights, the given weights or
+    the weights of the trapezoidal rule.
+
+    The scratch memory grows automatically if larger values are encountered,
+    but never beyond `bhmie_nmx_large`: larger particles are calculated by the
+    kernels for large size parameters which need no such scratch memory.
+    """
+
+    def __init__(self, nangles, x_max=1.0, m_max=1.0, angles='linear', weights=None):
+        self.nangles  = nangles
+        self.linear   = isinstance(angles, str) and angles == 'linear'
+        if nangles == 0:
+            self.theta   = np.zeros(0)
+            self.weights = np.zeros(0)
+        elif self.linear:
+            self.theta   = np.linspace(0., 180., 2 * nangles - 1)
+            self.weights = trapezoid_weights(self.theta)
+        elif isinstance(angles, str) and angles == 'gauss':
+            mu, w        = np.polynomial.legendre.leggauss(2 * nangles - 3)
+            self.theta   = np.hstack((0., np.arccos(mu[::-1]) * 180. / np.pi, 180.))
+            self.weights = np.hstack((0., w[::-1], 0.))
+        elif isinstance(angles, str):
+            raise ValueError('angles must be \'linear\', \'gauss\' or an array')
+        else:
+            self.theta   = np.array(angles, dtype=np.float64)
+            if np.any(np.diff(self.theta) <= 0) or self.theta[0] < 0 or self.theta[-1] > 180:
+                raise ValueError('angles need to increase between 0 and 180 degree')
+            if weights is None:
+                self.weights = trapezoid_weights(self.theta)
+            elif len(weights) != len(self.theta):
+                raise ValueError('need one weight per angle')
+            else:
+                self.weights = np.array(weights, dtype=np.float64)
+        self.mu       = np.cos(self.theta * np.pi / 180.)
+        self.iang0    = -1
+        self.iang180  = -1
+        if len(self.theta) > 0 and self.theta[0] == 0.0:
+            self.iang0   = 0
+        if len(self.theta) > 0 and self.theta[-1] == 180.0:
+            self.iang180 = len(self.theta) - 1
+        self.nmx      = min(bhmie_nmx(x_max, m_max), bhmie_nmx_large)
+        self._local   = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def workspace(self, nmx=0):
+        """
+        Returns the scratch arrays `dlog, work` of the calling thread, where
+        `dlog` has at least length `nmx`.
+        """
+        local = self._local
+        if not hasattr(local, 'dlog') or len(local.dlog) < nmx:
+            self.nmx   = max(self.nmx, nmx)
+            local.dlog = np.zeros(self.nmx, dtype=np.complex128)
+            local.work = np.zeros((4, len(self.theta)), dtype=np.float64)
+        return local.dlog, local.work
+
+
+@njit(nogil=True, cache=True)
+def bhmie_python_batch(x, refrel, large, mu, iang0, iang180, dlog, work, S1, S2, Qext, Qabs, Qsca, Qback, gsca):
+    """
+    Batched version of `bhmie_python`: runs the Mie calculation for all
+    entries of the 1D arrays `x` and `refrel` and fills the preallocated
+    output arrays in place.
+
+    Arguments:
+      x       = 1D array of size parameters 2*pi*radius_grain/lambda
+      refrel  = 1D complex array of refractive indices, same length as x
+      large   = 1D bool array, True where `bhmie_python_large_core` is used
+      mu, iang0, iang180, dlog, work = angle grid and workspace,
+                see `bhmie_python_core` and `bhmie_plan`
+      S1, S2  = complex arrays of shape (len(x), len(mu))
+      Qext, Qabs, Qsca, Qback, gsca = float arrays of shape len(x)
+
+    If numba is used, the GIL is released so that several threads can run
+    this function at the same time.
+    """
+    for i in range(len(x)):
+        if large[i]:
+            qext, qabs, qsca, qback, g = bhmie_python_large_core(
+                x[i], refrel[i], mu, iang0, iang180, work, S1[i], S2[i])
+        else:
+            qext, qabs, qsca, qback, g = bhmie_python_core(
+                x[i], refrel[i], mu, iang0, iang180, dlog, work, S1[i], S2[i])
+        Qext[i]  = qext
+        Qabs[i]  = qabs
+        Qsca[i]  = qsca
+        Qback[i] = qback
+        gsca[i]  = g
+
+
+@njit(parallel=True, cache=True)
+def bhmie_python_batch_parallel(x, refrel, large, mu, iang0, iang180, nmx, n_chunks,
+                                S1, S2, Qext, Qabs, Qsca, Qback, gsca):
+    """
+    Parallel version of `bhmie_python_batch`: the particles are distributed
+    over `n_chunks` chunks, which are run in parallel on the threads of numba.
+    Chunk c takes the entries c, c + n_chunks, c + 2 * n_chunks, ... so that
+    sorted size parameters give every chunk a similar amount of work. Each
+    chunk allocates its own workspace once.
+
+    Arguments:
+      x, refrel, large, mu, iang0, iang180 = see `bhmie_python_batch`
+      nmx      = length of the workspace, at least the number of terms of
+                 the largest particle that is not `large`
+      n_chunks = number of chunks
+      S1, S2, Qext, Qabs, Qsca, Qback, gsca = output arrays, see
+                 `bhmie_python_batch`
+    """
+    for c in prange(n_chunks):
+        dlog = np.zeros(nmx, dtype=np.complex128)
+        work = np.zeros((4, len(mu)), dtype=np.float64)
+        for i in range(c, len(x), n_chunks):
+            if large[i]:
+                qext, qabs, qsca, qback, g = bhmie_python_large_core(
+                    x[i], refrel[i], mu, iang0, iang180, work, S1[i], S2[i])
+            else:
+                qext, qabs, qsca, qback, g = bhmie_python_core(
+                    x[i], refrel[i], mu, iang0, iang180, dlog, work, S1[i], S2[i])
+            Qext[i]  = qext
+            Qabs[i]  = qabs
+            Qsca[i]  = qsca
+            Qback[i] = qback
+            gsca[i]  = g
+
+
+def bhmie_python_parallel_wrapper(x, nk, nangles, plan=None):
+    """
+    Same as `bhmie_python_batch_wrapper`, but the particles are calculated
+    in parallel on all threads of numba (see `numba.set_num_threads`) by
+    `bhmie_python_batch_parallel`. Results are identical to the serial
+    version.
+    """
+    return bhmie_python_batch_wrapper(x, nk, nangles, plan=plan, parallel=True)
+
+
+def bhmie_warmup(parallel=True):
+    """
+    Compiles all numba kernels by calling them once on a tiny problem. The
+    kernels are cached on disk (in `__pycache__` next to this file, or in
+    `NUMBA_CACHE_DIR` if that is set), so this needs to be done only once
+    per installation, e.g. right after installing the package with
+
+        python -c "import dsharp_opac; dsharp_opac.bhmie_warmup()"
+
+    Afterwards, every new process loads the compiled kernels from the cache
+    instead of compiling them again. Without numba, this does nothing.
+
+    Keywords:
+    ---------
+
+    parallel : bool
+        whether to also compile the parallel driver `bhmie_python_batch_parallel`
+
+    Output:
+    -------
+    the names of the compiled functions
+    """
+    if bhmie_type != 'numba':
+        return []
+    x    = np.array([0.1, 1.0])
+    nk   = 1.5 + 0.01j
+    plan = bhmie_plan(2)
+    bhmie_python(x[1], nk, plan.theta)
+    bhmie_python_wrapper(x[1], nk, 2)
+    bhmie_python_wrapper(float(bhmie_nmx_large), nk, 2)
+    bhmie_python_batch_wrapper(x, nk, 2, plan=plan)
+    names = ['bhmie_python', 'bhmie_python_core', 'bhmie_python_large_core', 'bhmie_lentz',
+             'bhmie_python_batch']
+    if parallel:
+        bhmie_python_parallel_wrapper(x, nk, 2, plan=plan)
+        names += ['bhmie_python_batch_parallel']
+    return names
+
+
+def bhmie_python_batch_wrapper(x, nk, nangles, plan=None, parallel=False):
+    """
+    Batched wrapper for the python version, callable just like the batched
+    fortran version. Particles that need more than `bhmie_nmx_large` terms
+    are calculated with `bhmie_python_large_core`, so there is no upper limit
+    on the size parameter.
+
+    Arguments:
+    ----------
+
+    x : array
+        size parameters 2 pi a / lambda, any shape
+
+    nk : complex | array
+        complex ref. index = n + i * k, either a scalar or an array that
+        can be broadcast to the shape of `x`
+
+    nangles : int
+        number of angles between 0 and 90 degree. Will return S1 & S2 at
+        2 * nangles - 1 angles between 0 and 180 degree. If 0, the angular
+        part of the calculation is skipped and S1 & S2 are empty.
+
+    Keywords:
+    ---------
+
+    plan : None | bhmie_plan
+        the plan providing angles and workspace, created on the fly with
+        equally spaced angles if None
+
+    parallel : bool
+        if True, use `bhmie_python_batch_parallel` with workspaces of its
+        own instead of the one of `plan`
+
+    Output:
+    -------
+    S1, S2, Qext, Qabs, Qsca, Qback, gsca
+
+    S1, S2 : arrays
+        the matrix elements at the angles `plan.theta`,
+        shape = x.shape + (len(plan.theta),)
+
+    Qext, Qabs, Qsca, Qback : arrays
+        the extinction, absorption, scattering, backscattering coefficients
+
+    gsca : array
+        Henyey-Greenstein asymmetry factor
+    """
+    x     = np.asarray(x, dtype=np.float64)
+    shape = x.shape
+    x     = x.ravel()
+    nk    = np.broadcast_to(np.asarray(nk, dtype=np.complex128), shape).ravel()
+
+    if plan is None:
+        plan = bhmie_plan(nangles)
+    elif plan.nangles != nangles:
+        raise ValueError('plan was created for {} angles, not {}'.format(plan.nangles, nangles))
+    nmx   = bhmie_nmx(x, nk, each=True)
+    large = nmx > bhmie_nmx_large
+
+    S1    = np.zeros((x.size, len(plan.theta)), dtype=np.complex128)
+    S2    = np.zeros((x.size, len(plan.theta)), dtype=np.complex128)
+    Qext  = np.zeros(x.size)
+    Qabs  = np.zeros(x.size)
+    Qsca  = np.zeros(x.size)
+    Qback = np.zeros(x.size)
+    gsca  = np.zeros(x.size)
+
+    if parallel:
+        n_chunks = max(1, min(x.size, 4 * get_num_threads()))
+        bhmie_python_batch_parallel(x, nk, large, plan.mu, plan.iang0, plan.iang180,
+                                    max(nmx[~large].max(initial=0), 1), n_chunks,
+                                    S1, S2, Qext, Qabs, Qsca, Qback, gsca)
+    else:
+        dlog, work = plan.workspace(nmx[~large].max(initial=0))
+        bhmie_python_batch(x, nk, large, plan.mu, plan.iang0, plan.iang180, dlog, work,
+                           S1, S2, Qext, Qabs, Qsca, Qback, gsca)
+
+    return (S1.reshape(shape + (-1,)), S2.reshape(shape + (-1,)),
+            Qext.reshape(shape), Qabs.reshape(shape), Qsca.reshape(shape),
+            Qback.reshape(shape), gsca.reshape(shape))
+
+
+def bhmie_numpy(x, nk, nangles, plan=None, max_elements=2**22):
+    """
+    Vectorized version of `bhmie_python` in plain numpy, callable like the
+    batched functions (see `bhmie_python_batch_wrapper`). Instead of running
+    the recurrences one particle after the other, they are run for many
+    particles at once: the particles are sorted by the number of terms they
+    need and split into groups, within a group all series are padded to the
+    longest one and terms of particles that are already finished are masked.
+    This is meant for installations without numba and the compiled code, in
+    which the loops of `bhmie_python` run in the interpreter.
+
+    Arguments:
+    ----------
+
+    x : array
+        size parameters 2 pi a / lambda, any shape
+
+    nk : complex | array
+        complex ref. index = n + i * k, either a scalar or an array that
+        can be broadcast to the shape of `x`
+
+    nangles : int
+        number of angles between 0 and 90 degree. Will return S1 & S2 at
+        2 * nangles - 1 angles between 0 and 180 degree.
+
+    Keywords:
+    ---------
+
+    plan : None | bhmie_plan
+        only used for its angle grid
+
+    max_elements : int
+        largest number of logarithmic derivatives stored at once, i.e. the
+        number of particles in a group times the length of the longest series
+
+    Output:
+    -------
+    S1, S2, Qext, Qabs, Qsca, Qback, gsca
+        as in `bhmie_python_batch_wrapper`
+    """
+    x     = np.asarray(x, dtype=np.float64)
+    shape = x.shape
+    x     = x.ravel()
+    nk    = np.broadcast_to(np.asarray(nk, dtype=np.complex128), shape).ravel()
+    if plan is None:
+        plan = bhmie_plan(nangles)
+    elif plan.nangles != nangles:
+        raise ValueError('plan was created for {} angles, not {}'.format(plan.nangles, nangles))
+
+    S1    = np.zeros((x.size, len(plan.theta)), dtype=np.complex128)
+    S2    = np.zeros((x.size, len(plan.theta)), dtype=np.complex128)
+    Q     = np.zeros((5, x.size))
+    #
+    # group the particles with similar number of terms
+    #
+    xstop = x + 4 * x**0.3333 + 2.0
+    nmx   = (np.floor(np.maximum(xstop, np.abs(x * nk))) + 15).astype(np.int64)
+    order = np.argsort(nmx, kind='stable')
+    i0    = 0
+    while i0 < x.size:
+        i1 = i0 + 1
+        while i1 < x.size and (i1 + 1 - i0) * nmx[order[i1]] <= max_elements:
+            i1 += 1
+        idx = order[i0:i1]
+        S1[idx], S2[idx], Q[:, idx] = _bhmie_numpy_group(x[idx], nk[idx], nmx[idx], plan)
+        i0 = i1
+
+    Qext, Qabs, Qsca, Qback, gsca = Q
+    return (S1.reshape(shape + (-1,)), S2.reshape(shape + (-1,)),
+            Qext.reshape(shape), Qabs.reshape(shape), Qsca.reshape(shape),
+            Qback.reshape(shape), gsca.reshape(shape))
+
+
+def _bhmie_numpy_group(x, refrel, nmx, plan):
+    """
+    Runs the recurrences of `bhmie_python_core` for the 1D arrays `x` and
+    `refrel` at once, `nmx` is the start of the downward recurrence of each
+    particle. Returns S1, S2 and an array of Qext, Qabs, Qsca, Qback, gsca.
+    """
+    mu      = np.abs(plan.mu)
+    sign    = np.where(plan.mu >= 0, 1.0, -1.0)
+    iang0   = plan.iang0
+    iang180 = plan.iang180
+    #
+    # sort by the number of terms: the particles that are not finished
+    # after n terms are then always the last ones
+    #
+    nstop   = np.floor(x + 4 * x**0.3333 + 2.0).astype(np.int64)
+    order   = np.argsort(nstop, kind='stable')
+    x       = x[order]
+    refrel  = refrel[order]
+    nmx     = nmx[order]
+    nstop   = nstop[order]
+    y       = x * refrel
+    #
+    # logarithmic derivatives by downward recurrence, each particle starts
+    # with 0 at its own nmx - 1
+    #
+    dlog    = np.zeros((len(x), nmx.max()), dtype=np.complex128)
+    for n in range(nmx.max() - 2, -1, -1):
+        en         = float(n + 2)
+        dlog[:, n] = np.where(n < nmx - 1, en / y - 1.0 / (dlog[:, n + 1] + en / y), 0j)
+    #
+    # series expansion by upward recurrence on the particles [k:] that
+    # still need the term n
+    #
+    S1   = np.zeros((len(x), len(mu)), dtype=np.complex128)
+    S2   = np.zeros((len(x), len(mu)), dtype=np.complex128)
+    psi0 = np.cos(x)
+    psi1 = np.sin(x)
+    chi0 = -np.sin(x)
+    chi1 = np.cos(x)
+    xi1  = psi1 - chi1 * 1j
+    pi0  = np.zeros(len(mu))
+    pi1  = np.ones(len(mu))
+    p    = -1.0
+    Qsca = np.zeros(len(x))
+    gsca = np.zeros(len(x))
+    an   = np.zeros(len(x), dtype=np.complex128)
+    bn   = np.zeros(len(x), dtype=np.complex128)
+    sfwd = np.zeros(len(x), dtype=np.complex128)
+    sbck = np.zeros(len(x), dtype=np.complex128)
+    for n in range(nstop[-1]):
+        k        = np.searchsorted(nstop, n, side='right')
+        xk       = x[k:]
+        en       = float(n + 1)
+        fn       = (2 * en + 1.0) / (en * (en + 1.0))
+        psi      = (2 * en - 1.0) * psi1[k:] / xk - psi0[k:]
+        chi      = (2 * en - 1.0) * chi1[k:] / xk - chi0[k:]
+        xi       = psi - chi * 1j
+        an1      = an[k:]
+        bn1      = bn[k:]
+        dum      = dlog[k:, n] / refrel[k:] + en / xk
+        ank      = (dum * psi - psi1[k:]) / (dum * xi - xi1[k:])
+        dum      = dlog[k:, n] * refrel[k:] + en / xk
+        bnk      = (dum * psi - psi1[k:]) / (dum * xi - xi1[k:])
+        #
+        # efficiencies
+        #
+        Qsca[k:] += (2 * en + 1.0) * (np.abs(ank)**2 + np.abs(bnk)**2)
+        gsca[k:] += fn * (ank.real * bnk.real + ank.imag * bnk.imag)
+        gsca[k:] += (en - 1.0) * (en + 1.0) / en * (an1.real * ank.real + an1.imag * ank.imag +
+                                                    bn1.real * bnk.real + bn1.imag * bnk.imag)
+        #
+        # angles: pi and tau do not depend on the particle
+        #
+        p        = -p
+        pi       = pi1
+        tau      = sign * (en * mu * pi - (en + 1.0) * pi0)
+        fac      = fn * np.where(sign > 0, 1.0, p)
+        S1[k:]  += fac * (ank[:, None] * pi + bnk[:, None] * tau)
+        S2[k:]  += fac * (ank[:, None] * tau + bnk[:, None] * pi)
+        sfwd[k:] += (2 * en + 1.0) * (ank + bnk)
+        sbck[k:] += p * (2 * en + 1.0) * (ank - bnk)
+        #
+        # prepare for the next iteration
+        #
+        an[k:]   = ank
+        bn[k:]   = bnk
+        psi0[k:] = psi1[k:]
+        psi1[k:] = psi
+        chi0[k:] = chi1[k:]
+        chi1[k:] = chi
+        xi1[k:]  = psi - chi * 1j
+        pi1      = ((2 * en + 1.0) * mu * pi - (en + 1.0) * pi0) / en
+        pi0      = pi
+    #
+    # final calculations as in bhmie_python_core
+    #
+    gsca  = 2 * gsca / Qsca
+    Qsca  = (2.0 / (x * x)) * Qsca
+    if iang0 < 0:
+        Qext  = (2.0 / (x * x)) * sfwd.real
+    else:
+        Qext  = (4.0 / (x * x)) * S1[:, iang0].real
+    if iang180 < 0:
+        Qback = (np.abs(sbck) / (2 * x))**2 / np.pi
+    else:
+        Qback = (np.abs(S1[:, iang180]) / x)**2 / np.pi
+    Qabs  = Qext - Qsca
+    #
+    # back to the original order
+    #
+    inverse = np.argsort(order)
+    return S1[inverse], S2[inverse], np.array([Qext, Qabs, Qsca, Qback, gsca])[:, inverse]
@@ -13,6 +13,7 @@ import warnings
 import pkg_resources
 import astropy.constants as const
 from pathlib import Path
+from collections import OrderedDict
 
 au = const.au.cgs.value
 M_sun = const.M_sun.cgs.value
@@ -32,19 +33,144 @@ sig_h2 = 2e-15  # cross section of H2 [cm^2]
 # `bhmie_function = `
 # - `bhmie_fortran`
 # - `bhmie_python_wrapper`
+# - `bhmie_numpy`
 # - `bhmie_pymiecoated`
+#
+# For the first three, a batched version that works on whole arrays of size
+# parameters and refractive indices is registered in `bhmie_batch_functions`.
+# `bhmie_numpy` runs the recurrences for many particles at once in numpy and
+# is the default if neither the compiled code nor numba is available. It is
+# listed in `bhmie_grid_functions`, which get the whole grid in one call.
+# `get_mie_coefficients` uses it to avoid calling the kernel once per grain.
+# Batched functions that release the GIL are listed in `bhmie_nogil_functions`,
+# those can be run in parallel by threads instead of processes. Without the
+# compiled code, `bhmie_python_wrapper` is batched by
+# `bhmie_python_parallel_wrapper` which uses all threads of numba.
+
+from .bhmie_python import bhmie_python_wrapper, bhmie_python_batch_wrapper, bhmie_python_parallel_wrapper
+from .bhmie_python import bhmie_numpy, bhmie_warmup
+from .bhmie_python import bhmie_plan, bhmie_nmx, bhmie_nmx_large, trapezoid_weights, adaptive_angles
+from .bhmie_python import bhmie_type as _bhmie_python_type
+
+bhmie_batch_functions = {bhmie_python_wrapper: bhmie_python_batch_wrapper, bhmie_numpy: bhmie_numpy}
+bhmie_nogil_functions = set()
+bhmie_grid_functions = {bhmie_numpy}
+if _bhmie_python_type == 'numba':
+    bhmie_nogil_functions.add(bhmie_python_batch_wrapper)
 
 try:
-    from .bhmie_fortran import bhmie_fortran
+    from .bhmie_fortran import bhmie_fortran, bhmie_fortran_batch, bhmie_fortran_mu_batch, bhmie_fortran_large_batch
+    from .bhmie_fortran import bhcoat_fortran, bhcoat_fortran_batch
     bhmie_function = bhmie_fortran
     bhmie_type = 'fortran'
 
+    def bhmie_fortran_batch_wrapper(x, nk, nangles, plan=None):
+        """
+        Wrapper for the batched fortran version, see `bhmie_python_batch_wrapper`
+        for the calling convention. The workspace is taken from `plan`.
+        Particles that need more than `bhmie_nmx_large` terms are calculated
+        by the double precision, memory-bounded `bhmie_fortran_large_batch`.
+        Angle grids other than the equally spaced one are calculated by
+        `bhmie_fortran_mu_batch`.
+        """
+        x = np.asarray(x, dtype=float)
+        shape = x.shape
+        x = x.ravel()
+        nk = np.broadcast_to(np.asarray(nk, dtype=complex), shape).ravel()
+        if plan is None:
+            plan = bhmie_plan(nangles)
+        elif plan.nangles != nangles:
+            raise ValueError('plan was created for {} angles, not {}'.format(plan.nangles, nangles))
+
+        nmx = bhmie_nmx(x, nk, each=True)
+        large = nmx > bhmie_nmx_large
+        dlog, _ = plan.workspace(nmx[~large].max(initial=0))
+
+        S1 = np.zeros((x.size, len(plan.theta)), dtype=complex)
+        S2 = np.zeros_like(S1)
+        Q = np.zeros((5, x.size))
+        for select in [~large, large]:
+            if not select.any():
+                continue
+            if select is large:
+                s1, s2, *q = bhmie_fortran_large_batch(x[select], nk[select], plan.mu)
+            elif plan.linear:
+                s1, s2, *q = bhmie_fortran_batch(x[select], nk[select], nangles, dlog)
+            else:
+                s1, s2, *q = bhmie_fortran_mu_batch(x[select], nk[select], plan.mu, dlog)
+            S1[select] = s1.T
+            S2[select] = s2.T
+            Q[:, select] = q
+
+        Qext, Qabs, Qsca, Qback, gsca = Q
+        return (S1.reshape(shape + (-1,)), S2.reshape(shape + (-1,)),
+                Qext.reshape(shape), Qabs.reshape(shape), Qsca.reshape(shape),
+                Qback.reshape(shape), gsca.reshape(shape))
+
+    bhmie_batch_functions[bhmie_fortran] = bhmie_fortran_batch_wrapper
+    bhmie_nogil_functions.add(bhmie_fortran_batch_wrapper)
+
+    def bhcoat_fortran_batch_wrapper(x, y, nk_core, nk_mantle, nangles, plan=None):
+        """
+        Batched Mie calculation for coated spheres with the compiled
+        `bhcoat_fortran_batch`, same calling convention and output as
+        `bhmie_fortran_batch_wrapper` except for the arguments
+
+        x, y : arrays
+            size parameters of the core and of the whole particle
+
+        nk_core, nk_mantle : complex | arrays
+            refractive indices of core and mantle
+
+        The efficiencies refer to the geometric cross section of the whole
+        particle. Particles without core (x <= 0) or without mantle (x >= y)
+        are calculated as homogeneous spheres.
+        """
+        y = np.asarray(y, dtype=float)
+        shape = y.shape
+        y = y.ravel()
+        x = np.broadcast_to(np.asarray(x, dtype=float), shape).ravel()
+        nk_core = np.broadcast_to(np.asarray(nk_core, dtype=complex), shape).ravel()
+        nk_mantle = np.broadcast_to(np.asarray(nk_mantle, dtype=complex), shape).ravel()
+        if plan is None:
+            plan = bhmie_plan(nangles)
+        elif plan.nangles != nangles:
+            raise ValueError('plan was created for {} angles, not {}'.format(plan.nangles, nangles))
+
+        S1 = np.zeros((y.size, len(plan.theta)), dtype=complex)
+        S2 = np.zeros_like(S1)
+        Q = np.zeros((5, y.size))
+        no_core = x <= 0
+        no_mantle = x >= y
+        coated = ~(no_core | no_mantle)
+        for select, nk in [(no_core, nk_mantle), (no_mantle, nk_core)]:
+            if select.any():
+                s1, s2, *q = bhmie_fortran_batch_wrapper(y[select], nk[select], nangles, plan=plan)
+                S1[select] = s1
+                S2[select] = s2
+                Q[:, select] = q
+        if coated.any():
+            s1, s2, *q = bhcoat_fortran_batch(x[coated], y[coated], nk_core[coated], nk_mantle[coated], plan.mu)
+            S1[coated] = s1.T
+            S2[coated] = s2.T
+            Q[:, coated] = q
+
+        Qext, Qabs, Qsca, Qback, gsca = Q
+        return (S1.reshape(shape + (-1,)), S2.reshape(shape + (-1,)),
+                Qext.reshape(shape), Qabs.reshape(shape), Qsca.reshape(shape),
+                Qback.reshape(shape), gsca.reshape(shape))
+
 except ImportError:
     warnings.warn('could not import compiled mie code - mie calculation will be slow')
-    from .bhmie_python import bhmie_python_wrapper
-    from .bhmie_python import bhmie_type as bt
-    bhmie_type = bt
+    bhmie_type = _bhmie_python_type
     bhmie_function = bhmie_python_wrapper
+    #
+    # without the compiled code, numba runs the particles in parallel
+    #
+    if bhmie_type == 'numba':
+        bhmie_batch_functions[bhmie_python_wrapper] = bhmie_python_parallel_wrapper
+    else:
+        bhmie_function = bhmie_numpy
 
     try:
         from numba import njit  # noqa
@@ -103,6 +229,517 @@ try:
 except ImportError:
     pass
 
+
+def bhmie_geometric(x, nk, nangles, plan=None, n_quad=200):
+    """
+    Asymptotic solution for very large size parameters, callable like the
+    batched Mie functions (see `bhmie_python_batch_wrapper`).
+
+    - extinction: anomalous diffraction (van de Hulst 1957, Sect. 11.22) plus
+      the edge term 0.996 exp(i pi/3) x^(-2/3) of the forward amplitude
+      (Nussenzveig & Wiscombe 1980)
+    - absorption: geometric optics, i.e. Fresnel reflection and refraction at
+      the surface and all orders of internal reflection, averaged over
+      impact parameter and polarization
+    - asymmetry parameter: diffraction is assumed to go forward, the rays
+      are summed with their exact deviation angles
+    - S1, S2: diffraction by a disk with the complex forward amplitude of
+      anomalous diffraction; only meaningful near the forward direction
+
+    Compared to `bhmie_fortran`, for Re(m) between 1.2 and 2 and Im(m)
+    between 1e-4 and 1, the relative errors in Q_abs and Q_sca are below
+    2.5% and 1% for x >= 1e3 and below 0.5% for x >= 1e4. The absolute error
+    in g is below 4e-3 for x >= 1e3 and below 5e-4 for x >= 1e4.
+
+    Arguments:
+    ----------
+
+    x : array
+        size parameters 2 pi a / lambda, any shape
+
+    nk : complex | array
+        complex ref. index = n + i * k, either a scalar or an array that
+        can be broadcast to the shape of `x`
+
+    nangles : int
+        number of angles between 0 and 90 degree. Will return S1 & S2 at
+        2 * nangles - 1 angles between 0 and 180 degree.
+
+    Keywords:
+    ---------
+
+    plan : None | bhmie_plan
+        only used for its angle grid
+
+    n_quad : int
+        number of Gauss-Legendre points for the impact parameter integration
+
+    Output:
+    -------
+    S1, S2, Qext, Qabs, Qsca, Qback, gsca
+        as in `bhmie_python_batch_wrapper`
+    """
+    from scipy.special import j1
+
+    x = np.asarray(x, dtype=float)
+    shape = x.shape
+    x = x.ravel()
+    m = np.broadcast_to(np.asarray(nk, dtype=complex), shape).ravel()[:, None]
+    if plan is None:
+        plan = bhmie_plan(nangles)
+    elif plan.nangles != nangles:
+        raise ValueError('plan was created for {} angles, not {}'.format(plan.nangles, nangles))
+    #
+    # anomalous diffraction: forward amplitude S(0) = x**2 * K(w)
+    #
+    w = -2j * x * (m[:, 0] - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        K = 0.5 + np.exp(-w) / w + (np.exp(-w) - 1) / w**2
+    K = np.where(np.abs(w) < 1e-4, w / 3 - w**2 / 8, K)
+    K = K + 0.9961930 * np.exp(1j * np.pi / 3) * x**(-2. / 3.)
+    Qext = 4 * K.real
+    #
+    # geometric optics: incidence angles on the Gauss-Legendre nodes,
+    # weighted with the impact parameter b = sin(theta_i) as 2 b db
+    #
+    t, wgt = np.polynomial.legendre.leggauss(n_quad)
+    th_i = (t + 1) * np.pi / 4
+    wgt = wgt * np.pi / 4 * 2 * np.sin(th_i) * np.cos(th_i)
+    cos_i = np.cos(th_i)
+    sin_i = np.sin(th_i)
+    cos_t = np.sqrt(1 - (sin_i / m)**2)
+    th_t = np.arcsin(np.minimum(sin_i / m.real, 1.0))
+    T = np.exp(-4 * x[:, None] * m.imag * np.cos(th_t))
+    #
+    # ray of order p has the deviation 2 th_i - 2 p th_t + (p - 1) pi and the
+    # fraction (1 - R)**2 R**(p - 1) T**p, which are summed as geometric series
+    #
+    e_1 = np.exp(2j * (th_i - th_t))
+    e_p = -np.exp(-2j * th_t)
+    Q_go = 0.0
+    C_go = 0.0
+    for R in [np.abs((cos_i - m * cos_t) / (cos_i + m * cos_t))**2,
+              np.abs((m * cos_i - cos_t) / (m * cos_i + cos_t))**2]:
+        denom = 1 - R * T
+        denom = np.where(denom > 0, denom, 1.0)
+        Q_go = Q_go + 0.5 * (R + (1 - R)**2 * T / denom)
+        C_go = C_go + 0.5 * (-R * np.cos(2 * th_i) + ((1 - R)**2 * T * e_1 / (1 - R * T * e_p)).real)
+    Q_go = Q_go @ wgt
+    C_go = C_go @ wgt
+
+    Qabs = 1 - Q_go
+    Qsca = Qext - Qabs
+    gsca = (Qext - 1 + C_go) / Qsca
+    Qback = np.abs((m[:, 0] - 1) / (m[:, 0] + 1))**2
+    #
+    # diffraction pattern of a disk
+    #
+    theta = plan.theta * np.pi / 180.
+    u = x[:, None] * np.sin(theta)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        airy = np.where(u > 0, 2 * j1(u) / u, 1.0)
+    S1 = (x**2 * K)[:, None] * airy * (1 + np.cos(theta)) / 2
+    S2 = S1.copy()
+
+    return (S1.reshape(shape + (-1,)), S2.reshape(shape + (-1,)),
+            Qext.reshape(shape), Qabs.reshape(shape), Qsca.reshape(shape),
+            Qback.reshape(shape), gsca.reshape(shape))
+
+
+bhmie_batch_functions[bhmie_geometric] = bhmie_geometric
+
+
+def bhmie_rayleigh(x, nk, nangles, plan=None):
+    """
+    Small particle limit, callable like the batched Mie functions (see
+    `bhmie_python_batch_wrapper`). Uses the expansions of the Mie coefficients
+    a1 to order x^6 and of b1, a2 to order x^5 (Bohren & Huffman 1983, Sect.
+    5.2), i.e. Rayleigh scattering with the first corrections, which gives
+    the extinction, the scattering and the angle dependence of S1 and S2.
+
+    The relative error is estimated by `rayleigh_error`, all cells of an
+    array are calculated in one go.
+
+    Arguments:
+    ----------
+
+    x : array
+        size parameters 2 pi a / lambda, any shape
+
+    nk : complex | array
+        complex ref. index = n + i * k, either a scalar or an array that
+        can be broadcast to the shape of `x`
+
+    nangles : int
+        number of angles between 0 and 90 degree. Will return S1 & S2 at
+        2 * nangles - 1 angles between 0 and 180 degree.
+
+    Keywords:
+    ---------
+
+    plan : None | bhmie_plan
+        only used for its angle grid
+
+    Output:
+    -------
+    S1, S2, Qext, Qabs, Qsca, Qback, gsca
+        as in `bhmie_python_batch_wrapper`
+    """
+    x = np.asarray(x, dtype=float)
+    m = np.broadcast_to(np.asarray(nk, dtype=complex), x.shape)
+    if plan is None:
+        plan = bhmie_plan(nangles)
+    elif plan.nangles != nangles:
+        raise ValueError('plan was created for {} angles, not {}'.format(plan.nangles, nangles))
+
+    m2 = m**2
+    L = (m2 - 1) / (m2 + 2)
+    a1 = -2j * x**3 / 3 * L - 2j * x**5 / 5 * (m2 - 2) * (m2 - 1) / (m2 + 2)**2 + 4 * x**6 / 9 * L**2
+    b1 = -1j * x**5 / 45 * (m2 - 1)
+    a2 = -1j * x**5 / 15 * (m2 - 1) / (2 * m2 + 3)
+
+    Qsca = 2 / x**2 * (3 * np.abs(a1)**2 + 3 * np.abs(b1)**2 + 5 * np.abs(a2)**2)
+    Qext = 2 / x**2 * (3 * a1 + 3 * b1 + 5 * a2).real
+    #
+    # without absorption, the truncated series do not exactly cancel
+    #
+    Qext = np.where(m.imag > 0, Qext, Qsca)
+    Qabs = Qext - Qsca
+    gsca = 6 / x**2 * (a1 * np.conj(a2 + b1)).real / Qsca
+    #
+    # amplitudes with pi_1 = 1, tau_1 = mu, pi_2 = 3 mu, tau_2 = 3 cos(2 theta)
+    #
+    mu = plan.mu
+    a1 = a1[..., None]
+    b1 = b1[..., None]
+    a2 = a2[..., None]
+    S1 = 1.5 * (a1 + b1 * mu) + 2.5 * a2 * mu
+    S2 = 1.5 * (a1 * mu + b1) + 2.5 * a2 * (2 * mu**2 - 1)
+    Qback = 4 * (np.abs(1.5 * (a1 - b1) - 2.5 * a2)[..., 0] / x)**2
+
+    return S1, S2, Qext, Qabs, Qsca, Qback, gsca
+
+
+bhmie_batch_functions[bhmie_rayleigh] = bhmie_rayleigh
+
+
+def rayleigh_error(x, nk):
+    """
+    Estimates the relative error of `bhmie_rayleigh` in Q_abs, Q_sca and S1,
+    S2 from the orders that are left out: (|m| x)^4, and for weakly
+    absorbing grains (|m| x)^2 Q_sca / Q_abs, with the leading order
+    approximation of the ratio. Compared to the full Mie calculation, the
+    estimate was found to be within a factor of 2 of the largest actual error
+    for 1 < Re(m) < 30 and 0 <= Im(m) < 30.
+
+    Arguments:
+    ----------
+
+    x : array
+        size parameters 2 pi a / lambda
+
+    nk : complex | array
+        complex ref. index = n + i * k, broadcast to the shape of `x`
+
+    Output:
+    -------
+    err : array
+        the estimated relative error
+    """
+    x = np.asarray(x, dtype=float)
+    m = np.asarray(nk, dtype=complex)
+    L = (m**2 - 1) / (m**2 + 2)
+    xm = x * np.abs(m)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(L.imag > 0, 2. / 3. * x**3 * np.abs(L)**2 / L.imag, 0.0)
+    return xm**4 + xm**2 * ratio
+
+
+# registry of the available Mie backends, see `bhmie_benchmark`. The keys can
+# also be passed as `bhmie_function` to `get_mie_coefficients`.
+
+bhmie_backends = {}
+if bhmie_type == 'fortran':
+    bhmie_backends['fortran'] = bhmie_fortran
+bhmie_backends[_bhmie_python_type] = bhmie_python_wrapper
+bhmie_backends['numpy'] = bhmie_numpy
+if 'bhmie_pymiecoated' in globals():
+    bhmie_backends['pymiecoated'] = bhmie_pymiecoated
+
+
+def _bhmie_benchmark_file():
+    """Returns the path of the file that caches the results of `bhmie_benchmark`."""
+    cache = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache, 'dsharp_opac', 'bhmie_benchmark.json')
+
+
+def _bhmie_machine():
+    """Returns a string identifying this machine and installation for `bhmie_benchmark`."""
+    import platform
+    from . import __version__
+    return '{}|{}|{}|{}|{}'.format(platform.node(), platform.machine(), platform.python_version(),
+                                   __version__, ','.join(sorted(bhmie_backends)))
+
+
+def _bhmie_read_benchmark(tol):
+    """Returns the cached result of `bhmie_benchmark` for this machine and `tol`, or None."""
+    import json
+    try:
+        with open(_bhmie_benchmark_file()) as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if result.get('machine') != _bhmie_machine() or result.get('tol') != tol:
+        return None
+    return result
+
+
+def bhmie_benchmark(tol=1e-3, repeat=3, cache=True, force=False):
+    """
+    Measures the speed of all backends in `bhmie_backends` on a representative
+    set of size parameters (0.01 to 1000) and refractive indices, and their
+    accuracy compared to `bhmie_numpy` (the double precision reference):
+    the largest relative deviation in Q_ext and Q_sca or absolute deviation
+    in g.
+
+    The result is cached per machine in `~/.cache/dsharp_opac/` (or in
+    `$XDG_CACHE_HOME/dsharp_opac/`) and only measured again if the machine,
+    the python or package version or the set of backends changes.
+
+    Keywords:
+    ---------
+
+    tol : float
+        backends that deviate more than this from the reference are not
+        considered for the ranking
+
+    repeat : int
+        the time is the best of `repeat` runs
+
+    cache : bool
+        whether to read and write the cache file
+
+    force : bool
+        measure again, even if a cached result exists
+
+    Output:
+    -------
+    dict with these entries:
+
+    ranking : list
+        the names of the backends within `tol`, fastest first
+
+    throughput : dict
+        particles per second for each backend
+
+    error : dict
+        largest relative deviation from the reference for each backend
+    """
+    import json
+    import time
+
+    if cache and not force:
+        result = _bhmie_read_benchmark(tol)
+        if result is not None:
+            return result
+    #
+    # the test set: one tile of particles with different refractive indices
+    #
+    x = np.tile(np.logspace(-2, 3, 24), 3)
+    nk = np.repeat([1.5 + 0.01j, 1.33 + 1e-4j, 2.0 + 1.0j], 24)
+    plan = bhmie_plan(3, x_max=x.max(), m_max=np.abs(nk).max())
+
+    ref = _mie_tile(bhmie_numpy, True, x, nk, 3, plan)
+    result = {'machine': _bhmie_machine(), 'tol': tol, 'throughput': {}, 'error': {}}
+    for name, func in bhmie_backends.items():
+        kernel = bhmie_batch_functions.get(func, func)
+        batched = func in bhmie_batch_functions
+        _mie_tile(kernel, batched, x[:2], nk[:2], 3, plan)  # compile or import
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            res = _mie_tile(kernel, batched, x, nk, 3, plan)
+            times += [time.perf_counter() - t0]
+        error = max(np.abs((res[0] + res[1]) / (ref[0] + ref[1]) - 1).max(),
+                    np.abs(res[1] / ref[1] - 1).max(),
+                    np.abs(res[2] - ref[2]).max())
+        result['throughput'][name] = len(x) / min(times)
+        result['error'][name] = float(error)
+
+    ok = [name for name in bhmie_backends if result['error'][name] <= tol]
+    result['ranking'] = sorted(ok, key=lambda name: -result['throughput'][name])
+
+    if cache:
+        fname = _bhmie_benchmark_file()
+        try:
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            with open(fname, 'w') as f:
+                json.dump(result, f, indent=2)
+        except OSError:
+            warnings.warn('could not write the benchmark cache {}'.format(fname))
+    return result
+
+
+def bhmie_select(tol=1e-3, **kwargs):
+    """
+    Returns the fastest backend of `bhmie_benchmark` that agrees with the
+    reference within `tol`. Keywords are passed on to `bhmie_benchmark`.
+    """
+    ranking = bhmie_benchmark(tol=tol, **kwargs)['ranking']
+    if len(ranking) == 0:
+        return bhmie_function
+    return bhmie_backends[ranking[0]]
+
+
+def bhmie_info(benchmark=False, **kwargs):
+    """
+    Prints which Mie backends are available, which one is used by default and
+    which one `bhmie_function='auto'` selects, together with the measured
+    throughput and accuracy of each backend.
+
+    Keywords:
+    ---------
+
+    benchmark : bool
+        if True, run `bhmie_benchmark` if there is no cached result, otherwise
+        only cached results are shown
+
+    Other keywords are passed on to `bhmie_benchmark`.
+
+    Output:
+    -------
+    the result of `bhmie_benchmark` or None, if there is none
+    """
+    default = [name for name, func in bhmie_backends.items() if func is bhmie_function]
+    print('bhmie_type: {}'.format(bhmie_type))
+    print('default:    {}'.format(default[0] if default else bhmie_function.__name__))
+    print('available:  {}'.format(', '.join(bhmie_backends)))
+
+    if benchmark:
+        result = bhmie_benchmark(**kwargs)
+    else:
+        result = _bhmie_read_benchmark(kwargs.get('tol', 1e-3))
+    if result is None:
+        print('no benchmark available, run bhmie_info(benchmark=True)')
+        return None
+
+    print('auto:       {}'.format(result['ranking'][0] if result['ranking'] else 'none within tolerance'))
+    print('')
+    print('{:12s} {:>14s} {:>10s}'.format('backend', 'particles/s', 'error'))
+    for name in sorted(result['throughput'], key=lambda name: -result['throughput'][name]):
+        print('{:12s} {:14.4g} {:10.2g}'.format(name, result['throughput'][name], result['error'][name]))
+    return result
+
+
+class MieCache(object):
+    """
+    Bounded in-memory cache of Mie results for `get_mie_coefficients`.
+
+    Each entry holds the efficiencies, the asymmetry parameter and the
+    scattering amplitudes of one (x, n, k) cell. Entries are keyed by the
+    Mie function, the angle grid and the values of x, n and k, which are
+    quantized by dropping the lowest bits of their mantissa: values that
+    agree to a relative precision of about `rtol` share an entry. When the
+    entries need more than `max_bytes`, the least recently used ones are
+    dropped.
+
+    Keywords:
+    ---------
+
+    max_bytes : int
+        memory budget of the stored results in bytes
+
+    rtol : float
+        relative precision of the keys, defaults to about 1e-12
+
+    Attributes:
+    -----------
+
+    hits, misses : int
+        number of cells that were found or not found in the cache
+
+    nbytes : int
+        memory currently used by the stored results
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, rtol=1e-12):
+        self._entries = OrderedDict()
+        self.max_bytes = max_bytes
+        self._mask = np.int64(-1) << np.int64(min(52, max(0, int(52 + np.log2(rtol)))))
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return 'MieCache({} entries, {:.3g} MB of {:.3g} MB, {} hits, {} misses)'.format(
+            len(self), self.nbytes / 2**20, self.max_bytes / 2**20, self.hits, self.misses)
+
+    def clear(self):
+        """Removes all entries and resets the counters"""
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, context, x, nk):
+        """
+        Returns the keys of the cells with size parameters `x` and refractive
+        indices `nk` (1D arrays of equal length, `nk` may have a second axis,
+        e.g. for coated grains) for the hashable `context`, which should
+        describe the Mie function and the angle grid.
+        """
+        nk = np.asarray(nk, dtype=complex)
+        if nk.ndim == 1:
+            nk = nk[:, None]
+        values = np.column_stack((x, nk.real, nk.imag)).astype(float)
+        values = values.view(np.int64) & self._mask
+        return [(context, row.tobytes()) for row in values]
+
+    def get(self, keys):
+        """
+        Looks up `keys` and updates the counters. Returns the list of stored
+        results, with None for missing entries.
+        """
+        results = []
+        for key in keys:
+            result = self._entries.get(key, None)
+            if result is not None:
+                self._entries.move_to_end(key)
+            results += [result]
+        n_found = sum(result is not None for result in results)
+        self.hits += n_found
+        self.misses += len(keys) - n_found
+        return results
+
+    def put(self, keys, results):
+        """
+        Stores `results`, a list of tuples of arrays and numbers, under `keys`
+        and drops the oldest entries if the memory budget is exceeded.
+        """
+        for key, result in zip(keys, results):
+            if key in self._entries:
+                continue
+            self._entries[key] = result
+            self.nbytes += self._size(result)
+        while self.nbytes > self.max_bytes and self._entries:
+            _, result = self._entries.popitem(last=False)
+            self.nbytes -= self._size(result)
+
+    @staticmethod
+    def _size(result):
+        return 100 + sum(np.asarray(value).nbytes for value in result)
+
+
+# the cache used by `get_mie_coefficients(..., cache=True)`
+
+mie_cache = MieCache()
+
+
+# the fortran size distribution releases the GIL and can be called from threads
+
 try:
     from .fit_module import fit_module
     distribution = fit_module.fit_function18_test
@@ -188,6 +825,121 @@ def download(packagedir):
                 raise ex
 
 
+#
+# the parsed optical constants files are cached on disk (see
+# `_read_optical_constants`) unless this switch is set to False or the
+# environment variable DSHARP_OPAC_NO_CACHE is set to a non-empty value;
+# the least recently used entries are removed above this size in bytes
+#
+optical_constants_cache = True
+optical_constants_cache_size = 256 * 2**20
+
+
+def _optical_constants_arrays(l, n, k, headerinfo=()):
+    """
+    Returns the dictionary of optical constants used by `diel_const._set_data`:
+    the float64 arrays `l`, `n`, `k` and their logarithms `ll`, `ln`, `lk`,
+    and the list of header lines `headerinfo`.
+    """
+    l, n, k = [np.ascontiguousarray(v, dtype=np.float64) for v in (l, n, k)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {'l': l, 'n': n, 'k': k, 'll': np.log10(l), 'ln': np.log10(n), 'lk': np.log10(k),
+                'headerinfo': list(headerinfo)}
+
+
+def _read_columns(fname, headerlines=0, columns=(0, 1, 2), unit=1e-4, n_offset=0.0, reverse=False):
+    """
+    Reads an optical constants text file with `headerlines` lines of header
+    and the wavelength, n and k in the given `columns`. The wavelength is
+    multiplied by `unit` (to get cm), `n_offset` is added to n and the order
+    is reversed if `reverse` is set.
+    """
+    with open(fname) as f:
+        headerinfo = [f.readline() for i in range(headerlines)]
+        data = np.loadtxt(f)
+    if reverse:
+        data = data[::-1]
+    return data[:, columns[0]] * unit, data[:, columns[1]] + n_offset, data[:, columns[2]], headerinfo
+
+
+def _read_zubko(fname_E, fname_n, fname_k):
+    """
+    Reads the energy, n and k files of Zubko et al. 1996.
+    """
+    E = np.loadtxt(fname_E)[-1::-1]
+    n = np.loadtxt(fname_n)[-1::-1]
+    k = np.loadtxt(fname_k)[-1::-1]
+    l = 0.00012398419292004205 / E  # E = h*c/lambda in CGS # noqa
+    return l, n, k, []
+
+
+def _read_segelstein(fname):
+    """
+    Reads the csv file of Segelstein 1981 which contains a block of n and a
+    block of k data.
+    """
+    with open(fname) as f:
+        l_n = []
+        l_k = []
+
+        for line in f:
+            line = line.strip()
+            if line == '':
+                continue
+            elif line.startswith('wl,n'):
+                data = l_n
+            elif line.startswith('wl,k'):
+                data = l_k
+            else:
+                data += [[float(x) for x in line.split(',')]]
+    l_n = np.array(l_n)
+    l_k = np.array(l_k)
+    if np.allclose(l_n[:, 0], l_k[:, 0]):
+        lam = l_n[:, 0]
+        n = l_n[:, 1]
+        k = l_k[:, 1]
+    return lam * 1e-4, n, k, []
+
+
+def _read_optical_constants(read, *sources, **kwargs):
+    """
+    Returns the optical constants that `read(*sources, **kwargs)` parses from
+    the text files `sources`, as dictionary like `_optical_constants_arrays`.
+
+    The text files are only parsed once: the arrays are then stored in a
+    binary cache below `$XDG_CACHE_HOME` (or `~/.cache`), keyed by the reader,
+    its keywords and the path, size and modification time of each file.
+    Later calls return the arrays as rows of one memory-mapped (read only)
+    table from there, so that only the pages that are used are read from disk.
+
+    If `optical_constants_cache` is False or `$DSHARP_OPAC_NO_CACHE` is set,
+    the files are parsed on every call and nothing is written to disk.
+    """
+    if not optical_constants_cache or os.environ.get('DSHARP_OPAC_NO_CACHE'):
+        return _optical_constants_arrays(*read(*sources, **kwargs))
+    directory = os.path.join(os.path.dirname(_opacity_cache_dir(True)), 'optical_constants')
+    stats = []
+    for fname in sources:
+        stat = os.stat(fname)
+        stats += [(os.path.realpath(fname), stat.st_size, stat.st_mtime_ns)]
+    key = _opacity_cache_key(read, kwargs, stats)
+    names = ['l', 'n', 'k', 'll', 'ln', 'lk']
+    entry = _opacity_cache_load(directory, key)
+    if entry is None:
+        data = _optical_constants_arrays(*read(*sources, **kwargs))
+        #
+        # all arrays go into one table, so that loading it needs only one map
+        #
+        entry = {'table': np.array([data[name] for name in names]), 'headerinfo': data['headerinfo']}
+        try:
+            _opacity_cache_store(directory, key, entry, optical_constants_cache_size)
+        except OSError:
+            pass
+    data = dict(zip(names, entry['table']))
+    data['headerinfo'] = entry['headerinfo']
+    return data
+
+
 class diel_const(object):
     """
     Abstract class for dielectric constants objects
@@ -232,6 +984,20 @@ class diel_const(object):
         self._has_negative_n = np.any(n <= 0)
         self.print_reference()
 
+    def _set_data(self, data):
+        """
+        Assigns wavelength, optical constants and their logarithms from a
+        dictionary as returned by `_read_optical_constants`.
+        """
+        self._l = data['l']
+        self._n = data['n']
+        self._k = data['k']
+        self._ll = data['ll']
+        self._ln = data['ln']
+        self._lk = data['lk']
+        self._lmin = self._l.min()
+        self._lmax = self._l.max()
+
     def print_reference(self, appendix=''):
         """Prints the citation request, appends appendix"""
         if self.reference is not None:
@@ -249,28 +1015,29 @@ class diel_const(object):
 
         Output:
         -------
-        n : float
+        n : float or array
         :    real part of optical property
 
-        k : float
+        k : float or array
         :    imaginary part of optical property
         """
-        if np.array(lam, ndmin=1).min() < self._lmin or np.array(lam, ndmin=1).max() > self._lmax:
-            raise NameError('{}: wavelength {:g} outside data-range [{:g},{:g}]'.format(type(self).__name__, lam, self._lmin, self._lmax))
+        lam = np.asarray(lam, dtype=float)
+        outside = (lam < self._lmin) | (lam > self._lmax)
+        if np.any(outside):
+            raise NameError('{}: wavelength {:g} outside data-range [{:g},{:g}]'.format(
+                type(self).__name__, lam[outside].flat[0], self._lmin, self._lmax))
 
-        log_interp = True
-        if self._has_negative_n:
-            # estimate if log interpolation is ok to do
-            n = np.interp(lam, self._l, self._n)
-            if n < 0:
-                log_interp = False
+        log_lam = np.log10(lam)
+        n = 10.**np.interp(log_lam, self._ll, self._ln)
+        k = 10.**np.interp(log_lam, self._ll, self._lk)
 
-        if log_interp:
-            result = 10.**np.interp(np.log10(lam), self._ll, self._ln), 10.**np.interp(np.log10(lam), self._ll, self._lk)
-        else:
-            result = np.interp(lam, self._l, self._n), 10.**np.interp(np.log10(lam), self._ll, self._lk)
+        if self._has_negative_n:
+            # log interpolation is not possible where n is negative
+            # or next to negative values: interpolate n linearly there
+            n_lin = np.interp(lam, self._l, self._n)
+            n = np.where((n_lin < 0) | ~np.isfinite(n), n_lin, n)[()]
 
-        return result
+        return n, k
 
     def extrapolate_constants_up(self, lmin, lmax, n=10, kind='second'):
         """
@@ -447,20 +1214,12 @@ class diel_from_lnk_file(diel_const):
         #
         self.datafile = datafile
         self.material_str = 'Optical constants from %s' % datafile
-        f = open(self.datafile)
-        self.headerinfo = [f.readline() for i in range(headerlines)]
-        data = np.loadtxt(f)
+        data = _read_optical_constants(_read_columns, self.datafile, headerlines=headerlines)
+        self.headerinfo = data['headerinfo']
         #
         # assign wavelength and optical constants
         #
-        self._l = data[:, 0] * 1e-4
-        self._n = data[:, 1]
-        self._k = data[:, 2]
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
+        self._set_data(data)
 
         if any(self._n <= 0):
             self._has_negative_n = True
@@ -558,18 +1317,11 @@ class diel_henning(diel_const):
         # read data
         #
         print('Reading opacities from %s' % fname)
-        data = np.loadtxt(self.datafile)
+        data = _read_optical_constants(_read_columns, self.datafile)
         #
         # assign wavelength and optical constants
         #
-        self._l = data[:, 0] * 1e-4
-        self._n = data[:, 1]
-        self._k = data[:, 2]
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
+        self._set_data(data)
         self.print_reference()
 
     @classmethod
@@ -621,18 +1373,11 @@ class diel_jaeger98(diel_const):
         # read data
         #
         print('Reading opacities from %s' % fname)
-        data = np.loadtxt(self.datafile)
+        data = _read_optical_constants(_read_columns, self.datafile, reverse=True)
         #
         # assign wavelength and optical constants
         #
-        self._l = data[::-1, 0] * 1e-4
-        self._n = data[::-1, 1]
-        self._k = data[::-1, 2]
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
+        self._set_data(data)
         self.reference = 'Jaeger et al. 1998'
         self.print_reference()
 
@@ -667,37 +1412,11 @@ class diel_segelstein_water(diel_const):
         # read data
         #
         print('Reading opacities from %s' % fname)
-        with open(self.datafile) as f:
-            l_n = []
-            l_k = []
-
-            for line in f:
-                line = line.strip()
-                if line == '':
-                    continue
-                elif line.startswith('wl,n'):
-                    data = l_n
-                elif line.startswith('wl,k'):
-                    data = l_k
-                else:
-                    data += [[float(x) for x in line.split(',')]]
-        l_n = np.array(l_n)
-        l_k = np.array(l_k)
-        if np.allclose(l_n[:, 0], l_k[:, 0]):
-            lam = l_n[:, 0]
-            n = l_n[:, 1]
-            k = l_k[:, 1]
+        data = _read_optical_constants(_read_segelstein, self.datafile)
         #
         # assign wavelength and optical constants
         #
-        self._l = lam * 1e-4
-        self._n = n
-        self._k = k
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
+        self._set_data(data)
         self.reference = 'Segelstein 1981'
         self.print_reference()
 
@@ -745,18 +1464,11 @@ class diel_preibisch93(diel_const):
         # read data
         #
         print('Reading opacities from %s' % fname)
-        data = np.loadtxt(self.datafile)
+        data = _read_optical_constants(_read_columns, self.datafile, unit=1.0)
         #
         # assign wavelength and optical constants
         #
-        self._l = data[:, 0]
-        self._n = data[:, 1]
-        self._k = data[:, 2]
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
+        self._set_data(data)
         self.reference = 'Preibisch et al. 1993'
         self.print_reference()
 
@@ -808,18 +1520,11 @@ class diel_pollack1994(diel_const):
         # read data
         #
         print('Reading opacities from %s' % fname)
-        data = np.loadtxt(self.datafile)
+        data = _read_optical_constants(_read_columns, self.datafile, unit=1.0)
         #
         # assign wavelength and optical constants
         #
-        self._l = data[:, 0]
-        self._n = data[:, 1]
-        self._k = data[:, 2]
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
+        self._set_data(data)
         self.reference = 'Pollack et al. (1994)'
         self.print_reference()
 
@@ -889,20 +1594,13 @@ class diel_draine2003(diel_const):
 
         # read from file
 
-        with open(self.datafile) as f:
-            self.headerinfo = [f.readline() for i in range(5)]
-            data = np.loadtxt(f)
+        data = _read_optical_constants(_read_columns, self.datafile, headerlines=5, columns=(0, 3, 4),
+                                       n_offset=1., reverse=True)
+        self.headerinfo = data['headerinfo']
         #
         # assign wavelength and optical constants
         #
-        self._l = data[-1::-1, 0] * 1e-4
-        self._n = data[-1::-1, 3] + 1.
-        self._k = data[-1::-1, 4]
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
+        self._set_data(data)
 
         self.reference = 'Draine 2003'
         self.print_reference()
@@ -930,20 +1628,13 @@ class diel_WeingartnerDraine2001_astrosil(diel_const):
         self.datafile = get_datafile(os.path.join('draine', 'eps_suvSil'), base='optical_constants')
         if not os.path.isfile(self.datafile):
             download(os.path.dirname(self.datafile))
-        f = open(self.datafile)
-        self.headerinfo = [f.readline() for i in range(9)]
-        data = np.loadtxt(f)
+        data = _read_optical_constants(_read_columns, self.datafile, headerlines=9, columns=(0, 3, 4),
+                                       n_offset=1., reverse=True)
+        self.headerinfo = data['headerinfo']
         #
         # assign wavelength and optical constants
         #
-        self._l = data[-1::-1, 0] * 1e-4
-        self._n = data[-1::-1, 3] + 1.
-        self._k = data[-1::-1, 4]
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
+        self._set_data(data)
         self.rho = 3.5  # see sect 2.4
 
         self.reference = 'Weingartner & Draine (2001)'
@@ -972,22 +1663,15 @@ class diel_drainelee84_astrosil(diel_const):
         self.datafile = get_datafile(os.path.join('draine', 'eps_Sil'), base='optical_constants')
         if not os.path.isfile(self.datafile):
             download(os.path.dirname(self.datafile))
-        with open(self.datafile) as f:
-            self.headerinfo = [f.readline() for i in range(6)]
-            data = np.loadtxt(f)
+        data = _read_optical_constants(_read_columns, self.datafile, headerlines=6, columns=(0, 3, 4),
+                                       n_offset=1., reverse=True)
+        self.headerinfo = data['headerinfo']
         #
         # assign wavelength and optical constants
         #
-        self._l = data[::-1, 0] * 1e-4
-        self._n = data[::-1, 3] + 1.
-        self._k = data[::-1, 4]
+        self._set_data(data)
         if any(self._n <= 0):
             self._has_negative_n = True
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
         self.rho = 3.3  # DL84, page 102, 3rd paragraph
 
         self.reference = 'Draine & Lee (1984)'
@@ -1060,21 +1744,12 @@ class diel_zubko96(diel_const):
         self.material_str = 'Carbonaceous Grains (Zubko et al. 1996, {})'.format(sample)
         self.datafile = directory
 
-        E = np.loadtxt(get_datafile(os.path.join('zubko_E_{}.txt'.format(sample)), base=self.datafile))[-1::-1]
-        n = np.loadtxt(get_datafile(os.path.join('zubko_n_{}.txt'.format(sample)), base=self.datafile))[-1::-1]
-        k = np.loadtxt(get_datafile(os.path.join('zubko_k_{}.txt'.format(sample)), base=self.datafile))[-1::-1]
-        l = 0.00012398419292004205 / E  # E = h*c/lambda in CGS # noqa
+        data = _read_optical_constants(
+            _read_zubko, *[get_datafile('zubko_{}_{}.txt'.format(q, sample), base=self.datafile) for q in 'Enk'])
         #
         # assign wavelength and optical constants
         #
-        self._l = l
-        self._n = n
-        self._k = k
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
+        self._set_data(data)
 
         if extrapol:
             self.extrapolate_constants_up(lmin, lmax)
@@ -1109,18 +1784,8 @@ class diel_warren84(diel_const):
         #
         # read data and assign wavelength and optical constants
         #
-        data = np.loadtxt(self.datafile)
-        self._l = data[:, 0] * 1e-4
-        self._n = data[:, 1]
-        self._k = data[:, 2]
-        #
-        # assign derived attributes
-        #
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
+        data = _read_optical_constants(_read_columns, self.datafile)
+        self._set_data(data)
         self.rho = 0.917  # Warren 1984, page 1215
 
         self.print_reference()
@@ -1155,18 +1820,8 @@ class diel_warrenbrandt08(diel_const):
         #
         # read data and assign wavelength and optical constants
         #
-        data = np.loadtxt(self.datafile)
-        self._l = data[:, 0] * 1e-4
-        self._n = data[:, 1]
-        self._k = data[:, 2]
-        #
-        # assign derived attributes
-        #
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
+        data = _read_optical_constants(_read_columns, self.datafile)
+        self._set_data(data)
         self.rho = 0.917  # Warren 1984, page 1215
 
         self.print_reference()
@@ -1225,12 +1880,9 @@ class diel_ricci10(diel_const):
         #
         # read data and assign wavelength and optical constants
         #
-        f = open(self.datafile)
-        self.headerinfo = [f.readline() for i in range(2)]
-        data = np.loadtxt(f)
-        l = data[:, 0] * 1e-4  # noqa
-        n = data[:, 1] + 1.0
-        k = data[:, 2]
+        data = _read_optical_constants(_read_columns, self.datafile, headerlines=2, n_offset=1.0)
+        self.headerinfo = data['headerinfo']
+        l, n, k = data['l'], data['n'], data['k']  # noqa
         #
         # extrapolate
         #
@@ -1265,22 +1917,173 @@ class diel_ricci10(diel_const):
                 n = np.append(n[0], n)
                 k = np.append(k[0], k)
                 l = np.append(lmin, l)  # noqa
+            data = _optical_constants_arrays(l, n, k, data['headerinfo'])
         #
         # assign the attributes
         #
-        self._l = l
-        self._n = n
-        self._k = k
-        self._ll = np.log10(self._l)
-        self._ln = np.log10(self._n)
-        self._lk = np.log10(self._k)
-        self._lmin = self._l.min()
-        self._lmax = self._l.max()
+        self._set_data(data)
 
         self.reference = 'Ricci et al. (2010)'
         self.print_reference(', or the specific reference for that species')
 
 
+def _bruggeman(eps, abundances, tol=1e-12, maxiter=50):
+    """
+    Solves the Bruggeman mixing rule
+
+        sum_j f_j * (eps_j - eps_mean) / (eps_j + 2 * eps_mean) = 0
+
+    for many wavelengths at once. For two components, the quadratic
+    equation is solved in closed form, otherwise with a complex Newton
+    iteration that starts from the Looyenga mixing rule.
+    Wavelengths that do not converge to the physical root (Im(eps_mean) >= 0)
+    are started again from the solution at a neighbouring wavelength. Only
+    if that fails too, `mpmath.findroot` is used.
+
+    Arguments:
+    ----------
+
+    eps : array
+        complex dielectric constants of shape (n_components, n_lam), the
+        wavelengths should be sorted
+
+    abundances : array
+        volume fractions of the n_components materials, or an array of
+        shape (n_components, n_lam) with different fractions per column
+
+    Keywords:
+    ---------
+
+    tol : float
+        relative tolerance of the Newton steps and of the root branch
+
+    maxiter : int
+        maximum number of Newton iterations
+
+    Output:
+    -------
+    eps_mean : array
+        the mixed dielectric constants of length n_lam
+
+    info : dict
+        convergence diagnostics with arrays of length n_lam: the number of
+        Newton `iterations` (0 for the closed form), the `residual` of the
+        mixing rule, whether the Newton iteration `converged` and whether
+        `mpmath` was needed
+    """
+    eps = np.asarray(eps, dtype=complex)
+    f = np.asarray(abundances, dtype=float)
+    if f.ndim == 1:
+        f = f[:, None]
+    n_lam = eps.shape[1]
+    iterations = np.zeros(n_lam, dtype=int)
+
+    def residual(x):
+        return np.abs((f * (eps - x) / (eps + 2 * x)).sum(0))
+
+    def physical(x):
+        return np.isfinite(x) & (x.imag >= -tol * np.abs(x))
+
+    if len(f) == 2:
+        #
+        # 2 F x**2 - b x - F eps_1 eps_2 = 0: of the two roots, take the one
+        # with the larger imaginary part, or the larger real part if both
+        # are real
+        #
+        F = f.sum(0)
+        b = (2 * f[0] - f[1]) * eps[0] + (2 * f[1] - f[0]) * eps[1]
+        root = np.sqrt(b**2 + 8 * F**2 * eps[0] * eps[1])
+        x1 = (b + root) / (4 * F)
+        x2 = (b - root) / (4 * F)
+        real = np.abs(x1.imag - x2.imag) <= tol * np.maximum(np.abs(x1), np.abs(x2))
+        take_1 = np.where(real, x1.real >= x2.real, x1.imag >= x2.imag)
+        x = np.where(take_1, x1, x2)
+        converged = physical(x)
+    else:
+        @np.errstate(over='ignore', invalid='ignore', divide='ignore')
+        def newton(x, active):
+            x = x.copy()
+            for _ in range(maxiter):
+                if not active.any():
+                    break
+                d = eps[:, active] + 2 * x[active]
+                f_a = f[:, active] if f.shape[1] > 1 else f
+                step = (f_a * (eps[:, active] - x[active]) / d).sum(0) / (-3 * f_a * eps[:, active] / d**2).sum(0)
+                x[active] -= step
+                iterations[active] += 1
+                active[active] = ~(np.abs(step) <= tol * np.abs(x[active]))
+            return x, ~active & physical(x)
+
+        x, converged = newton(((f * eps**(1. / 3.)).sum(0) / f.sum(0))**3, np.ones(n_lam, dtype=bool))
+        #
+        # warm start the failed wavelengths from a converged neighbour
+        #
+        while not converged.all():
+            left = np.hstack((False, converged[:-1]))
+            right = np.hstack((converged[1:], False))
+            retry = ~converged & (left | right)
+            if not retry.any():
+                break
+            start = x.copy()
+            start[retry & left] = x[np.nonzero(retry & left)[0] - 1]
+            start[retry & ~left] = x[np.nonzero(retry & ~left)[0] + 1]
+            x_new, ok = newton(start, retry.copy())
+            x[retry] = x_new[retry]
+            converged[retry] = ok[retry]
+            if not ok[retry].any():
+                break
+    #
+    # arbitrary precision for the rest
+    #
+    fallback = ~converged
+    if fallback.any():
+        from mpmath import findroot
+        f = np.broadcast_to(f, eps.shape)
+        for i in np.nonzero(fallback)[0]:
+            def fct(y):
+                return sum(f[:, i] * ((eps[:, i] - y) / (eps[:, i] + 2 * y)))
+            x[i] = complex(findroot(fct, complex(0.5, 0.5)))
+
+    info = {
+        'iterations': iterations,
+        'residual': residual(x),
+        'converged': converged,
+        'mpmath': fallback,
+    }
+    return x, info
+
+
+def _maxwell_garnett(eps, abundances):
+    """
+    Maxwell-Garnett mixing rule after Bohren & Huffman for many wavelengths
+    at once, the first component is the matrix.
+
+    Arguments:
+    ----------
+
+    eps : array
+        complex dielectric constants of shape (n_components, n_lam)
+
+    abundances : array
+        volume fractions of the n_components materials, or an array of
+        shape (n_components, n_lam) with different fractions per column
+
+    Output:
+    -------
+    eps_mean : array
+        the mixed dielectric constants of length n_lam
+    """
+    f_i = np.asarray(abundances, dtype=float)[1:]
+    if f_i.ndim == 1:
+        f_i = f_i[:, None]
+    eps_m = eps[0]
+    eps_i = eps[1:]
+    beta_i = 3 * eps_m / (eps_i + 2 * eps_m)
+    f = f_i.sum(0)
+    return ((1 - f) * eps_m + (f_i * beta_i * eps_i).sum(0)) / \
+        (1 - f + (f_i * beta_i).sum(0))
+
+
 class diel_mixed():
     """
     This is a dielectric_constant class that mixes the various
@@ -1297,6 +2100,10 @@ class diel_mixed():
     rule : str
     :    the mixing rule. Possible choices are
          'Bruggeman'
+
+    After each call of `nk` with the Bruggeman rule, the attribute
+    `diagnostics` holds the convergence information of the solver for each
+    wavelength, see `_bruggeman`.
     """
 
     def __init__(self, constants, abundances, rule='Bruggeman', extrapol=False):
@@ -1329,6 +2136,7 @@ class diel_mixed():
         self.abundances = abundances
         self.rule = rule
         self.extrapol = extrapol
+        self.diagnostics = None
 
     def nk(self, lam):
         """
@@ -1348,82 +2156,113 @@ class diel_mixed():
         k : float
         :    imaginary part of mixed optical property
         """
-        from mpmath import findroot
         l_arr = np.array(lam, ndmin=1)
-        eps_mean = np.empty(np.shape(l_arr)).astype('complex')
+        #
+        # calculate eps = (n + I*k)**2 for each material at all wavelengths
+        #
+        eps = np.array([np.reshape((np.asarray(n) + np.asarray(k) * 1j)**2, len(l_arr))
+                        for n, k in [c.nk(l_arr) for c in self.constants]])
+        abundances = np.asarray(self.abundances, dtype=float)
 
-        for i, _l in enumerate(l_arr):
+        if self.rule.lower() == 'bruggeman':
+            #
+            # solve the mixing rule for all wavelengths at once,
+            # in order of wavelength to warm start from the neighbours
+            #
+            order = np.argsort(l_arr)
+            eps_mean = np.empty(len(l_arr), dtype=complex)
+            eps_mean[order], info = _bruggeman(eps[:, order], abundances)
+            self.diagnostics = {key: value[np.argsort(order)] for key, value in info.items()}
+        elif self.rule.lower() == 'maxwell-garnett':
+            #
+            # kataoka et al. 2014, eq. 3
+            #
+            # fj_gammaj = np.array(self.abundances) * 3. / (eps + 2.)
+            # eps_mean = (fj_gammaj * eps).sum() / (fj_gammaj.sum())
             #
-            # calculate eps = (n + I*k)**2 for each material
+            # according to another paper, turns out to be equivalent
             #
-            eps = np.array([complex(*c.nk(_l))**2 for c in self.constants])
-
-            if self.rule.lower() == 'bruggeman':
-                #
-                # define the mixing rule and solve for the mixed value
-                #
-                def fct(x):
-                    return sum(self.abundances * ((eps - x) / (eps + 2 * x)))
-                eps_mean[i] = complex(findroot(fct, complex(0.5, 0.5)))
-            elif self.rule.lower() == 'maxwell-garnett':
-                #
-                # kataoka et al. 2014, eq. 3
-                #
-                # fj_gammaj = np.array(self.abundances) * 3. / (eps + 2.)
-                # eps_mean[i] = (fj_gammaj * eps).sum() / (fj_gammaj.sum())
-                #
-                # according to another paper, turns out to be equivalent
-                #
-                # eps_h = eps[0]
-                # eps_i = eps[1:]
-                # f_i = self.abundances[1:]
-                # R = (f_i * (eps_i - eps_h) / (eps_i + 2 * eps_h)).sum(0)
-                # eps_mean[i] = eps_h * (1 + 2 * R) / (1 - R)
-                #
-                # according to Bohren & Huffman
-                #
-                eps_m = eps[0]
-                eps_i = eps[1:]
-                f_i = self.abundances[1:]
-                beta_i = 3 * eps_m / (eps_i + 2 * eps_m)
-                f = sum(f_i)
-                eps_mean[i] = ((1 - f) * eps_m + (f_i * beta_i * eps_i).sum()) / \
-                    (1 - f + (f_i * beta_i).sum())
+            # eps_h = eps[0]
+            # eps_i = eps[1:]
+            # f_i = self.abundances[1:]
+            # R = (f_i * (eps_i - eps_h) / (eps_i + 2 * eps_h)).sum(0)
+            # eps_mean = eps_h * (1 + 2 * R) / (1 - R)
             #
-            # return n and k
+            # according to Bohren & Huffman
             #
-            eps_mean = np.sqrt(eps_mean)
-            return np.array([eps_mean.real.squeeze(), eps_mean.imag.squeeze()])
+            eps_mean = _maxwell_garnett(eps, abundances)
+        #
+        # return n and k
+        #
+        eps_mean = np.sqrt(eps_mean)
+        return np.array([eps_mean.real.squeeze(), eps_mean.imag.squeeze()])
+
+    def _data_range(self):
+        """
+        Returns the wavelength range (lmin, lmax) in which all components,
+        also those of nested mixtures, are defined.
+        """
+        ranges = [c._data_range() if isinstance(c, diel_mixed) else (c._lmin, c._lmax) for c in self.constants]
+        return max(r[0] for r in ranges), min(r[1] for r in ranges)
 
-    def get_normal_object(self):
+    def get_normal_object(self, lam=None, points_per_decade=None):
         """
         By default, diel_mixed provides only the nk values, when self.nk is
         called. We can make this object behave like the other optical constants
         with this function. This will return a diel_const object.
-        """
 
-        const = self.constants
+        The mixing rule is solved once for all wavelengths of the table, and
+        the table is memoized: calling this again for a mix of the same
+        component data, abundances and rule on the same grid returns a copy
+        of the stored object without solving the mixing rule again.
 
-        lmin = np.max([c._lmin for c in const])
-        lmax = np.min([c._lmax for c in const])
-        lam = np.logspace(np.log10(lmin), np.log10(lmax), 200)
+        Keywords:
+        ---------
+
+        lam : None | array
+            wavelength grid of the table in cm. By default, 200 log-spaced
+            points in the range where all components are defined.
+
+        points_per_decade : None | float
+            if given (and `lam` is None), the default range is sampled with
+            this number of points per decade instead of 200 points
+        """
+        import copy
+        lmin, lmax = self._data_range()
+        if lam is None:
+            if points_per_decade is None:
+                n_lam = 200
+            else:
+                n_lam = max(2, int(np.ceil(points_per_decade * np.log10(lmax / lmin))) + 1)
+            lam = np.clip(np.logspace(np.log10(lmin), np.log10(lmax), n_lam), lmin, lmax)
+        lam = np.asarray(lam, dtype=float)
 
-        n = np.zeros_like(lam)
-        k = np.zeros_like(lam)
+        key = _opacity_cache_key('get_normal_object', self.constants, self.abundances, self.rule, self.extrapol, lam)
+        if key in _normal_objects:
+            _normal_objects.move_to_end(key)
+            return copy.deepcopy(_normal_objects[key])
 
-        for i, _lam in enumerate(lam):
-            n[i], k[i] = self.nk(_lam)
+        n, k = self.nk(lam)
 
         d = diel_const(lam, n, k)
         d.datafile = ''
 
-        for c in const:
-            d.datafile += c.datafile + '\n'
+        for c in self.constants:
+            d.datafile += getattr(c, 'datafile', '') + '\n'
 
         d.material_str = self.material_str
         d.extrapol = self.extrapol
 
-        return d
+        _normal_objects[key] = d
+        while len(_normal_objects) > 32:
+            _normal_objects.popitem(last=False)
+
+        return copy.deepcopy(d)
+
+
+# the tables of `diel_mixed.get_normal_object`, least recently used first
+
+_normal_objects = OrderedDict()
 
 
 def powerlaw_N_of_a(a, a_max, q, rho_s):
@@ -1773,8 +2612,249 @@ def get_size_averaged_opacity(a, lam, n, rho_s, diel_const=None, q_abs=None,
     return kappa_abs_m, kappa_sca_m
 
 
+def _mie_tile(kernel, batched, x, nk, nang, plan=None):
+    """
+    Runs the Mie calculation for one tile of `get_mie_coefficients`.
+
+    Arguments:
+    ----------
+
+    kernel : callable
+        the (batched or scalar) Mie function
+
+    batched : bool
+        whether `kernel` is a batched function, see `bhmie_batch_functions`
+
+    x, nk : arrays
+        1D arrays of size parameters and complex refractive indices
+
+    nang : int
+        number of angles between 0 and 90 degree, 0 if no scattering
+        amplitudes are needed
+
+    plan : None | bhmie_plan
+        angle grid and workspace passed on to batched kernels
+
+    Output:
+    -------
+    q_abs, q_sca, g, S1, S2 : arrays
+        the results for each entry in `x`
+    """
+    if batched:
+        S1, S2, _, Qabs, Qsca, _, gsca = kernel(x, nk, nang, plan=plan)
+        return Qabs, Qsca, gsca.real, S1, S2
+
+    q_abs = np.zeros(len(x))
+    q_sca = np.zeros(len(x))
+    g_sca = np.zeros(len(x))
+    s_1 = np.zeros([len(x), max(2 * nang - 1, 0)], dtype=complex)
+    s_2 = np.zeros([len(x), max(2 * nang - 1, 0)], dtype=complex)
+    for i in range(len(x)):
+        S1, S2, _, Qabs, Qsca, _, gsca = kernel(x[i], nk[i], max(nang, 2))
+        q_abs[i] = Qabs
+        q_sca[i] = Qsca
+        g_sca[i] = gsca.real
+        if nang > 0:
+            s_1[i, :] = S1
+            s_2[i, :] = S2
+    return q_abs, q_sca, g_sca, s_1, s_2
+
+
+def _bhcoat_tile(y, nk, nangles, plan=None, radius_ratio=1.0):
+    """
+    Batched kernel for coated grains in `get_mie_coefficients`: the core has
+    the size parameter `radius_ratio * y` and the refractive index
+    `nk[..., 0]`, the mantle the refractive index `nk[..., 1]`. Calling
+    convention as `bhcoat_fortran_batch_wrapper`.
+    """
+    return bhcoat_fortran_batch_wrapper(radius_ratio * y, y, nk[..., 0], nk[..., 1], nangles, plan=plan)
+
+
+class _OutOfCoreArray(object):
+    """
+    Array in an anonymous temporary file for the memory-bounded mode of
+    `get_mie_coefficients`. Reading and writing with integer indices (or
+    index arrays) along the first two axes, `array[ia, ilam]` or
+    `array[ia, ilam, :]`, uses `os.pread` and `os.pwrite`, one call per run
+    of consecutive elements, so they do not need any memory besides the
+    values. `array.data` is the memory map of the whole file, which is
+    returned to the user; it refers back to this object as `_out_of_core`.
+    """
+
+    def __init__(self, shape, dtype, directory=None):
+        import tempfile
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._file.truncate(max(1, int(np.prod(self.shape))) * self.dtype.itemsize)
+        self.data = np.memmap(self._file, dtype=self.dtype, mode='r+', shape=self.shape)
+        self.data._out_of_core = self
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _runs(self, key):
+        """
+        Returns the broadcast shape of the index arrays in `key`, the order
+        in which the elements are stored and the runs of consecutive elements
+        as (start, end, offset in bytes).
+        """
+        if not isinstance(key, tuple) or len(key) < 2 or any(k != slice(None) for k in key[2:]):
+            raise IndexError('only [ia, ilam] and [ia, ilam, :] are supported')
+        ia, ilam = np.broadcast_arrays(*[np.asarray(i, dtype=np.int64) for i in key[:2]])
+        flat = (ia * self.shape[1] + ilam).ravel()
+        order = np.argsort(flat, kind='stable')
+        flat = flat[order]
+        starts = np.nonzero(np.hstack((True, np.diff(flat) != 1)))[0]
+        ends = np.hstack((starts[1:], len(flat)))
+        row = int(np.prod(self.shape[2:])) * self.dtype.itemsize
+        return ia.shape, order, [(i0, i1, int(flat[i0]) * row) for i0, i1 in zip(starts, ends)]
+
+    def __getitem__(self, key):
+        shape, order, runs = self._runs(key)
+        values = np.empty((len(order),) + self.shape[2:], dtype=self.dtype)
+        for i0, i1, offset in runs:
+            chunk = os.pread(self._file.fileno(), (i1 - i0) * values[0].nbytes, offset)
+            values[order[i0:i1]] = np.frombuffer(chunk, dtype=self.dtype).reshape((i1 - i0,) + self.shape[2:])
+        return values.reshape(shape + self.shape[2:])
+
+    def __setitem__(self, key, values):
+        shape, order, runs = self._runs(key)
+        values = np.broadcast_to(np.asarray(values, dtype=self.dtype), shape + self.shape[2:])
+        values = values.reshape((len(order),) + self.shape[2:])
+        for i0, i1, offset in runs:
+            os.pwrite(self._file.fileno(), np.ascontiguousarray(values[order[i0:i1]]).tobytes(), offset)
+
+
+def _checkpoint_digest(arrays):
+    """Returns the SHA-256 hex digest of the data of all `arrays`."""
+    import hashlib
+    h = hashlib.sha256()
+    for array in arrays:
+        h.update(np.ascontiguousarray(array).tobytes())
+    return h.hexdigest()
+
+
+def _checkpoint_open(directory, key, mie_mask):
+    """
+    Opens or creates the checkpoint `directory` of `get_mie_coefficients`
+    for the calculation identified by `key`, where `mie_mask` marks the cells
+    of the Mie calculation.
+
+    Output:
+    -------
+    list of (ilam, (q_abs, q_sca, g, S1, S2)) for all columns found in the
+    directory that are complete and pass the integrity check
+    """
+    import json
+    os.makedirs(directory, exist_ok=True)
+    fname = os.path.join(directory, 'checkpoint.json')
+    if os.path.isfile(fname):
+        with open(fname) as f:
+            if json.load(f).get('key', None) != key:
+                raise ValueError('checkpoint {} belongs to a different calculation'.format(directory))
+    else:
+        with open(fname, 'w') as f:
+            json.dump({'key': key}, f)
+
+    restored = []
+    for ilam in np.nonzero(mie_mask.any(0))[0]:
+        fname = os.path.join(directory, 'column_{:05d}.npz'.format(ilam))
+        if not os.path.isfile(fname):
+            continue
+        try:
+            with np.load(fname) as data:
+                result = tuple(data[name] for name in ['q_abs', 'q_sca', 'g', 'S1', 'S2'])
+                valid = (str(data['sha256']) == _checkpoint_digest(result) and
+                         len(result[0]) == mie_mask[:, ilam].sum())
+        except Exception:
+            valid = False
+        if valid:
+            restored += [(ilam, result)]
+        else:
+            warnings.warn('checkpoint file {} is damaged and will be recalculated'.format(fname))
+    return restored
+
+
+def _checkpoint_write(directory, ilam, result):
+    """
+    Writes the results `(q_abs, q_sca, g, S1, S2)` of column `ilam` to the
+    checkpoint `directory`. The file is written under a temporary name and
+    renamed when complete.
+    """
+    fname = os.path.join(directory, 'column_{:05d}.npz'.format(ilam))
+    q_abs, q_sca, g, S1, S2 = result
+    with open(fname + '.tmp', 'wb') as f:
+        np.savez(f, q_abs=q_abs, q_sca=q_sca, g=g, S1=S1, S2=S2, sha256=_checkpoint_digest(result))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(fname + '.tmp', fname)
+
+
+def _mie_tile_adaptive(kernel, x, nk, nang, angle_tol, m_max=1.0, n_max=2048):
+    """
+    Runs the Mie calculation for the cells of one particle size of
+    `get_mie_coefficients` on the grid of `adaptive_angles` for the largest
+    size parameter in `x`. The number of angles is doubled until the integral
+    over the scattering amplitudes agrees with Q_sca within `angle_tol` on two
+    successive grids, or until it exceeds `n_max`.
+
+    Arguments:
+    ----------
+
+    kernel : callable
+        the batched Mie function
+
+    x, nk : arrays
+        1D arrays of size parameters and complex refractive indices
+
+    nang : int
+        number of angles of the first grid in each part of `adaptive_angles`
+
+    angle_tol : float
+        target relative error of the integral over Z11
+
+    Keywords:
+    ---------
+
+    m_max : float
+        the largest absolute value of the refractive index
+
+    n_max : int
+        the largest number of angles in each part of the grid
+
+    Output:
+    -------
+    q_abs, q_sca, g, S1, S2, plan
+        as in `_mie_tile`, and the plan that holds the final angle grid
+    """
+    n = nang
+    converged = False
+    while True:
+        theta, weights = adaptive_angles(x.max(), n)
+        plan = bhmie_plan(nang, x_max=x.max(), m_max=m_max, angles=theta, weights=weights)
+        result = _mie_tile(kernel, True, x, nk, nang, plan)
+        _, q_sca, _, S1, S2 = result
+        q_int = (weights * (np.abs(S1)**2 + np.abs(S2)**2)).sum(-1) / x**2
+        mask = q_sca > 0
+        error = np.abs(q_int[mask] / q_sca[mask] - 1).max(initial=0.0)
+        if error <= angle_tol and converged:
+            break
+        converged = error <= angle_tol
+        if 2 * n > n_max:
+            if error > angle_tol:
+                warnings.warn('angle grid not converged for x={:.3g}: error of {:.2g}%'.format(x.max(), error * 100))
+            break
+        n *= 2
+    return result + (plan,)
+
+
 def get_mie_coefficients(A, LAM, diel_constants, bhmie_function=bhmie_function,
-                         nang=3, extrapolate_large_grains=False):
+                         nang=3, extrapolate_large_grains=False, n_workers=1,
+                         large_x_method='mie', x_large=None, rayleigh_tol=None,
+                         efficiencies_only=False, angles='linear', angle_tol=1e-3,
+                         diel_constants_mantle=None, mantle_fraction=0.0, cache=None,
+                         checkpoint=None, memory_limit=None, scratch_dir=None):
     """
     This calculates the opacity for the given dielectric constants for all
     grain sizes and wavelength specified in LAM and A.
@@ -1793,17 +2873,107 @@ def get_mie_coefficients(A, LAM, diel_constants, bhmie_function=bhmie_function,
     Keywords:
     ---------
 
-    method : callable
+    method : callable | str
         a function that carries out the Mie calculation with this signature
         S1, S2, Qext, Qabs, Qsca, Qback, gsca = bhmie_function(x, (n, k), n_angles)
+        If a batched version of it is registered in `bhmie_batch_functions`,
+        that one is called once per tile of the (A, LAM) grid.
+        Can also be the name of a backend in `bhmie_backends`, or `'auto'`
+        for the fastest accurate one on this machine (see `bhmie_select`).
 
     nang : int
         number of angles between 0 and 90 degree. Will return S1 & S2 at
         2 * nang - 1 angles between 0 and 180 degree.
 
     extrapolate_large_grains : bool
-        default: False; if True, then extrapolate the absorption and scattering
-        coefficients for very large grains.
+        default: False; if True, this is the same as `large_x_method='geometric'`.
+        If False, very large grains are calculated exactly; the batched kernels
+        then use an engine for large size parameters whose memory grows only
+        like the square root of the number of terms, so there is no upper
+        limit on the size parameter.
+
+    large_x_method : str
+        how to calculate grains with size parameters above `x_large`:
+
+        - `'mie'`: the full Mie calculation with `bhmie_function` (default)
+        - `'geometric'`: the asymptotic solution of `bhmie_geometric`
+          (anomalous diffraction and geometric optics), see there for the
+          error bound. S1 and S2 are then only meaningful near the forward
+          direction.
+
+    x_large : None | float
+        size parameter above which `large_x_method` is used. If None, it is
+        used where the Mie series needs more than 200000 terms.
+
+    rayleigh_tol : None | float
+        if given, all cells where the estimated relative error of the small
+        particle limit (see `rayleigh_error`) is below `rayleigh_tol` are
+        calculated at once with `bhmie_rayleigh` instead of the full Mie
+        calculation. Values around 1e-4 typically leave the full calculation
+        only to grains larger than a few percent of the wavelength.
+
+    efficiencies_only : bool
+        if True, the angular part of the Mie calculation is skipped and the
+        scattering amplitudes are neither calculated nor stored, so the
+        output contains no `S1`, `S2`, `theta` and `mu_weights`. Same as
+        `nang=0`.
+
+    angles : str | array
+        the angle grid, `'linear'` (default), `'gauss'` or an array of angles
+        in degree, see `bhmie_plan`, or `'adaptive'`: every particle size gets
+        its own grid that resolves the forward peak, see `adaptive_angles`.
+        Starting with `nang` angles in both parts of that grid, the number of
+        angles is doubled until the integral over the scattering amplitudes
+        agrees with Q_sca within `angle_tol`. Grids other than `'linear'`
+        need a batched `bhmie_function`.
+
+    angle_tol : float
+        target relative error of the integral over Z11 for `'adaptive'`
+
+    diel_constants_mantle : None | object of class diel_const
+        if given, the grains are coated spheres: a core made of
+        `diel_constants` inside a mantle made of `diel_constants_mantle`.
+        `A` is then the outer radius and the efficiencies refer to its
+        cross section. This uses the compiled `bhcoat_fortran_batch_wrapper`
+        instead of `bhmie_function` and cannot be combined with
+        `large_x_method='geometric'` or `rayleigh_tol`.
+
+    mantle_fraction : float
+        volume of the mantle divided by the volume of the whole grain, the
+        core radius is `A * (1 - mantle_fraction)**(1/3)`
+
+    cache : None | bool | MieCache
+        if given, the results of the full Mie calculation are looked up in
+        and stored to this `MieCache` (`True` uses the module-wide
+        `mie_cache`), so repeated or overlapping grids only calculate the
+        new cells. Not used for `angles='adaptive'`.
+
+    checkpoint : None | str
+        if given, every finished wavelength column of the Mie calculation is
+        written to this directory. If the calculation is interrupted, calling
+        it again with the same arguments and the same directory only
+        calculates the missing columns. Each column file carries a checksum,
+        incomplete or damaged files are calculated again. A directory that
+        belongs to a different calculation raises a ValueError. Not
+        available for `angles='adaptive'`.
+
+    memory_limit : None | int
+        if given, the memory in bytes that the scattering amplitudes may
+        use. S1 and S2 are then written to temporary files (in `scratch_dir`,
+        or the default temporary directory) and returned as memory-mapped
+        arrays, and the calculation proceeds in chunks of cells that fit
+        into the limit. Only the efficiencies stay in memory. Not available
+        for `angles='adaptive'`.
+
+    scratch_dir : None | str
+        directory of the temporary files for `memory_limit`
+
+    n_workers : int
+        number of workers among which the tiles of the (A, LAM) grid are
+        distributed. Kernels in `bhmie_nogil_functions` run on threads which
+        write directly into the output arrays, all others on processes.
+        Results are identical to the serial calculation (n_workers=1, the
+        default).
 
     Output:
     -------
@@ -1819,95 +2989,365 @@ def get_mie_coefficients(A, LAM, diel_constants, bhmie_function=bhmie_function,
         assymetry factor
 
     S1, S2 : arrays
-        complex scattering amplitudes
+        complex scattering amplitudes, only if angles were calculated
+
+    mu_weights : array
+        quadrature weights in mu = cos(theta) belonging to `theta`
+
+    n_theta : array
+        only for `'adaptive'`: the number of angles of each particle size.
+        `theta` and `mu_weights` then have the shape (len(A), max(n_theta))
+        and S1, S2 the shape (len(A), len(LAM), max(n_theta)). The unused
+        entries are padded with theta = 180 degree and zero weights and
+        amplitudes, so sums over all angles need no special treatment.
     """
-    from scipy.optimize import fsolve
+    if efficiencies_only:
+        nang = 0
+    if isinstance(bhmie_function, str) and bhmie_function == 'auto':
+        bhmie_function = bhmie_select()
+    elif isinstance(bhmie_function, str):
+        if bhmie_function not in bhmie_backends:
+            raise ValueError('unknown backend {}, available: {}'.format(bhmie_function, ', '.join(bhmie_backends)))
+        bhmie_function = bhmie_backends[bhmie_function]
     #
     # feed the bhmie function
     # use the first entries
     #
+    coated = diel_constants_mantle is not None
+    if coated:
+        if 'bhcoat_fortran_batch_wrapper' not in globals():
+            raise ValueError('coated grains need the compiled mie code')
+        if extrapolate_large_grains or large_x_method != 'mie' or rayleigh_tol is not None:
+            raise ValueError('coated grains need large_x_method=\'mie\' and rayleigh_tol=None')
+        if not 0 <= mantle_fraction <= 1:
+            raise ValueError('mantle_fraction must be between 0 and 1')
     q_abs = np.zeros([len(A), len(LAM)])
     q_sca = np.zeros_like(q_abs)
     g_sca = np.zeros_like(q_abs)
-    s_1 = np.zeros([len(A), len(LAM), 2 * nang - 1], dtype=complex)
-    s_2 = np.zeros([len(A), len(LAM), 2 * nang - 1], dtype=complex)
-    NMXX = 200000  # after how many terms to use extrapolation
-    full_mask = np.zeros_like(q_abs)
+    NMXX = bhmie_nmx_large  # after how many terms to use the asymptotic solution
+    bhmie_batch = bhmie_batch_functions.get(bhmie_function, None)
+
+    if extrapolate_large_grains:
+        large_x_method = 'geometric'
+    if large_x_method not in ['mie', 'geometric']:
+        raise ValueError('large_x_method must be \'mie\' or \'geometric\'')
 
     # issue a warning for large size parameters
 
     xmax = 2. * np.pi / LAM.min() * A.max()
     xstop = xmax + 4. * xmax**.333333 + 2.0
     nmx = (xstop.max() + 15).max()
-    if nmx > 2e5 and extrapolate_large_grains is False:
+    if nmx > 2e5 and large_x_method == 'mie' and bhmie_batch is None:
         warnings.warn('large size parameter: nmx={} - this can take long'.format(nmx))
     #
-    # the wave length loop
+    # interpolate the refr. index at all wave lengths at once, for
+    # coated grains of core and mantle
     #
-    for ilam, lam in enumerate(LAM):
-        #
-        # display progress
-        #
-        progress_bar((ilam + 1.0) / len(LAM) * 100, 'Mie')
-        #
-        # interpolate the refr. index
-        #
-        n, k = diel_constants.nk(lam)
-        #
-        # define the size parameter
-        #
-        X = 2. * np.pi / lam * A
-        #
-        # define the cutoff where no convergence is reached
-        # mask is true where the calculation should converge
-        #
-        Y = X * (n + k * 1j)
-        Y = abs(Y)
-        Xstop = X + 4. * X**.333333 + 2.0
+    n, k = diel_constants.nk(LAM)
+    nk_all = np.asarray(n) + np.asarray(k) * 1j
+    if coated:
+        n_mantle, k_mantle = diel_constants_mantle.nk(LAM)
+        nk_all = np.column_stack((nk_all, np.asarray(n_mantle) + np.asarray(k_mantle) * 1j))
+    #
+    # define the size parameter
+    #
+    X_all = (2. * np.pi / LAM)[None, :] * A[:, None]
+    #
+    # calc_mask is true where the Mie calculation is done, the
+    # asymptotic solution is used for the rest (see below).
+    #
+    calc_mask = np.ones([len(A), len(LAM)], dtype=bool)
+    if large_x_method == 'geometric' and x_large is None:
+        Y = abs(X_all * nk_all[None, :])
+        Xstop = X_all + 4. * X_all**.333333 + 2.0
         nmx = np.maximum(Xstop, Y).astype(int) + 15
-        mask = nmx < NMXX
-        if extrapolate_large_grains is False:
-            mask[:] = True
-        full_mask[:, ilam] = mask
-        #
-        # cut it such that only converging terms are included
-        # and extrapolate the missing parts (see below).
-        # X_cut are the ones that should be calculated normally
-        #
-        X_cut = X[mask]
-        if len(X_cut) == 0:
-            def f(x):
-                return x + 4. * x**0.33333 + 2.0 - NMXX
-            x_max = fsolve(f, NMXX)  # /30.
-            X_cut = [x_max]
+        calc_mask = nmx < NMXX
+    elif large_x_method == 'geometric':
+        calc_mask = X_all <= x_large
+    #
+    # small grains for which the Rayleigh limit is accurate enough
+    #
+    small_mask = np.zeros_like(calc_mask)
+    if rayleigh_tol is not None:
+        small_mask = calc_mask & (rayleigh_error(X_all, nk_all[None, :]) < rayleigh_tol)
+        calc_mask = calc_mask & ~small_mask
+    #
+    # what identifies the results of the Mie calculation: the function
+    # and the angle grid
+    #
+    adaptive = isinstance(angles, str) and angles == 'adaptive' and nang > 0
+    if coated:
+        context = ('bhcoat', mantle_fraction)
+    else:
+        context = (getattr(bhmie_function, '__name__', repr(bhmie_function)),)
+    if isinstance(angles, str):
+        context += (nang, angles)
+    else:
+        context += (nang, np.asarray(angles, dtype=float).tobytes())
+    #
+    # resume from the completed columns in the checkpoint directory
+    #
+    mie_mask = calc_mask.copy()
+    done_mask = np.zeros_like(calc_mask)
+    restored = []
+    if checkpoint is not None:
+        if adaptive:
+            raise ValueError('checkpoints are not available for adaptive angle grids')
+        checkpoint_key = _opacity_cache_key('get_mie_coefficients', A, LAM, X_all, nk_all, mie_mask, context)
+        restored = _checkpoint_open(checkpoint, checkpoint_key, mie_mask)
+        for ilam, _ in restored:
+            done_mask[:, ilam] = mie_mask[:, ilam]
+        calc_mask = calc_mask & ~done_mask
+    #
+    # look up the cells of the Mie calculation in the cache
+    #
+    if cache is True:
+        cache = mie_cache
+    if cache is False or adaptive:
+        cache = None
+    cached_mask = np.zeros_like(calc_mask)
+    if cache is not None:
+        ia, ilam = np.nonzero(calc_mask)
+        cache_keys = cache.keys(context, X_all[ia, ilam], nk_all[ilam])
+        cached = cache.get(cache_keys)
+        found = np.array([result is not None for result in cached], dtype=bool)
+        cached_mask[ia[found], ilam[found]] = True
+        calc_mask = calc_mask & ~cached_mask
+        cache_keys = [key for key, hit in zip(cache_keys, found) if not hit]
+        cached = [result for result in cached if result is not None]
+    #
+    # split the grid into tiles: one wavelength column per tile in serial
+    # mode (the whole grid for the functions in `bhmie_grid_functions`),
+    # in parallel mode enough tiles to keep all workers busy. Checkpoints
+    # are written per column, so then every tile lies within one column.
+    #
+    if memory_limit is not None and adaptive:
+        raise ValueError('memory_limit is not available for adaptive angle grids')
+    if checkpoint is not None:
+        n_lam_split = len(LAM)
+        n_a_split = 1
+    elif n_workers > 1:
+        n_lam_split = min(len(LAM), 8 * n_workers)
+        n_a_split = min(len(A), int(np.ceil(8 * n_workers / n_lam_split)))
+    elif bhmie_batch in bhmie_grid_functions:
+        n_lam_split = 1
+        n_a_split = 1
+    else:
+        n_lam_split = len(LAM)
+        n_a_split = 1
+
+    if coated:
+        from functools import partial
+        kernel, batched = partial(_bhcoat_tile, radius_ratio=(1.0 - mantle_fraction)**(1. / 3.)), True
+    elif bhmie_batch is not None:
+        kernel, batched = bhmie_batch, True
+    else:
+        kernel, batched = bhmie_function, False
+    #
+    # with several workers, the kernel itself should not run in parallel
+    #
+    if n_workers > 1 and kernel is bhmie_python_parallel_wrapper:
+        kernel = bhmie_python_batch_wrapper
+    nogil = coated or kernel in bhmie_nogil_functions
+
+    m_max = np.abs(nk_all).max()
+    if adaptive:
         #
-        # loop through the sizes that converge
+        # one tile and one plan per particle size, the amplitudes are
+        # collected per size and padded to a common length at the end
         #
-        for ia, x in enumerate(X_cut):
-            S1, S2, _, Qabs, Qsca, _, gsca = bhmie_function(x, complex(n, k), nang)
-            q_abs[ia, ilam] = Qabs
-            q_sca[ia, ilam] = Qsca
-            g_sca[ia, ilam] = gsca.real
-            s_1[ia, ilam, :] = S1
-            s_2[ia, ilam, :] = S2
+        if not batched:
+            raise ValueError('angle grids other than \'linear\' need a batched bhmie_function')
+        tiles = []
+        for ia in range(len(A)):
+            ilam = np.nonzero(calc_mask[ia])[0]
+            if len(ilam) > 0:
+                tiles += [(np.full(len(ilam), ia), ilam)]
+        plans = [None] * len(A)
+        s_1 = [None] * len(A)
+        s_2 = [None] * len(A)
+        plan = None
+    else:
         #
-        # extrapolate for large grains
+        # one plan for all tiles: angles and scratch memory are set up only once
         #
-        q_abs[ia + 1:, ilam] = q_abs[ia, ilam]
-        q_sca[ia + 1:, ilam] = q_sca[ia, ilam]
+        if isinstance(angles, str) and angles == 'adaptive':
+            angles = 'linear'
+        plan = bhmie_plan(nang, x_max=X_all[calc_mask].max(initial=1.0), m_max=m_max, angles=angles)
+        if not (batched or plan.linear):
+            raise ValueError('angle grids other than \'linear\' need a batched bhmie_function')
+        if memory_limit is None:
+            s_1 = np.zeros([len(A), len(LAM), len(plan.theta)], dtype=complex)
+            s_2 = np.zeros([len(A), len(LAM), len(plan.theta)], dtype=complex)
+        else:
+            s_1 = _OutOfCoreArray([len(A), len(LAM), len(plan.theta)], complex, scratch_dir)
+            s_2 = _OutOfCoreArray([len(A), len(LAM), len(plan.theta)], complex, scratch_dir)
 
-        # Laor & Draine 1993, Eq. 8
+    #
+    # with a memory limit, the tiles are made small enough that the
+    # amplitudes of all cells of a tile (and copies of them) on the angle
+    # grid of the plan fit in
+    #
+    n_cells = len(A) * len(LAM)
+    if memory_limit is not None:
+        n_cells = max(1, int(memory_limit // (8 * 16 * len(plan.theta) + 64)))
+        n_lam_split = max(n_lam_split, min(len(LAM), int(np.ceil(len(LAM) / n_cells))))
+        n_lam_tile = int(np.ceil(len(LAM) / n_lam_split))
+        n_a_split = max(n_a_split, min(len(A), int(np.ceil(len(A) * n_lam_tile / n_cells))))
+
+    if not adaptive:
+        tiles = []
+        for ilam_block in np.array_split(np.arange(len(LAM)), n_lam_split):
+            for ia_block in np.array_split(np.arange(len(A)), n_a_split):
+                ia, ilam = np.meshgrid(ia_block, ilam_block, indexing='ij')
+                select = calc_mask[ia, ilam]
+                if select.any():
+                    tiles += [(ia[select], ilam[select])]
+
+    def task(tile):
+        ia, ilam = tile
+        if adaptive:
+            return _mie_tile_adaptive, (kernel, X_all[ia, ilam], nk_all[ilam], nang, angle_tol, m_max)
+        return _mie_tile, (kernel, batched, X_all[ia, ilam], nk_all[ilam], nang, plan)
+
+    def store(tile, result):
+        ia, ilam = tile
+        q_abs[ia, ilam], q_sca[ia, ilam], g_sca[ia, ilam] = result[:3]
+        if not adaptive:
+            s_1[ia, ilam, :], s_2[ia, ilam, :] = result[3:]
+            return
+        i = ia[0]
+        if len(result) > 5:
+            plans[i] = result[5]
+            s_1[i] = np.zeros([len(LAM), len(plans[i].theta)], dtype=complex)
+            s_2[i] = np.zeros([len(LAM), len(plans[i].theta)], dtype=complex)
+        s_1[i][ilam, :], s_2[i][ilam, :] = result[3:5]
+
+    def save(ilam):
+        ia = np.nonzero(mie_mask[:, ilam])[0]
+        _checkpoint_write(checkpoint, ilam, (q_abs[ia, ilam], q_sca[ia, ilam], g_sca[ia, ilam],
+                                             s_1[ia, ilam], s_2[ia, ilam]))
+
+    #
+    # a column goes to the checkpoint only when all tiles covering it are
+    # stored (with a memory limit, a column can be split into several tiles)
+    #
+    import threading
+    pending = np.zeros(len(LAM), dtype=int)
+    for tile in tiles:
+        pending[np.unique(tile[1])] += 1
+    pending_lock = threading.Lock()
+
+    def finish(tile, result):
+        store(tile, result)
+        if checkpoint is None:
+            return
+        columns = np.unique(tile[1])
+        with pending_lock:
+            pending[columns] -= 1
+            complete = columns[pending[columns] == 0]
+        for ilam in complete:
+            save(ilam)
+
+    def compute(tile):
+        func, args = task(tile)
+        finish(tile, func(*args))
+    #
+    # results from the checkpoint and the cache, columns that are
+    # complete without any Mie calculation go to the checkpoint
+    #
+    for ilam, result in restored:
+        ia = np.nonzero(mie_mask[:, ilam])[0]
+        store((ia, np.full(len(ia), ilam)), result)
+    if cache is not None and cached:
+        ia, ilam = np.nonzero(cached_mask)
+        store((ia, ilam), [np.array(value) for value in zip(*cached)])
+    if checkpoint is not None:
+        for ilam in np.nonzero(cached_mask.any(0) & ~calc_mask.any(0))[0]:
+            save(ilam)
+    #
+    # compute all tiles, either one after the other or on a pool of
+    # threads (if the kernel releases the GIL) or processes
+    #
+    if n_workers > 1 and nogil:
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(compute, tile) for tile in tiles]
+            for i_done, future in enumerate(as_completed(futures)):
+                progress_bar((i_done + 1.0) / len(tiles) * 100, 'Mie')
+                future.result()
+    elif n_workers > 1:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {pool.submit(func, *args): tile for tile in tiles for func, args in [task(tile)]}
+            for i_done, future in enumerate(as_completed(futures)):
+                progress_bar((i_done + 1.0) / len(tiles) * 100, 'Mie')
+                finish(futures[future], future.result())
+    else:
+        for i_done, tile in enumerate(tiles):
+            progress_bar((i_done + 1.0) / len(tiles) * 100, 'Mie')
+            compute(tile)
+    #
+    # small particle limit and asymptotic solution for large grains; with
+    # adaptive grids, these are done size by size and sizes without any
+    # Mie calculation get the grid of the first iteration
+    #
+    if adaptive:
+        for ia in range(len(A)):
+            if plans[ia] is None:
+                theta, weights = adaptive_angles(X_all[ia].max(), nang)
+                plans[ia] = bhmie_plan(nang, x_max=X_all[ia].max(), m_max=m_max, angles=theta, weights=weights)
+                s_1[ia] = np.zeros([len(LAM), len(theta)], dtype=complex)
+                s_2[ia] = np.zeros([len(LAM), len(theta)], dtype=complex)
 
-        g_sca[ia + 1:, ilam] = 0.3 * X[ia + 1:]**2 / (1 + 0.3 * X[ia + 1:]**2)  # g_sca[ia, ilam]
+    #
+    # new results to the cache
+    #
+    if cache is not None:
+        ia, ilam = np.nonzero(calc_mask)
+        cache.put(cache_keys, [(q_abs[i, j], q_sca[i, j], g_sca[i, j], s_1[i, j].copy(), s_2[i, j].copy())
+                               for i, j in zip(ia, ilam)])
+
+    for solution, mask in [(bhmie_rayleigh, small_mask), (bhmie_geometric, ~(mie_mask | small_mask))]:
+        if not mask.any():
+            continue
+        if adaptive:
+            groups = [(ia, plans[ia]) for ia in range(len(A)) if mask[ia].any()]
+        else:
+            groups = [(slice(None), plan)]
+        for ia_group, plan_group in groups:
+            group_mask = np.zeros_like(mask)
+            group_mask[ia_group] = mask[ia_group]
+            ia, ilam = np.nonzero(group_mask)
+            for chunk in np.array_split(np.arange(len(ia)), int(np.ceil(len(ia) / n_cells))):
+                cells = ia[chunk], ilam[chunk]
+                S1, S2, _, Qabs, Qsca, _, gsca = solution(X_all[cells], nk_all[cells[1]], nang, plan=plan_group)
+                store(cells, (Qabs, Qsca, gsca, S1, S2))
 
     package = {
         'q_abs': q_abs,
         'q_sca': q_sca,
         'g': g_sca,
-        'S1': s_1,
-        'S2': s_2,
-        'theta': np.linspace(0, 180., 2 * nang - 1)
     }
+    if adaptive:
+        n_theta = np.array([len(p.theta) for p in plans])
+        package['S1'] = np.zeros([len(A), len(LAM), n_theta.max()], dtype=complex)
+        package['S2'] = np.zeros([len(A), len(LAM), n_theta.max()], dtype=complex)
+        package['theta'] = np.full([len(A), n_theta.max()], 180.)
+        package['mu_weights'] = np.zeros([len(A), n_theta.max()])
+        package['n_theta'] = n_theta
+        for ia, n in enumerate(n_theta):
+            package['S1'][ia, :, :n] = s_1[ia]
+            package['S2'][ia, :, :n] = s_2[ia]
+            package['theta'][ia, :n] = plans[ia].theta
+            package['mu_weights'][ia, :n] = plans[ia].weights
+    elif nang > 0:
+        if memory_limit is not None:
+            s_1, s_2 = s_1.data, s_2.data
+        package['S1'] = s_1
+        package['S2'] = s_2
+        package['theta'] = plan.theta
+        package['mu_weights'] = plan.weights
 
     package['info'] = """Created with the disklab package by Kees Dullemond and Til Birnstiel.
     If you make use of this file or package, do cite the according paper
@@ -1917,7 +3357,7 @@ def get_mie_coefficients(A, LAM, diel_constants, bhmie_function=bhmie_function,
     return package
 
 
-def calculate_mueller_matrix(lam, m, S1, S2, theta=None, k_sca=None):
+def calculate_mueller_matrix(lam, m, S1, S2, theta=None, k_sca=None, mu_weights=None):
     """
     Calculate the Mueller matrix elements Zij given the scattering amplitudes
     S1 and S2.
@@ -1943,11 +3383,18 @@ def calculate_mueller_matrix(lam, m, S1, S2, theta=None, k_sca=None):
     scattering matrix elements is identical to the scattering opacities.
 
     theta : array
-        array of angles
+        array of angles, or an array of shape (nm, nangles) with one padded
+        angle grid per particle (see `angles='adaptive'` in
+        `get_mie_coefficients`)
 
     k_sca : array
         array of scattering opacities
 
+    mu_weights : array
+        quadrature weights in mu = cos(theta) for the integral over Z11, as
+        returned by `get_mie_coefficients`, same shape as `theta`. If not
+        given, the trapezoidal rule is used.
+
     Notes:
     ------
     The conversion factor `factor` is calculated as defined in Kees Dullemonds
@@ -1985,17 +3432,12 @@ def calculate_mueller_matrix(lam, m, S1, S2, theta=None, k_sca=None):
     error_tolerance = 0.01
     error_max = 0.0
     if theta is not None and k_sca is not None:
-        n_theta = len(theta)
-        mu = np.cos(theta * np.pi / 180.)
-        dmu = np.diff(mu)
-        for ia in range(len(m)):
-            for ilam in range(len(lam)):
-                zav = 0.5 * (zscat[ia, ilam, 1:n_theta, 0] + zscat[ia, ilam, 0:n_theta - 1, 0])
-                dum = -0.5 * zav * dmu
-                integral = dum.sum() * 4 * np.pi
-                kscat_from_z11[ia, ilam] = integral
-                err = abs(integral / k_sca[ia, ilam] - 1.0)
-                error_max = max(err, error_max)
+        if mu_weights is None:
+            mu_weights = trapezoid_weights(theta)
+        if mu_weights.ndim == 2:
+            mu_weights = mu_weights[:, None, :]
+        kscat_from_z11 = 2 * np.pi * (zscat[..., 0] * mu_weights).sum(-1)
+        error_max = np.abs(kscat_from_z11 / k_sca - 1.0).max()
 
     if error_max > error_tolerance:
         warnings.warn('Maximum error of {:.2g}%: above error tolerance'.format(error_max * 100))
@@ -2050,6 +3492,11 @@ def write_disklab_opacity(fname, opac_dict, path='.'):
             rho_s : array
                 material density of the grains
 
+            S1, S2, theta, zscat, ... : arrays
+                the angle dependent quantities are stored if present, they are
+                missing for example if the opacities were calculated with
+                `efficiencies_only=True`.
+
     Keywords:
     ---------
 
@@ -2083,6 +3530,8 @@ def write_disklab_opacity(fname, opac_dict, path='.'):
             'info',
             'rho_s',
             'theta',
+            'mu_weights',
+            'n_theta',
             'a_h',
             'k_abs_h',
             'k_sca_h',
@@ -2254,6 +3703,15 @@ def write_radmc3d_scatmat_file(index, opacity_dict, name, path='.'):
             scattering Mueller matrix elements
             size = len(a), len(lam), len(theta), 6
 
+        mu_weights : array
+            optional: quadrature weights in mu belonging to theta, used to
+            check that the integral over Z11 agrees with k_sca
+
+        n_theta : array
+            only needed for padded angle grids with one row per grain
+            species (see `angles='adaptive'` in `get_mie_coefficients`): the
+            number of angles of each species
+
     name : str
         name to be used as species name, will be part of the file name
 
@@ -2269,6 +3727,25 @@ def write_radmc3d_scatmat_file(index, opacity_dict, name, path='.'):
     """
     filename = os.path.join(path, 'dustkapscatmat_{}.inp'.format(name))
 
+    theta = opacity_dict['theta']
+    zscat = opacity_dict['zscat'][index]
+    mu_weights = opacity_dict.get('mu_weights', None)
+    if theta.ndim == 2:
+        n_theta = opacity_dict['n_theta'][index]
+        theta = theta[index, :n_theta]
+        zscat = zscat[:, :n_theta, :]
+        if mu_weights is not None:
+            mu_weights = mu_weights[index, :n_theta]
+
+    if theta[0] != 0.0 or theta[-1] != 180.0:
+        raise ValueError('RADMC-3D needs an angle grid from 0 to 180 degree')
+
+    if mu_weights is not None:
+        kscat_from_z11 = 2 * np.pi * (zscat[:, :, 0] * mu_weights).sum(-1)
+        error_max = np.abs(kscat_from_z11 / opacity_dict['k_sca'][index] - 1.0).max()
+        if error_max > 0.01:
+            warnings.warn('Maximum error of {:.2g}% in the integral over Z11'.format(error_max * 100))
+
     with open(filename, 'w') as f:
         f.write('# Opacity and scattering matrix file for ' + name + '\n')
         f.write('# Please do not forget to cite in your publications theo riginal paper of these optical constant measurements\n')
@@ -2279,7 +3756,7 @@ def write_radmc3d_scatmat_file(index, opacity_dict, name, path='.'):
         f.write('# Material density = {0:6.3f} g/cm^3\n'.format(opacity_dict["rho_s"]))
         f.write('1\n')  # Format number
         f.write('{0:d}\n'.format(opacity_dict["lam"].size))
-        f.write('{0:d}\n'.format(opacity_dict["theta"].size))
+        f.write('{0:d}\n'.format(theta.size))
         f.write('\n')
         for i in range(opacity_dict['lam'].size):
             f.write('%13.6e %13.6e %13.6e %13.6e\n' % (opacity_dict['lam'][i] * 1e4,
@@ -2287,15 +3764,15 @@ def write_radmc3d_scatmat_file(index, opacity_dict, name, path='.'):
                                                        opacity_dict['k_sca'][index, i],
                                                        opacity_dict['g'][index, i]))
         f.write('\n')
-        for j in range(opacity_dict['theta'].size):
-            f.write('%13.6e\n' % (opacity_dict['theta'][j]))
+        for j in range(theta.size):
+            f.write('%13.6e\n' % (theta[j]))
         f.write('\n')
         for ilam in range(opacity_dict['lam'].size):
-            for itheta in range(opacity_dict['theta'].size):
+            for itheta in range(theta.size):
                 f.write('%13.6e %13.6e %13.6e %13.6e %13.6e %13.6e\n' %
-                        (opacity_dict['zscat'][index, ilam, itheta, 0], opacity_dict['zscat'][index, ilam, itheta, 1],
-                         opacity_dict['zscat'][index, ilam, itheta, 2], opacity_dict['zscat'][index, ilam, itheta, 3],
-                         opacity_dict['zscat'][index, ilam, itheta, 4], opacity_dict['zscat'][index, ilam, itheta, 5]))
+                        (zscat[ilam, itheta, 0], zscat[ilam, itheta, 1],
+                         zscat[ilam, itheta, 2], zscat[ilam, itheta, 3],
+                         zscat[ilam, itheta, 4], zscat[ilam, itheta, 5]))
             f.write('\n')
 
 
@@ -2448,6 +3925,52 @@ def compare_nk(constants, lmin=1e-5, lmax=1e3, orig_data=False, ax=None, twoaxes
         return ax1
 
 
+def _dsharp_components():
+    """
+    Returns the optical constants of the four components of the DSHARP mix,
+    see `get_dsharp_mix`: water ice, astrosilicates, troilite and organics.
+    """
+    return [
+        diel_warrenbrandt08(),
+        diel_draine2003('astrosilicates'),
+        diel_henning('troilite'),
+        diel_henning('organics', refractory=True),
+    ]
+
+
+def _dsharp_fractions(fm_ice):
+    """
+    Returns the mass fractions, the mean material density and the volume
+    fractions of the DSHARP mix (see `get_dsharp_mix`) for an array of water
+    ice mass fractions. The fractions have the shape (len(fm_ice), 4).
+    """
+    fm_ice = np.asarray(fm_ice, dtype=float)
+
+    # material densities
+
+    densities = np.array([
+        0.92,
+        3.30,
+        4.83,
+        1.50])
+
+    # fm_rest is the normalized mass fractions of the rest (adding up to 1)
+
+    fm_rest = np.array([0.41127, 0.09292, 0.49581])
+    f_mass = np.column_stack((
+        fm_ice,
+        (1 - fm_ice)[:, None] * fm_rest))
+
+    # calculate the mean density, needed to get opacity in units of cm^2/g
+
+    rho_s = 1.0 / (f_mass / densities).sum(-1)
+
+    f_vol = rho_s[:, None] / densities * f_mass
+    f_vol = f_vol / f_vol.sum(-1)[:, None]
+
+    return f_mass, rho_s, f_vol
+
+
 def get_dsharp_mix(fm_ice=0.2, porosity=0.0, rule='Bruggeman'):
     """
     This method calculates the mixed mie coefficients for the DSHARP project.
@@ -2483,36 +4006,8 @@ def get_dsharp_mix(fm_ice=0.2, porosity=0.0, rule='Bruggeman'):
     rho_s : float
         the material density of the particles in g/cm**3
     """
-    # define arrays for optical constants, bulk densities, and volume fractions for each species
-
-    constants = [
-        diel_warrenbrandt08(),
-        diel_draine2003('astrosilicates'),
-        diel_henning('troilite'),
-        diel_henning('organics', refractory=True),
-    ]
-
-    # material densities
-
-    densities = np.array([
-        0.92,
-        3.30,
-        4.83,
-        1.50])
-
-    # fm_rest is the normalized mass fractions of the rest (adding up to 1)
-
-    fm_rest = np.array([0.41127, 0.09292, 0.49581])
-    f_mass = np.hstack((
-        fm_ice,
-        (1 - fm_ice) * fm_rest))
-
-    # calculate the mean density, needed to get opacity in units of cm^2/g
-
-    rho_s = 1.0 / (f_mass / densities).sum()
-
-    f_vol = rho_s / densities * f_mass
-    f_vol = f_vol / f_vol.sum()
+    constants = _dsharp_components()
+    f_mass, rho_s, f_vol = [v[0] for v in _dsharp_fractions(np.atleast_1d(fm_ice))]
 
     length = max([len(c.material_str) for c in constants])
     length = max([length, 16])
@@ -2533,6 +4028,145 @@ def get_dsharp_mix(fm_ice=0.2, porosity=0.0, rule='Bruggeman'):
     return diel_const, rho_s
 
 
+class _diel_columns(object):
+    """
+    Refractive indices given for each entry of a wavelength array, used by
+    `get_dsharp_opacities` to pass many compositions to one call of
+    `get_mie_coefficients`.
+    """
+
+    def __init__(self, lam, nk):
+        self._lam = np.asarray(lam, dtype=float)
+        self._nk = np.asarray(nk, dtype=complex)
+
+    def nk(self, lam):
+        if not np.array_equal(lam, self._lam):
+            raise ValueError('the refractive indices are only known on the given grid')
+        return self._nk.real, self._nk.imag
+
+
+def get_dsharp_opacities(a, lam, fm_ice, porosity, rule='Bruggeman', n_angle=3, n_workers=1, **kwargs):
+    """
+    Calculates the opacities of the DSHARP mix (see `get_dsharp_mix`) for
+    all combinations of water ice mass fractions and porosities.
+
+    The optical constants of the components are read only once, the mixing
+    rules are solved for all compositions and wavelengths at once, and the
+    Mie calculations of all compositions are done in a single call of
+    `get_mie_coefficients`, so that they share one pool of workers.
+
+    Arguments:
+    ----------
+
+    a : array
+        The grain size grid in cm
+
+    lam : array
+        the wavelength grid in cm
+
+    fm_ice : float | array
+        mass fractions of water ice
+
+    porosity : float | array
+        porosities (vacuum volume fractions)
+
+    Keywords:
+    ---------
+
+    rule : str
+        'Bruggeman' or 'Maxwell-Garnett', the rule to mix the four components.
+        Vacuum is always mixed in a second step with the Maxwell-Garnett rule.
+
+    n_angle : int
+        number of angles for which to calculate scattering properties
+
+    n_workers : int
+        number of parallel workers of the Mie calculation
+
+    all other keywords are passed to `get_mie_coefficients`.
+
+    Output:
+    -------
+    dictionary like in get_opacities, where `k_abs`, `k_sca`, `q_abs`,
+    `q_sca`, `g`, `S1` and `S2` have two more leading axes for `fm_ice` and
+    `porosity`, e.g. `k_abs.shape == (len(fm_ice), len(porosity), len(a), len(lam))`.
+    `rho_s` has the shape (len(fm_ice), len(porosity)). In addition:
+
+    fm_ice, porosity : arrays
+        the composition axes
+
+    nk : array
+        the complex refractive indices of the mixes, of shape
+        (len(fm_ice), len(porosity), len(lam))
+    """
+    a = np.asarray(a, dtype=float)
+    lam = np.asarray(lam, dtype=float)
+    fm_ice = np.atleast_1d(np.asarray(fm_ice, dtype=float))
+    porosity = np.atleast_1d(np.asarray(porosity, dtype=float))
+    n_fm, n_p, n_lam = len(fm_ice), len(porosity), len(lam)
+    if rule.lower() not in ['bruggeman', 'maxwell-garnett']:
+        raise NameError('Unknown mixing rule: %s' % rule)
+
+    # the dielectric constants of the components, read only once
+
+    eps = np.array([np.reshape((np.asarray(n) + np.asarray(k) * 1j)**2, n_lam)
+                    for n, k in [c.nk(lam) for c in _dsharp_components()]])
+    _, rho_s, f_vol = _dsharp_fractions(fm_ice)
+
+    # mix the components for all ice fractions at once, one block of
+    # (sorted) wavelengths per ice fraction
+
+    order = np.argsort(lam)
+    eps_all = np.tile(eps[:, order], (1, n_fm))
+    f_all = np.repeat(f_vol.T, n_lam, axis=1)
+    if rule.lower() == 'bruggeman':
+        eps_mix, _ = _bruggeman(eps_all, f_all)
+    else:
+        eps_mix = _maxwell_garnett(eps_all, f_all)
+    eps_mix = eps_mix.reshape(n_fm, n_lam)[:, np.argsort(order)]
+
+    # mix in the vacuum for all porosities
+
+    eps_por = np.zeros((n_fm, n_p, n_lam), dtype=complex)
+    for ip, p in enumerate(porosity):
+        if p > 0:
+            eps_vac = np.ones(n_fm * n_lam, dtype=complex)
+            eps_por[:, ip, :] = _maxwell_garnett(np.array([eps_vac, eps_mix.ravel()]), [p, 1 - p]).reshape(n_fm, n_lam)
+        else:
+            eps_por[:, ip, :] = eps_mix
+    nk = np.sqrt(eps_por)
+    rho_s = rho_s[:, None] * (1 - porosity)[None, :]
+
+    # the Mie calculation for all compositions at once: the compositions are
+    # stacked along the wavelength axis
+
+    lam_all = np.tile(lam, n_fm * n_p)
+    package = get_mie_coefficients(a, lam_all, _diel_columns(lam_all, nk.ravel()), nang=n_angle,
+                                   n_workers=n_workers, **kwargs)
+
+    def unstack(value):
+        value = value.reshape((len(a), n_fm, n_p, n_lam) + value.shape[2:])
+        return np.moveaxis(value, 0, 2)
+
+    for key in ['q_abs', 'q_sca', 'g', 'S1', 'S2']:
+        if key in package:
+            package[key] = unstack(package[key])
+
+    m = 4 * np.pi / 3. * rho_s[:, :, None] * a**3
+    factor = np.pi * a**2 / m
+    package['k_abs'] = package['q_abs'] * factor[..., None]
+    package['k_sca'] = package['q_sca'] * factor[..., None]
+
+    package['rho_s'] = rho_s
+    package['a'] = a
+    package['lam'] = lam
+    package['fm_ice'] = fm_ice
+    package['porosity'] = porosity
+    package['nk'] = nk
+
+    return package
+
+
 def get_ricci_mix(extrapol=False, lmax=None, rule='Bruggeman'):
     """
     This method calculates the mixed mie coefficients as in Ricci et al. 2010.
@@ -2584,9 +4218,133 @@ def get_ricci_mix(extrapol=False, lmax=None, rule='Bruggeman'):
     return diel_constants, rho_s
 
 
+def _opacity_cache_dir(disk_cache):
+    """
+    Returns the directory of the opacity cache for the `disk_cache` keyword
+    of `get_opacities`: None for None or False, the default directory below
+    `$XDG_CACHE_HOME` (or `~/.cache`) for True, otherwise `disk_cache`.
+    """
+    if disk_cache is None or disk_cache is False:
+        return None
+    if disk_cache is True:
+        cache = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        return os.path.join(cache, 'dsharp_opac', 'opacities')
+    return str(disk_cache)
+
+
+def _opacity_cache_hash(h, obj):
+    """
+    Feeds the content of `obj` into the hash `h`: arrays by their data,
+    containers element by element, functions by their name and dielectric
+    constants by their attributes (e.g. `_l`, `_n`, `_k` or the components
+    and abundances of a mix).
+    """
+    from functools import partial
+    if isinstance(obj, (np.ndarray, np.generic)):
+        obj = np.ascontiguousarray(obj)
+        h.update('{}{}'.format(obj.dtype.str, obj.shape).encode())
+        h.update(obj.tobytes())
+    elif obj is None or isinstance(obj, (bool, int, float, complex, str)):
+        h.update('{}:{!r};'.format(type(obj).__name__, obj).encode())
+    elif isinstance(obj, (list, tuple)):
+        h.update('{}['.format(len(obj)).encode())
+        for item in obj:
+            _opacity_cache_hash(h, item)
+    elif isinstance(obj, dict):
+        _opacity_cache_hash(h, sorted(obj.items(), key=lambda item: str(item[0])))
+    elif isinstance(obj, partial):
+        _opacity_cache_hash(h, [obj.func, obj.args, obj.keywords])
+    elif callable(obj) and hasattr(obj, '__name__'):
+        h.update('{}.{};'.format(getattr(obj, '__module__', ''), obj.__name__).encode())
+    elif hasattr(obj, 'nk'):
+        h.update(type(obj).__name__.encode())
+        _opacity_cache_hash(h, {key: value for key, value in vars(obj).items() if key != 'diagnostics'})
+    else:
+        h.update(repr(obj).encode())
+
+
+def _opacity_cache_key(*args):
+    """Returns the content hash of `args` and the package version."""
+    import hashlib
+    from . import __version__
+    h = hashlib.sha256()
+    _opacity_cache_hash(h, [__version__, args])
+    return h.hexdigest()
+
+
+def _opacity_cache_load(directory, key):
+    """
+    Returns the cached opacity dictionary `key` in `directory` with all
+    arrays memory-mapped (read only), or None if there is none.
+    """
+    import json
+    entry = os.path.join(directory, key)
+    try:
+        with open(os.path.join(entry, 'meta.json')) as f:
+            meta = json.load(f)
+        package = meta['values']
+        for name in meta['arrays']:
+            package[name] = np.load(os.path.join(entry, name + '.npy'), mmap_mode='r')
+        os.utime(os.path.join(entry, 'meta.json'))
+    except (OSError, ValueError, KeyError):
+        return None
+    return package
+
+
+def _opacity_cache_store(directory, key, package, max_bytes):
+    """
+    Stores the opacity dictionary `package` as entry `key` in `directory`,
+    one `.npy` file per array, and removes the least recently used entries
+    until all entries together are smaller than `max_bytes`.
+    """
+    import json
+    import shutil
+    import tempfile
+    os.makedirs(directory, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.' + key, dir=directory)
+    meta = {'arrays': [], 'values': {}}
+    for name, value in package.items():
+        if isinstance(value, np.ndarray):
+            np.save(os.path.join(tmp, name + '.npy'), value)
+            meta['arrays'] += [name]
+        else:
+            meta['values'][name] = value.item() if isinstance(value, np.generic) else value
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    try:
+        os.rename(tmp, os.path.join(directory, key))
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+    #
+    # eviction: the least recently used entries first, but never the new one
+    #
+    entries = []
+    for name in os.listdir(directory):
+        entry = os.path.join(directory, name)
+        if name.startswith('.') or not os.path.isdir(entry):
+            continue
+        try:
+            size = sum(f.stat().st_size for f in os.scandir(entry))
+            entries += [(os.stat(os.path.join(entry, 'meta.json')).st_mtime, size, name)]
+        except OSError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name != key:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+            total -= size
+
+
 def get_opacities(a, lam, rho_s, diel_const, bhmie_function=bhmie_function,
                   extrapol=False, n_angle=3,
-                  extrapolate_large_grains=False):
+                  extrapolate_large_grains=False, n_workers=1,
+                  large_x_method='mie', x_large=None, rayleigh_tol=None,
+                  efficiencies_only=False, angles='linear', angle_tol=1e-3,
+                  diel_const_mantle=None, mantle_fraction=0.0, cache=None,
+                  disk_cache=None, disk_cache_size=4 * 2**30, checkpoint=None,
+                  memory_limit=None, scratch_dir=None):
     """
     Calculates opacities according to some specified method for
     a given size- and wavelength grid.
@@ -2604,13 +4362,14 @@ def get_opacities(a, lam, rho_s, diel_const, bhmie_function=bhmie_function,
         in case other dielectric constants should be used
 
     rho_s : float
-        material density of each size [g/cm^3]
+        material density of each size [g/cm^3], for coated grains the mean
+        density of core and mantle
 
     Keywords:
     ---------
 
-    bhmie_function : callable
-        which function to use for the mie calculation
+    bhmie_function : callable | str
+        which function to use for the mie calculation, see get_mie_coefficients
 
     extrapol : bool
         whether to extrapolate *default* optical constants if lam is outside the
@@ -2622,6 +4381,52 @@ def get_opacities(a, lam, rho_s, diel_const, bhmie_function=bhmie_function,
     extrapolate_large_grains : bool
         option passed to get_mie_cofefficients, see there.
 
+    n_workers : int
+        number of parallel processes, passed to get_mie_coefficients.
+
+    large_x_method, x_large : str, None | float
+        treatment of very large grains, passed to get_mie_coefficients.
+
+    rayleigh_tol : None | float
+        tolerance of the small particle limit, passed to get_mie_coefficients.
+
+    efficiencies_only : bool
+        if True, skip the scattering amplitudes, see get_mie_coefficients.
+
+    angles, angle_tol : str | array, float
+        the angle grid and the tolerance of adaptive angle grids, passed to
+        get_mie_coefficients.
+
+    diel_const_mantle : None | dielectric constant
+        if given, the grains consist of a core made of `diel_const` and a
+        mantle made of `diel_const_mantle`, see get_mie_coefficients.
+
+    mantle_fraction : float
+        volume fraction of the mantle, see get_mie_coefficients.
+
+    cache : None | bool | MieCache
+        cache of Mie results, see get_mie_coefficients.
+
+    disk_cache : None | bool | str
+        if given, the whole result is looked up in and stored to this cache
+        directory (`True` uses `$XDG_CACHE_HOME/dsharp_opac/opacities`). The
+        entries are named by a hash of the dielectric constant data, the
+        grids, all keywords that change the result, the backend and the
+        package version. Results from the cache contain read-only
+        memory-mapped arrays.
+
+    disk_cache_size : int
+        size of the cache directory in bytes above which the least recently
+        used entries are removed
+
+    checkpoint : None | str
+        directory for checkpoints of the Mie calculation, to resume
+        interrupted runs, see get_mie_coefficients.
+
+    memory_limit, scratch_dir : None | int, None | str
+        memory budget of the scattering amplitudes and directory for their
+        temporary files, see get_mie_coefficients.
+
     Output:
     -------
     Returns a dictionary with the following entries:
@@ -2630,13 +4435,14 @@ def get_opacities(a, lam, rho_s, diel_const, bhmie_function=bhmie_function,
         absorption and scattering opacities [g/cm^2]
 
     theta : array
-        angle (in degree, 0=forward) on which angle dependent quantities are defined
+        angle (in degree, 0=forward) on which angle dependent quantities are
+        defined, not present if `efficiencies_only` is set
 
     g : array
         Henyey-Greenstein scattering asymmetry factor
 
     S1, S2 : arrays
-        the complex scattering amplitudes
+        the complex scattering amplitudes, not present if `efficiencies_only` is set
 
     rho_s : float
         material density of the grains [g/cm^3]
@@ -2648,12 +4454,29 @@ def get_opacities(a, lam, rho_s, diel_const, bhmie_function=bhmie_function,
         the wavelength grid in cm
 
     """
+    directory = _opacity_cache_dir(disk_cache)
+    if directory is not None:
+        if isinstance(bhmie_function, str) and bhmie_function == 'auto':
+            bhmie_function = bhmie_select()
+        key = _opacity_cache_key(
+            'get_opacities', np.asarray(a, dtype=float), np.asarray(lam, dtype=float), rho_s, diel_const,
+            bhmie_function, extrapol, n_angle, extrapolate_large_grains, large_x_method, x_large,
+            rayleigh_tol, efficiencies_only, angles, angle_tol, diel_const_mantle, mantle_fraction)
+        package = _opacity_cache_load(directory, key)
+        if package is not None:
+            return package
+
     m = 4 * np.pi / 3. * rho_s * a**3
 
     package = get_mie_coefficients(
         a, lam, diel_const,
         bhmie_function=bhmie_function, nang=n_angle,
-        extrapolate_large_grains=extrapolate_large_grains)
+        extrapolate_large_grains=extrapolate_large_grains,
+        n_workers=n_workers, large_x_method=large_x_method, x_large=x_large,
+        rayleigh_tol=rayleigh_tol, efficiencies_only=efficiencies_only,
+        angles=angles, angle_tol=angle_tol,
+        diel_constants_mantle=diel_const_mantle, mantle_fraction=mantle_fraction,
+        cache=cache, checkpoint=checkpoint, memory_limit=memory_limit, scratch_dir=scratch_dir)
 
     q_abs = package['q_abs']
     q_sca = package['q_sca']
@@ -2667,6 +4490,112 @@ def get_opacities(a, lam, rho_s, diel_const, bhmie_function=bhmie_function,
     package['a'] = a
     package['lam'] = lam
 
+    if directory is not None:
+        _opacity_cache_store(directory, key, package, disk_cache_size)
+
+    return package
+
+
+def _merge_grid(old, new, rtol):
+    """
+    Returns the sorted union of the grids `old` and `new`, where values that
+    agree within `rtol` are the same grid point, and a boolean mask of the
+    points of the union that are in `old`.
+    """
+    old = np.asarray(old, dtype=float)
+    grid = np.sort(np.concatenate((old, np.asarray(new, dtype=float))))
+    grid = grid[np.hstack((True, np.diff(grid) > rtol * np.abs(grid[1:])))]
+    in_old = np.zeros(len(grid), dtype=bool)
+    for value in old:
+        in_old[np.argmin(np.abs(grid - value))] = True
+    return grid, in_old
+
+
+def extend_opacities(opac, a, lam, diel_const, rho_s=None, rtol=1e-10, **kwargs):
+    """
+    Extends an existing opacity table to new particle sizes and/or wavelengths.
+    Only the cells that are not yet part of the table are calculated.
+
+    Arguments:
+    ----------
+
+    opac : dict | str
+        the existing table, as returned by `get_opacities` or written by
+        `write_disklab_opacity` (then also the file name)
+
+    a, lam : arrays
+        particle sizes and wavelengths [cm] to be added; the result has the
+        sorted union of the old and these grids
+
+    diel_const : dielectric constant
+        the dielectric constants of the existing table
+
+    Keywords:
+    ---------
+
+    rho_s : None | float
+        material density [g/cm^3], if None it is taken from `opac`
+
+    rtol : float
+        relative tolerance within which grid points are considered equal
+
+    all other keywords are passed to `get_opacities` and need to be the
+    same as for the existing table, e.g. `n_angle`.
+
+    Output:
+    -------
+    dictionary like in get_opacities with the merged grids `a` and `lam`
+    and the entries `k_abs`, `k_sca`, `g`, `q_abs`, `q_sca`, `S1`, `S2`
+    that are present both in `opac` and in the new calculation.
+    """
+    if isinstance(opac, (str, Path)):
+        opac = dict(np.load(opac))
+    if rho_s is None:
+        if 'rho_s' not in opac:
+            raise ValueError('rho_s is not part of the opacity table and needs to be given')
+        rho_s = float(np.asarray(opac['rho_s']))
+    if 'theta' in opac and np.ndim(opac['theta']) > 1:
+        raise ValueError('tables with adaptive angle grids cannot be extended')
+
+    a_all, old_a = _merge_grid(opac['a'], a, rtol)
+    lam_all, old_lam = _merge_grid(opac['lam'], lam, rtol)
+    ia_old = np.nonzero(old_a)[0]
+    ilam_old = np.nonzero(old_lam)[0]
+
+    # the new cells: new sizes at all wavelengths, old sizes at new wavelengths
+
+    blocks = []
+    if (~old_a).any():
+        blocks += [(np.nonzero(~old_a)[0], np.arange(len(lam_all)))]
+    if (~old_lam).any():
+        blocks += [(ia_old, np.nonzero(~old_lam)[0])]
+
+    results = [get_opacities(a_all[ia], lam_all[ilam], rho_s, diel_const, **kwargs) for ia, ilam in blocks]
+
+    keys = [key for key in ['k_abs', 'k_sca', 'g', 'q_abs', 'q_sca', 'S1', 'S2']
+            if key in opac and all(key in res for res in results)]
+    if results and 'theta' in opac and 'S1' in keys:
+        theta = results[0]['theta']
+        if len(theta) != len(opac['theta']) or not np.allclose(theta, opac['theta']):
+            raise ValueError('the angle grid differs from the one of the opacity table')
+
+    package = {}
+    for key in keys:
+        old = np.asarray(opac[key])
+        package[key] = np.zeros((len(a_all), len(lam_all)) + old.shape[2:], dtype=old.dtype)
+        package[key][np.ix_(ia_old, ilam_old)] = old
+        for (ia, ilam), res in zip(blocks, results):
+            package[key][np.ix_(ia, ilam)] = res[key]
+
+    for key in ['theta', 'mu_weights', 'info']:
+        if key in opac:
+            package[key] = opac[key]
+        elif results and key in results[0]:
+            package[key] = results[0][key]
+    package['rho_s'] = rho_s
+    package['a'] = a_all
+    package['lam'] = lam_all
+
     return package
 
 
@@ -2796,7 +4725,7 @@ def size_average_opacity(lam_avg, a, lam, k_abs, k_sca, q=3.5, plot=False, ax=No
     return ret
 
 
-def get_smooth_opacities(a, lam, rho_s, diel_const, smoothing='linear', **kwargs):
+def get_smooth_opacities(a, lam, rho_s, diel_const, smoothing='linear', n_workers=1, **kwargs):
     """
     Similar to `get_opacities`, but it calculates the opacities on a much finer
     grid and then averages them back on the original grid.
@@ -2821,6 +4750,12 @@ def get_smooth_opacities(a, lam, rho_s, diel_const, smoothing='linear', **kwargs
     smoothing : str
         type of smoothing, see code. Either 'linear' or 'gaussian'.
 
+    n_workers : int
+        number of parallel processes for the Mie calculation on the fine grid.
+
+    disk_cache, disk_cache_size : None | bool | str, int
+        disk cache of the smoothed result, see `get_opacities`.
+
     all other keywords are passed to the call of `get_opacities`.
 
     Returns
@@ -2866,19 +4801,37 @@ def get_smooth_opacities(a, lam, rho_s, diel_const, smoothing='linear', **kwargs
     if np.any(a_h < 0):
         raise ValueError('particle size smaller 0, please increase particle size grid resolution')
 
+    if isinstance(kwargs.get('angles', None), str) and kwargs['angles'] == 'adaptive':
+        raise ValueError('averaging the scattering amplitudes needs a common angle grid')
+
+    # look up the smoothed table in the disk cache, the fine grid itself is not cached
+
+    directory = _opacity_cache_dir(kwargs.pop('disk_cache', None))
+    disk_cache_size = kwargs.pop('disk_cache_size', 4 * 2**30)
+    if directory is not None:
+        if isinstance(kwargs.get('bhmie_function', None), str) and kwargs['bhmie_function'] == 'auto':
+            kwargs['bhmie_function'] = bhmie_select()
+        key = _opacity_cache_key(
+            'get_smooth_opacities', np.asarray(a, dtype=float), np.asarray(lam, dtype=float), rho_s,
+            diel_const, smoothing, {k: v for k, v in kwargs.items() if k not in ['cache', 'checkpoint', 'memory_limit', 'scratch_dir']})
+        res = _opacity_cache_load(directory, key)
+        if res is not None:
+            return res
+
     # calculate the high res opacities
 
-    res_h = get_opacities(a_h, lam, rho_s, diel_const, **kwargs)
+    res_h = get_opacities(a_h, lam, rho_s, diel_const, n_workers=n_workers, **kwargs)
 
     k_abs_h = res_h['k_abs']
     k_sca_h = res_h['k_sca']
     q_abs_h = res_h['q_abs']
     q_sca_h = res_h['q_sca']
     g_h = res_h['g']
-    S1_h = res_h['S1']
-    S2_h = res_h['S2']
-    theta = res_h['theta']
-    n_theta = len(theta)
+    amplitudes = 'S1' in res_h
+    if amplitudes:
+        S1_h = res_h['S1']
+        S2_h = res_h['S2']
+        n_theta = len(res_h['theta'])
 
     # create arrays to store the smoothed values
 
@@ -2887,8 +4840,19 @@ def get_smooth_opacities(a, lam, rho_s, diel_const, smoothing='linear', **kwargs
     q_sca = np.zeros((len(a), len(lam)))
     q_abs = np.zeros((len(a), len(lam)))
     g = np.zeros((len(a), len(lam)))
-    S1 = np.zeros((len(a), len(lam), n_theta), dtype=S1_h.dtype)
-    S2 = np.zeros((len(a), len(lam), n_theta), dtype=S1_h.dtype)
+    memory_limit = kwargs.get('memory_limit', None)
+    if amplitudes and memory_limit is None:
+        S1 = np.zeros((len(a), len(lam), n_theta), dtype=S1_h.dtype)
+        S2 = np.zeros((len(a), len(lam), n_theta), dtype=S1_h.dtype)
+    elif amplitudes:
+
+        # with a memory limit, the smoothed amplitudes go to temporary files
+        # and the averages are done in chunks of wavelengths
+
+        S1 = _OutOfCoreArray((len(a), len(lam), n_theta), S1_h.dtype, kwargs.get('scratch_dir', None))
+        S2 = _OutOfCoreArray((len(a), len(lam), n_theta), S1_h.dtype, kwargs.get('scratch_dir', None))
+        n_lam_chunk = max(1, int(memory_limit // (4 * n_inter * n_theta * S1_h.itemsize)))
+        lam_chunks = [np.arange(i, min(i + n_lam_chunk, len(lam))) for i in range(0, len(lam), n_lam_chunk)]
 
     # for each low-res grid point ...
 
@@ -2913,8 +4877,14 @@ def get_smooth_opacities(a, lam, rho_s, diel_const, smoothing='linear', **kwargs
         q_abs[i, :] = (w[:, None] * q_abs_h[i0:i1, :]).sum(0)
         q_sca[i, :] = (w[:, None] * q_sca_h[i0:i1, :]).sum(0)
         g[i, :] = (w[:, None] * g_h[i0:i1, :]).sum(0)
-        S1[i, :, :] = (w[:, None, None] * S1_h[i0:i1, :, :]).sum(0)
-        S2[i, :, :] = (w[:, None, None] * S2_h[i0:i1, :, :]).sum(0)
+        if amplitudes and memory_limit is None:
+            S1[i, :, :] = (w[:, None, None] * S1_h[i0:i1, :, :]).sum(0)
+            S2[i, :, :] = (w[:, None, None] * S2_h[i0:i1, :, :]).sum(0)
+        elif amplitudes:
+            rows = np.arange(i0, i1)[:, None]
+            for ilam in lam_chunks:
+                S1[i, ilam] = (w[:, None, None] * S1_h._out_of_core[rows, ilam]).sum(0)
+                S2[i, ilam] = (w[:, None, None] * S2_h._out_of_core[rows, ilam]).sum(0)
 
     # store the results in a dictionary, but keep the high-res results with new name
 
@@ -2925,8 +4895,11 @@ def get_smooth_opacities(a, lam, rho_s, diel_const, smoothing='linear', **kwargs
     res['k_abs'] = k_abs
     res['k_sca'] = k_sca
     res['g'] = g
-    res['S1'] = S1
-    res['S2'] = S2
+    if amplitudes and memory_limit is not None:
+        S1, S2 = S1.data, S2.data
+    if amplitudes:
+        res['S1'] = S1
+        res['S2'] = S2
 
     # we could use the averaged q ...
     # res['q_abs'] = q_abs
@@ -2943,7 +4916,9 @@ def get_smooth_opacities(a, lam, rho_s, diel_const, smoothing='linear', **kwargs
     res['lam'] = lam
     res['info'] = res_h['info']
     res['rho_s'] = res_h['rho_s']
-    res['theta'] = res_h['theta']
+    if amplitudes:
+        res['theta'] = res_h['theta']
+        res['mu_weights'] = res_h['mu_weights']
 
     # finally the high-res (non-averaged) results
 
@@ -2953,7 +4928,11 @@ def get_smooth_opacities(a, lam, rho_s, diel_const, smoothing='linear', **kwargs
     res['q_abs_h'] = q_abs_h
     res['q_sca_h'] = q_sca_h
     res['g_h'] = g_h
-    res['S1_h'] = S1_h
-    res['S2_h'] = S2_h
+    if amplitudes:
+        res['S1_h'] = S1_h
+        res['S2_h'] = S2_h
+
+    if directory is not None:
+        _opacity_cache_store(directory, key, res, disk_cache_size)
 
     return res
@@ -526,6 +526,10 @@ CONTAINS
     SUBROUTINE fit_function18_test(fit,a_01,a_12,a_l,a_p,a_r,a_sett,nm,xi,T,alpha,sigma_g,sigma_d,rho_s,m_grid,a_grid, &
         & m_star,R,v_frag)
       IMPLICIT NONE
+      !
+      ! release the GIL when called from python, the module only holds parameters
+      !
+      !f2py threadsafe
       INTEGER,         INTENT(in)  :: nm
       doubleprecision, INTENT(in)  :: xi,T,alpha,sigma_g,sigma_d,rho_s,m_star,R,v_frag
       doubleprecision, INTENT(in)  :: m_grid(1:nm),a_grid(1:nm)
@@ -0,0 +1,47 @@
+"""
+Regression test for resuming an interrupted Mie calculation from its
+checkpoint when the memory limit splits the wavelength columns into
+several tiles.
+"""
+import numpy as np
+import pytest
+
+from dsharp_opac import dsharp_opac as do
+
+
+class Interrupt(Exception):
+    pass
+
+
+def test_checkpoint_resume_with_memory_limit(tmp_path, monkeypatch):
+    lam_c = np.logspace(-5, 1, 50)
+    diel = do.diel_const(lam_c, 1.5 * np.ones_like(lam_c), 0.01 * np.ones_like(lam_c))
+    a = np.logspace(-4, -1, 40)
+    lam = np.logspace(-4, -2, 3)
+    #
+    # the memory limit leaves room for only a few cells per tile, so every
+    # wavelength column is split into several tiles
+    #
+    kwargs = dict(nang=180, memory_limit=200000)
+    checkpoint = str(tmp_path / 'checkpoint')
+
+    reference = do.get_mie_coefficients(a, lam, diel, nang=180)
+
+    mie_tile = do._mie_tile
+    calls = []
+
+    def interrupted_tile(*args):
+        calls.append(1)
+        if len(calls) > 1:
+            raise Interrupt
+        return mie_tile(*args)
+
+    monkeypatch.setattr(do, '_mie_tile', interrupted_tile)
+    with pytest.raises(Interrupt):
+        do.get_mie_coefficients(a, lam, diel, checkpoint=checkpoint, **kwargs)
+    monkeypatch.setattr(do, '_mie_tile', mie_tile)
+
+    resumed = do.get_mie_coefficients(a, lam, diel, checkpoint=checkpoint, **kwargs)
+
+    for key in ['q_abs', 'q_sca', 'g', 'S1', 'S2']:
+        assert np.array_equal(np.asarray(resumed[key]), reference[key]), key